@@ -21,6 +21,7 @@ from .log import log, logger
 from . import cli, config
 from .cli import get_sid
 from .engine import Running
+from .budget import parse_budget
 # from .utils import unhandled_exception_message, create_github_issue
 
 from .__version__ import __title__, __introduction__, __url__, __version__
@@ -46,6 +47,15 @@ def main():
         parser_group_scan.add_argument('-o', '--output', dest='output', action='store', default='', metavar='<output>', help='vulnerability output STREAM, FILE')
         parser_group_scan.add_argument('-r', '--rule', dest='special_rules', action='store', default=None, metavar='<rule_id>', help='specifies rules e.g: 1000, 1001')
         parser_group_scan.add_argument('-s', '--secret', dest='secret_name', action='store', default=None, metavar='<secret_name>', help='secret repair function e.g: wordpress')
+        parser_group_scan.add_argument('-e', '--engine', dest='engine', action='store', default='recursive', metavar='<engine>', choices=['recursive', 'worklist'], help='taint back-tracking engine (engines: %(choices)s)')
+        parser_group_scan.add_argument('-j', '--jobs', dest='jobs', action='store', default=1, type=int, metavar='<jobs>', help='number of processes to scan rules in parallel')
+        parser_group_scan.add_argument('-p', '--parallel', dest='parallel', action='store', default='rule', metavar='<parallel>', choices=['rule', 'file'], help='split the scan across processes by rule or by file shard (modes: %(choices)s)')
+        parser_group_scan.add_argument('--incremental', dest='incremental', action='store_true', default=False, help='only scan files changed since the last incremental scan of the target, manifests are kept in $COBRA_MANIFEST_PATH or ~/.cache/cobra/manifest')
+        parser_group_scan.add_argument('--diff', dest='diff', action='store', default=None, metavar='<base..head>', help='only scan lines changed between two commits of the local git repository')
+        parser_group_scan.add_argument('--diff-context', dest='diff_context', action='store', default=3, type=int, metavar='<lines>', help='lines around the changed lines to scan in diff mode')
+        parser_group_scan.add_argument('--candidate-budget', dest='candidate_budget', action='store', default=None, type=parse_budget, metavar='<steps:seconds>', help='analysis budget of each candidate, 0 for unlimited e.g: 20000:60')
+        parser_group_scan.add_argument('--file-budget', dest='file_budget', action='store', default=None, type=parse_budget, metavar='<steps:seconds>', help='analysis budget of the candidates in each file for each rule')
+        parser_group_scan.add_argument('--rule-budget', dest='rule_budget', action='store', default=None, type=parse_budget, metavar='<steps:seconds>', help='analysis budget of all candidates of each rule')
         parser_group_scan.add_argument('-i', '--sid', dest='sid', action='store', default=None, metavar='<sid>', help='sid for cobra-wa')
         parser_group_scan.add_argument('-l', '--log', dest='log', action='store', default=None, metavar='<log>', help='log name for cobra-wa')
         parser_group_scan.add_argument('-d', '--debug', dest='debug', action='store_true', default=False, help='open debug mode')
@@ -79,7 +89,13 @@ def main():
         }
         Running(a_sid).status(data)
 
-        cli.start(args.target, args.format, args.output, args.special_rules, a_sid, args.secret_name)
+        budgets = {}
+        for scope, budget in (('candidate', args.candidate_budget), ('file', args.file_budget), ('rule', args.rule_budget)):
+            if budget is not None:
+                budgets[scope] = budget
+
+        cli.start(args.target, args.format, args.output, args.special_rules, a_sid, args.secret_name, args.engine, args.jobs, args.parallel,
+                  args.incremental, args.diff, args.diff_context, budgets)
 
         t2 = time.time()
         logger.info('[INIT] Done! Consume Time:{ct}s'.format(ct=t2 - t1))
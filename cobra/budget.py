@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.budget
+    ~~~~~~~~~~~~
+
+    Analysis budgets per candidate, file and rule
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import time
+from prettytable import PrettyTable
+from .log import logger
+from .exceptions import BudgetExceededException
+
+budget_scopes = ('candidate', 'file', 'rule')
+
+# 预算耗尽的候选在结果中的分析结论
+budget_reason = 'Analysis budget exceeded'
+
+# worklist引擎没有递归深度限制，没有指定候选预算时使用的默认预算 (步数, 秒数)
+worklist_budget = (20000, 60)
+
+
+class Budget(object):
+    """
+    单个候选、文件或者规则的步数和时间预算，0为不限制
+    """
+
+    def __init__(self, scope, svid, name, max_steps=0, max_time=0):
+        self.scope = scope
+        self.svid = svid
+        self.name = name
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.steps = 0
+        self.start = time.time()
+        self.elapsed = 0
+        self.exceeded = False
+        self.abandoned = 0  # 因为该预算放弃分析的候选数
+
+    def check(self):
+        """
+        预算是否耗尽
+        :return:
+        """
+        if not self.exceeded:
+            self.elapsed = time.time() - self.start
+            self.exceeded = bool(self.max_steps and self.steps > self.max_steps or
+                                 self.max_time and self.elapsed > self.max_time)
+        return self.exceeded
+
+
+class AnalysisBudget(object):
+    """
+    候选、文件和规则三个范围的分析预算，回溯的每一步同时计入所有进行中的范围，
+    任一范围耗尽时放弃当前候选，文件或者规则耗尽时其余候选也不再分析
+    """
+
+    def __init__(self, budgets=None):
+        self.limits = dict((scope, (0, 0)) for scope in budget_scopes)  # 范围 -> (步数, 秒数)
+        self.limits.update(budgets or {})
+        self.budgets = {}  # 范围 -> 进行中的预算
+        self.hits = []  # 耗尽的预算
+
+    @property
+    def enabled(self):
+        return any(max_steps or max_time for max_steps, max_time in self.limits.values())
+
+    def start(self, scope, svid, name):
+        """
+        开始一个范围的分析
+        :param scope: candidate/file/rule
+        :param svid: 规则id
+        :param name: 候选、文件或者规则的名称
+        :return:
+        """
+        max_steps, max_time = self.limits[scope]
+        self.budgets[scope] = Budget(scope, svid, name, max_steps, max_time)
+
+    def stop(self, scope):
+        """
+        结束一个范围的分析
+        :param scope:
+        :return:
+        """
+        self.budgets.pop(scope, None)
+
+    def step(self):
+        """
+        回溯的一步，预算耗尽时抛出异常
+        :return:
+        """
+        for budget in self.budgets.values():
+            budget.steps += 1
+        self.check()
+
+    def check(self):
+        """
+        检查所有进行中的范围，从小到大第一个耗尽的预算随异常抛出
+        :return:
+        """
+        for scope in budget_scopes:
+            budget = self.budgets.get(scope)
+            if budget is None:
+                continue
+
+            if not budget.exceeded and budget.check():
+                logger.warning('[BUDGET] {s} budget of {n} exceeded after {st} steps ({t:.2f}s)'.format(
+                    s=scope, n=budget.name, st=budget.steps, t=budget.elapsed))
+                self.hits.append(budget)
+
+            if budget.exceeded:
+                raise BudgetExceededException(budget)
+
+    def report(self):
+        """
+        输出所有耗尽的预算，用于调整预算
+        :return:
+        """
+        if not self.hits:
+            return
+
+        table = PrettyTable(['#', 'Scope', 'CVI', 'Target', 'Steps', 'Time(s)', 'Abandoned'])
+        table.align = 'l'
+        for idx, budget in enumerate(self.hits):
+            table.add_row([idx + 1, budget.scope, budget.svid, budget.name, budget.steps,
+                           '{:.2f}'.format(budget.elapsed), budget.abandoned])
+
+        logger.warning('[SCAN] [BUDGET] {n} analysis budgets exceeded\r\n{table}'.format(n=len(self.hits),
+                                                                                          table=table))
+
+
+def parse_budget(value):
+    """
+    解析`步数:秒数`格式的预算，0为不限制
+    :param value: 如`20000:60`、`20000`、`:60`
+    :return: (步数, 秒数)
+    """
+    steps, _, seconds = value.partition(':')
+    max_steps = int(steps or 0)
+    max_time = float(seconds or 0)
+    if max_steps < 0 or max_time < 0:
+        raise ValueError(value)
+
+    return max_steps, max_time
@@ -11,22 +11,51 @@
     :license:   MIT, see LICENSE for more details.
     :copyright: Copyright (c) 2017 Feei. All rights reserved
 """
-import os
 import re
+import bisect
 import traceback
 import codecs
 from .log import logger
 from .rule import block
 from .file import File
-from .file import FileParseAll
+from .include import read_file
 from .parser import is_controllable
 from .parser import anlysis_params
+from .exceptions import BudgetExceededException
 
 
 class CAST(object):
     languages = ['php', 'java', 'sol']
 
-    def __init__(self, rule, target_directory, file_path, line, code, files=None, rule_class=None, repair_functions=[]):
+    # Parse rule
+    regex = {
+        'java': {
+            'functions': r'(?:public|protected|private|static|\s) +[\w\<\>\[\]]+\s+(\w+) *\([^\)]*\) *(?:\{?|[^;])',
+            'string': r"(?:[\"])(.*)(?:[\"])",
+            'assign_string': r"String\s{0}\s=\s\"(.*)\";",
+            'annotation': r"(\\\*|\/\/|\*)+"
+        },
+        'php': {
+            'functions': r'(?:function\s+)(\w+)\s*\(',
+            'string': r"(?:['\"])(.*)(?:[\"'])",
+            'assign_string': r"({0}\s?=\s?[\"'](.*)(?:['\"]))",
+            'annotation': r"(#|\\\*|\/\/|\*)+",
+            'variable': r'(\$[a-zA-Z_\x7f-\xff][a-zA-Z0-9_\x7f-\xff]*)',
+            # Need match
+            #    $url = $_GET['test'];
+            #    $url = $_POST['test'];
+            #    $url = $_REQUEST['test'];
+            #    $url = $_SERVER['user_agent'];
+            #    $v = trim($_GET['t']);
+            # Don't match
+            #    $url = $_SERVER
+            #    $url = $testsdf;
+            'assign_out_input': r'({0}\s?=\s?.*\$_[GET|POST|REQUEST|SERVER|COOKIE]+(?:\[))'
+        }
+    }
+
+    def __init__(self, rule, target_directory, file_path, line, code, files=None, rule_class=None, repair_functions=[],
+                 context=None, language=None):
         self.target_directory = target_directory
         self.data = []
         self.rule = rule
@@ -39,37 +68,14 @@ class CAST(object):
         self.language = None
         self.sr = rule_class
         self.repair_functions = repair_functions
-        for language in self.languages:
-            if self.file_path[-len(language):].lower() == language:
-                self.language = language
-
-        os.chdir(self.target_directory)
-        # Parse rule
-        self.regex = {
-            'java': {
-                'functions': r'(?:public|protected|private|static|\s) +[\w\<\>\[\]]+\s+(\w+) *\([^\)]*\) *(?:\{?|[^;])',
-                'string': r"(?:[\"])(.*)(?:[\"])",
-                'assign_string': r"String\s{0}\s=\s\"(.*)\";",
-                'annotation': r"(\\\*|\/\/|\*)+"
-            },
-            'php': {
-                'functions': r'(?:function\s+)(\w+)\s*\(',
-                'string': r"(?:['\"])(.*)(?:[\"'])",
-                'assign_string': r"({0}\s?=\s?[\"'](.*)(?:['\"]))",
-                'annotation': r"(#|\\\*|\/\/|\*)+",
-                'variable': r'(\$[a-zA-Z_\x7f-\xff][a-zA-Z0-9_\x7f-\xff]*)',
-                # Need match
-                #    $url = $_GET['test'];
-                #    $url = $_POST['test'];
-                #    $url = $_REQUEST['test'];
-                #    $url = $_SERVER['user_agent'];
-                #    $v = trim($_GET['t']);
-                # Don't match
-                #    $url = $_SERVER
-                #    $url = $testsdf;
-                'assign_out_input': r'({0}\s?=\s?.*\$_[GET|POST|REQUEST|SERVER|COOKIE]+(?:\[))'
-            }
-        }
+        self.context = context
+        if language is not None:
+            self.language = language
+        else:
+            for language in self.languages:
+                if self.file_path[-len(language):].lower() == language:
+                    self.language = language
+
         logger.debug("[AST] [LANGUAGE] {language}".format(language=self.language))
 
     def functions(self):
@@ -77,59 +83,60 @@ class CAST(object):
         get all functions in this file
         :return:
         """
-        # grep = Tool().grep
         if self.language not in self.regex:
             logger.info("[AST] Undefined language's functions regex {0}".format(self.language))
             return False
-        regex_functions = self.regex[self.language]['functions']
-        f = FileParseAll(self.files, self.target_directory)
-        result = f.grep(regex_functions)
-        try:
-            result = result.decode('utf-8')
-        except AttributeError as e:
-            pass
-        if len(result):
-            functions = {}
-            lines = result
-            prev_function_name = ''
-            for index, line in enumerate(lines):
-                if line == ():
-                    logger.info('[AST] Empty')
-                    continue
 
-                if len(line) < 2:
-                    logger.info("[AST] Not found(:)")
+        index = self.function_index()
+        if not index.functions:
+            return False
 
-                regex_annotation = self.regex[self.language]['annotation']
-                string = re.findall(regex_annotation, line[1])
-                if len(string) >= 1 and string[0] != '':
-                    logger.info("[AST] This function is annotation")
-
-                function_name = re.findall(regex_functions, line[2])
-                if len(function_name) >= 1:
-                    if len(function_name) == 2:
-                        if function_name[0] != '':
-                            function_name = function_name[0]
-                        elif function_name[1] != '':
-                            function_name = function_name[1]
-                    else:
-                        function_name = function_name[0]
-                    if index > 0 and prev_function_name in functions:
-                        functions[prev_function_name]['end'] = line[1]
-                    prev_function_name = function_name
-                    functions[function_name] = {
-                        'start': line[1],
-                        'end': None  # next function's start
-                    }
-                else:
-                    logger.warning("[AST] Can't get function name: {0}".format(line))
-            end = sum(1 for l in open(self.file_path))
-            for name, value in functions.items():
-                if value['end'] is None:
-                    functions[name]['end'] = end
-            return functions
+        functions = {}
+        for name, start, end in index.functions:
+            functions[name] = {
+                'start': start,
+                'end': end
+            }
+        return functions
+
+    def function_index(self):
+        """
+        get function boundaries of this file, cached in the include graph of this scan
+        :return: FunctionIndex
+        """
+        include_graph = self.context.include_graph if self.context is not None else None
+        if include_graph is not None and self.file_path in include_graph.function_indexes:
+            return include_graph.function_indexes[self.file_path]
+
+        stream = include_graph.tokens(self.file_path) if include_graph is not None else None
+        if stream is not None:
+            code_content = stream.code_content
         else:
-            return False
+            code_content = read_file(self.file_path) or ''
+
+        if self.language == 'php' and stream is not None and stream.error is None:
+            index = FunctionIndex(stream.functions(), code_content)
+        else:
+            index = FunctionIndex(regex_functions(self.regex[self.language]['functions'], code_content), code_content)
+
+        if include_graph is not None:
+            include_graph.function_indexes[self.file_path] = index
+        return index
+
+    def variables(self, code):
+        """
+        get variables in code
+        :param code: code in this line
+        :return:
+        """
+        if self.language == 'php' and self.context is not None and self.context.include_graph is not None:
+            stream = self.context.include_graph.tokens(self.file_path)
+            if stream is not None and self.line:
+                variables = stream.variables(self.line, code)
+                if variables is not None:
+                    return variables
+
+        return re.findall(self.regex[self.language]['variable'], code)
 
     def block_code(self, block_position):
         """
@@ -153,33 +160,35 @@ class CAST(object):
         else:
             block_start = 1
             block_end = 0
-            functions = self.functions()
-            if functions:
-                for function_name, function_value in functions.items():
-                    if int(function_value['start']) < int(self.line) < int(function_value['end']):
-                        in_this_function = '<---- {0}'.format(self.line)
-                        if block_position == 0:
-                            block_start = function_value['start']
-                            block_end = int(self.line) - 1
-                        elif block_position == 1:
-                            block_start = int(self.line)
-                            block_end = int(function_value['end']) - 1
-                        elif block_position == 3:
-                            block_start = function_value['start']
-                            block_end = function_value['end']
-                        logger.debug(
-                            "[AST] [FUNCTION] {0} ({1} - {2}) {3}".format(function_name, function_value['start'],
-                                                                          function_value['end'], in_this_function))
+            index = self.function_index() if self.language in self.regex else None
+            if index is not None and index.functions:
+                function = index.function_at(int(self.line))
+                if function is not None:
+                    function_name, function_start, function_end = function
+                    in_this_function = '<---- {0}'.format(self.line)
+                    if block_position == 0:
+                        block_start = function_start
+                        block_end = int(self.line) - 1
+                    elif block_position == 1:
+                        block_start = int(self.line)
+                        block_end = function_end - 1
+                    elif block_position == 3:
+                        block_start = function_start
+                        block_end = function_end
+                    logger.debug(
+                        "[AST] [FUNCTION] {0} ({1} - {2}) {3}".format(function_name, function_start, function_end,
+                                                                      in_this_function))
             else:
+                lines = index.lines if index is not None else sum(1 for l in open(self.file_path))
                 if block_position == 0:
                     block_start = 1
                     block_end = int(self.line) - 1
                 elif block_position == 1:
                     block_start = int(self.line) + 1
-                    block_end = sum(1 for l in open(self.file_path))
+                    block_end = lines
                 elif block_position == 3:
                     block_start = 1
-                    block_end = sum(1 for l in open(self.file_path))
+                    block_end = lines
                 logger.debug("[AST] Not function anything `function`, will split file")
             # get param block code
             line_rule = "{0},{1}p".format(block_start, block_end)
@@ -209,7 +218,7 @@ class CAST(object):
                 regex_string = self.regex[self.language]['string']
                 string = re.findall(regex_string, param_name)
                 if len(string) >= 1 and string[0] != '':
-                    regex_get_variable_result = re.findall(self.regex[self.language]['variable'], param_name)
+                    regex_get_variable_result = self.variables(param_name)
                     len_regex_get_variable_result = len(regex_get_variable_result)
                     if len_regex_get_variable_result >= 1:
                         # TODO
@@ -229,8 +238,12 @@ class CAST(object):
 
                     # Get assign code block
                     # param_block_code = self.block_code(0)
-                    fi = codecs.open(self.file_path, "r", encoding='utf-8', errors='ignore')
-                    param_content = fi.read()
+                    if self.context is not None:
+                        # 同一个文件的内容只读取一次
+                        param_content = self.context.include_graph.read(self.file_path)
+                    else:
+                        fi = codecs.open(self.file_path, "r", encoding='utf-8', errors='ignore')
+                        param_content = fi.read()
 
                     if param_content is False:
                         logger.debug("[AST] Can't get assign code block")
@@ -238,7 +251,9 @@ class CAST(object):
 
                     logger.debug("[Deep AST] Start AST for param {param_name}".format(param_name=param_name))
 
-                    _is_co, _cp, expr_lineno = anlysis_params(param_name, param_content, self.file_path, self.line, self.sr.vul_function, self.repair_functions)
+                    _is_co, _cp, expr_lineno = anlysis_params(param_name, param_content, self.file_path, self.line,
+                                                              self.sr.vul_function, self.repair_functions,
+                                                              context=self.context)
 
                     if _is_co == 1:
                         logger.debug("[AST] Is assign string: `Yes`")
@@ -282,7 +297,7 @@ class CAST(object):
                     continue
                     # return False, self.data
 
-            except KeyboardInterrupt as e:
+            except (KeyboardInterrupt, BudgetExceededException):
                 raise
 
             except:
@@ -316,3 +331,60 @@ class CAST(object):
             return True, self.data
         else:
             return False, self.data
+
+
+class FunctionIndex(object):
+    """
+    单个文件中函数的起止行号，按起始行号排列，二分查找行号所在的函数
+    """
+
+    def __init__(self, functions, code_content):
+        self.functions = sorted(functions, key=lambda function: function[1])  # [(函数名, 起始行号, 结束行号)]
+        self.starts = [function[1] for function in self.functions]
+        self.lines = line_count(code_content)
+
+    def function_at(self, lineno):
+        """
+        行号所在的最内层函数
+        :param lineno:
+        :return: (函数名, 起始行号, 结束行号)，不在函数中时返回None
+        """
+        index = bisect.bisect_left(self.starts, lineno)
+        while index > 0:
+            index -= 1
+            name, start, end = self.functions[index]
+            if start < lineno < end:
+                return self.functions[index]
+
+        return None
+
+
+def regex_functions(regex, code_content):
+    """
+    用正则匹配函数定义，函数在下一个函数开始的位置结束
+    :param regex:
+    :param code_content:
+    :return: [(函数名, 起始行号, 结束行号)]
+    """
+    starts = []
+    for lineno, line in enumerate(code_content.split('\n'), 1):
+        for name in re.findall(regex, line):
+            if name:
+                starts.append((name, lineno))
+                break
+
+    lines = line_count(code_content)
+    functions = []
+    for i, (name, start) in enumerate(starts):
+        end = starts[i + 1][1] if i + 1 < len(starts) else lines
+        functions.append((name, start, end))
+    return functions
+
+
+def line_count(code_content):
+    """
+    代码的行数
+    :param code_content:
+    :return:
+    """
+    return code_content.count('\n') + (1 if code_content and not code_content.endswith('\n') else 0)
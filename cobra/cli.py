@@ -18,6 +18,7 @@ from .exceptions import PickupException
 from .export import write_to_file
 from .log import logger
 from .file import Directory
+from .diff import GitDiff
 from .utils import ParseArgs
 from .utils import md5, random_generator
 
@@ -35,10 +36,18 @@ def get_sid(target, is_a_sid=False):
     return sid.lower()
 
 
-def start(target, formatter, output, special_rules, a_sid=None, secret_name=None):
+def start(target, formatter, output, special_rules, a_sid=None, secret_name=None, engine='recursive', jobs=1,
+          parallel='rule', incremental=False, diff=None, diff_context=3, budgets=None):
     """
     Start CLI
     :param secret_id: secret id or name?
+    :param engine: taint back-tracking engine
+    :param jobs: number of processes to scan rules in parallel
+    :param parallel: split the scan by rule or by file across the processes
+    :param incremental: reuse the results of unchanged files from the last incremental scan
+    :param diff: only scan the lines changed between two commits of the target repository, BASE..HEAD
+    :param diff_context: number of lines around the changed lines to scan as well
+    :param budgets: analysis budgets per candidate, file and rule, {scope: (steps, seconds)}
     :param target: File, FOLDER, GIT
     :param formatter:
     :param output:
@@ -81,13 +90,18 @@ def start(target, formatter, output, special_rules, a_sid=None, secret_name=None
                                                                                            ec=len(files),
                                                                                            tc=time_consume))
 
+        git_diff = None
+        if diff:
+            git_diff = GitDiff(target_directory, diff, diff_context).load()
+
         if pa.special_rules is not None:
             logger.info('[CLI] [SPECIAL-RULE] only scan used by {r}'.format(r=','.join(pa.special_rules)))
 
         # scan
         scan(target_directory=target_directory, a_sid=a_sid, s_sid=s_sid, special_rules=pa.special_rules,
              language=main_language, framework=main_framework, file_count=file_count, extension_count=len(files),
-             files=files, secret_name=secret_name)
+             files=files, secret_name=secret_name, engine=engine, jobs=jobs,
+             parallel=parallel, incremental=incremental, diff=git_diff, budgets=budgets)
     except KeyboardInterrupt as e:
         logger.critical("[!] KeyboardInterrupt, exit...")
         exit()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.compact
+    ~~~~~~~~~~~~~
+
+    Compact copies of phply AST nodes kept in the include graph cache
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from phply import phpast as php
+
+# phply节点类 -> 紧凑节点类
+compact_classes = {}
+
+
+class CompactNode(object):
+    """
+    紧凑节点类的公共基类，紧凑节点类继承对应的phply节点类，分析代码的isinstance判断不受影响
+    字段保存在__slots__中，但phply的Node基类没有__slots__，实例仍然带有__dict__，
+    比phply节点节省的内存有限，测试文件上约15%-30%
+    """
+    __slots__ = ()
+    kind = None  # 对应的phply节点类
+
+    def __eq__(self, other):
+        if not isinstance(other, self.kind):
+            return False
+        for field in self.fields:
+            if not (getattr(self, field) == getattr(other, field)):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+
+def compact_class(kind):
+    """
+    获取phply节点类对应的紧凑节点类
+    :param kind:
+    :return:
+    """
+    if kind not in compact_classes:
+        attrs = {
+            '__slots__': ('lineno',) + tuple(kind.fields),
+            'kind': kind,
+        }
+        compact_classes[kind] = type(kind.__name__, (CompactNode, kind), attrs)
+
+    return compact_classes[kind]
+
+
+def compact(value):
+    """
+    将phply语法树转换为紧凑表示，列表和元组保持原来的类型，分析代码可以直接使用
+    :param value: 节点、节点列表或者普通值
+    :return:
+    """
+    if isinstance(value, CompactNode):
+        return value
+
+    if isinstance(value, php.Node):
+        node_class = compact_class(value.__class__)
+        node = node_class.__new__(node_class)
+        node.lineno = value.lineno
+        for field in value.fields:
+            setattr(node, field, compact(getattr(value, field)))
+        return node
+
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+
+    if isinstance(value, tuple):
+        return tuple(compact(item) for item in value)
+
+    return value
+
+
+def expand(value):
+    """
+    将紧凑表示还原为phply语法树，列表和元组保持原来的类型
+    :param value:
+    :return:
+    """
+    if isinstance(value, CompactNode):
+        return value.kind(*[expand(getattr(value, field)) for field in value.fields], lineno=value.lineno)
+
+    if isinstance(value, list):
+        return [expand(item) for item in value]
+
+    if isinstance(value, tuple):
+        return tuple(expand(item) for item in value)
+
+    return value
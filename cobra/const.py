@@ -41,3 +41,21 @@ fpc_multi = '(?:[f]){fpc}'.format(fpc=fpc)
 # Hallo $var. blabla $var, $iam a var $varvarvar gfg djf jdfgjh fd $variable $_GET['req']
 #
 fav = '\$([a-zA-Z_\x7f-\xff][a-zA-Z0-9_\x7f-\xff]*)'
+
+#
+# User controllable params
+#
+controlled_params = [
+    '$_GET',
+    '$_POST',
+    '$_REQUEST',
+    '$_COOKIE',
+    '$_FILES',
+    # '$_SERVER', # 暂时去掉了，误报率太高了
+    '$HTTP_POST_FILES',
+    '$HTTP_COOKIE_VARS',
+    '$HTTP_REQUEST_VARS',
+    '$HTTP_POST_VARS',
+    '$HTTP_RAW_POST_DATA',
+    '$HTTP_GET_VARS'
+]
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.diff
+    ~~~~~~~~~~
+
+    Limit a scan to the files changed in a git diff
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import os
+import re
+import subprocess
+from .log import logger
+from .exceptions import PickupGitException
+
+hunk_regex = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+
+class GitDiff(object):
+    """
+    本地git仓库两次提交之间修改的文件和行，只匹配修改行附近的候选漏洞，
+    include和函数调用仍然在完整的项目中查找
+    """
+
+    def __init__(self, target_directory, revisions, context=3):
+        self.target_directory = target_directory
+        self.revisions = revisions  # BASE..HEAD，只有BASE时与工作区比较
+        self.context = context  # 修改行前后同样匹配的行数
+        self.hunks = {}  # 文件绝对路径 -> [(起始行号, 结束行号)]，修改后的行号
+        self.lines = {}  # 文件绝对路径 -> 修改行以及上下文的行号
+
+    def git(self, *args):
+        """
+        在扫描目录中执行git命令
+        :param args:
+        :return: 命令输出
+        """
+        command = ['git', '-C', self.target_directory] + list(args)
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise PickupGitException('git not found: {}'.format(e))
+
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise PickupGitException('{c} failed: {e}'.format(c=' '.join(command),
+                                                              e=err.decode('utf-8', 'replace').strip()))
+        return out.decode('utf-8', 'replace')
+
+    def load(self):
+        """
+        读取修改的文件和行
+        :return:
+        """
+        self.check_head()
+        output = self.git('-c', 'core.quotePath=false', 'diff', '--no-color', '--no-ext-diff', '--relative',
+                          '--src-prefix=a/', '--dst-prefix=b/', '-U0', self.revisions, '--')
+        self.parse(output)
+
+        for file_path, hunks in self.hunks.items():
+            lines = set()
+            for start, end in hunks:
+                lines.update(range(max(1, start - self.context), end + self.context + 1))
+            self.lines[file_path] = lines
+
+        logger.info('[DIFF] {r}: {f} files, {h} hunks changed'.format(r=self.revisions, f=len(self.hunks),
+                                                                        h=sum(len(h) for h in self.hunks.values())))
+        return self
+
+    def check_head(self):
+        """
+        候选漏洞的行号来自工作区，工作区不是HEAD时修改行的行号可能不对应
+        :return:
+        """
+        if '..' not in self.revisions:
+            return
+
+        head = self.revisions.split('..')[-1].lstrip('.') or 'HEAD'
+        expected = self.git('rev-parse', '--verify', head + '^{commit}').strip()
+        current = self.git('rev-parse', '--verify', 'HEAD^{commit}').strip()
+        if expected != current:
+            logger.warning('[DIFF] working tree is at {c}, not {h}, changed lines may not match'.format(
+                c=current[:8], h=head))
+
+    def parse(self, output):
+        """
+        解析`git diff -U0`的输出，只删除代码的位置标记删除位置前后的两行
+        :param output:
+        :return:
+        """
+        file_path = None
+        header = False
+        for line in output.splitlines():
+            if line.startswith('diff --git '):
+                file_path = None
+                header = True
+            elif header and line.startswith('+++ '):
+                path = line[4:].rstrip('\t')
+                if path.startswith('"') and path.endswith('"'):
+                    path = path[1:-1]
+                if path == '/dev/null':
+                    file_path = None
+                else:
+                    file_path = os.path.normpath(os.path.join(self.target_directory, path[2:]))
+            elif line.startswith('@@'):
+                header = False
+                match = hunk_regex.match(line)
+                if file_path is None or match is None:
+                    continue
+
+                start = int(match.group(1))
+                count = int(match.group(2)) if match.group(2) is not None else 1
+                if count == 0:
+                    hunk = (max(1, start), start + 1)
+                else:
+                    hunk = (start, start + count - 1)
+                self.hunks.setdefault(file_path, []).append(hunk)
+
+    def changed_files(self, files):
+        """
+        文件列表中修改过的文件
+        :param files: [(扩展名, {'count': 数量, 'list': [相对路径]})]
+        :return: 修改过的相对路径
+        """
+        changed = set()
+        for ext, info in files or []:
+            for ffile in info['list']:
+                if os.path.normpath(self.target_directory + ffile) in self.lines:
+                    changed.add(ffile)
+        return changed
+
+    def contains(self, file_path, line_number):
+        """
+        候选漏洞是否在修改行附近
+        :param file_path:
+        :param line_number:
+        :return:
+        """
+        try:
+            line_number = int(line_number)
+        except (TypeError, ValueError):
+            return False
+
+        return line_number in self.lines.get(os.path.normpath(file_path.strip()), ())
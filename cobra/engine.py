@@ -16,7 +16,9 @@ import re
 import json
 import portalocker
 import traceback
-import codecs
+import copy
+import multiprocessing
+from collections import OrderedDict
 from . import const
 from .rule import Rule
 from .utils import Tool
@@ -25,7 +27,13 @@ from .config import running_path
 from .result import VulnerabilityResult
 from .cast import CAST
 from .parser import scan_parser
-from .file import FileParseAll
+from .parser import AnalysisContext
+from .include import IncludeGraph
+from .prune import SourcePruner
+from .budget import AnalysisBudget, budget_reason, worklist_budget
+from .exceptions import BudgetExceededException
+from .file import FileParseAll, file_grep, split_file_list, filter_file_list
+from .manifest import Manifest, fingerprint, rule_fingerprint
 from rules.autorule import autorule
 from prettytable import PrettyTable
 from phply import phpast as php
@@ -139,19 +147,176 @@ def score2level(score):
         return '{l}-{s}: {ast}'.format(l=level[:1], s=score_full, ast=a)
 
 
-def scan_single(target_directory, single_rule, files=None, secret_name=None):
+class ScanContext(object):
+    """
+    单次扫描共用的扫描状态，扫描开始时生成一次，所有规则和候选共用
+    修复函数、文件语言等不随候选变化的数据每次扫描只计算一次
+    """
+
+    def __init__(self, target_directory, files=None, secret_name=None, engine='recursive', incremental=False,
+                 diff=None, budgets=None):
+        self.target_directory = target_directory
+        self.files = files
+        self.secret_name = secret_name
+        self.engine = engine  # 回溯引擎 recursive/worklist
+        self.include_graph = IncludeGraph(target_directory, files)  # include关系图、token流和语法树
+        self.memos = {}  # 函数体回溯的备忘缓存
+        self.pruner = SourcePruner(self.include_graph)
+        self.expanded = {}  # 已经展开的新规则及结果
+        self.expanding = []  # 正在展开的新规则，按调用链排列
+        self.incomplete = set()  # 因为递归或者深度限制没有完整展开的新规则，不保存结果
+        self.repair_dict = repair_rules(secret_name)  # 修复函数 -> 规则id列表
+        self.repairs = {}  # 规则id -> 修复函数
+        self.languages = {}  # 文件 -> CAST支持的语言
+        self.incremental = incremental  # 增量扫描，记录每个文件的候选分析时读取的文件
+        self.diff = diff  # git diff扫描时修改的行，只分析修改行附近的候选
+        if engine == 'worklist' and not (budgets or {}).get('candidate'):
+            budgets = dict(budgets or {}, candidate=worklist_budget)
+        self.budget = AnalysisBudget(budgets)  # 候选、文件和规则的分析预算
+
+    def repair_functions(self, svid):
+        """
+        规则对应的修复函数
+        :param svid:
+        :return: 修复函数的元组
+        """
+        if svid not in self.repairs:
+            self.repairs[svid] = tuple(key for key in self.repair_dict if svid in self.repair_dict[key])
+
+        return self.repairs[svid]
+
+    def language(self, file_path):
+        """
+        文件对应的CAST语言
+        :param file_path:
+        :return: 不支持的语言返回None
+        """
+        if file_path not in self.languages:
+            self.languages[file_path] = None
+            for language in CAST.languages:
+                if file_path[-len(language):].lower() == language:
+                    self.languages[file_path] = language
+
+        return self.languages[file_path]
+
+    def analysis_context(self, svid):
+        """
+        生成单个候选的分析上下文
+        :param svid:
+        :return:
+        """
+        budget = self.budget if self.budget.enabled else None
+        return AnalysisContext(self.repair_functions(svid), self.include_graph, self.engine, self.memos, budget)
+
+
+def repair_rules(secret_name=None):
+    """
+    读取修复函数规则，secret_name中的规则覆盖默认规则
+    :param secret_name:
+    :return: {修复函数: [规则id]}
+    """
+    a = __import__('rules.secret.demo', fromlist=['IS_REPAIR_DEFAULT'])
+    repair_dict = getattr(a, 'IS_REPAIR_DEFAULT')
+
+    if secret_name is not None:
+        try:
+            a = __import__('rules.secret.' + secret_name, fromlist=[secret_name])
+            a = getattr(a, secret_name)
+            repair_dict = repair_dict.copy()
+            repair_dict.update(a.items())
+        except ImportError:
+            logger.warning('[AST][INIT] Secret_name init error... No nodule named {}'.format(secret_name))
+
+    return repair_dict
+
+
+def scan_single(target_directory, single_rule, files=None, secret_name=None, scan_context=None, shard=None):
     try:
-        return SingleRule(target_directory, single_rule, files, secret_name).process()
+        return SingleRule(target_directory, single_rule, files, secret_name, scan_context=scan_context,
+                          shard=shard).process()
     except Exception:
         raise
 
 
+# 并行扫描时worker进程中的扫描状态，每个进程只初始化一次
+worker_state = {}
+
+
+def init_worker(target_directory, language, special_rules, files, secret_name, engine, incremental=False, diff=None,
+                budgets=None):
+    """
+    初始化worker进程，加载规则并生成进程内共享的include关系图、函数摘要等扫描状态
+    :param target_directory:
+    :param language:
+    :param special_rules:
+    :param files:
+    :param secret_name:
+    :param engine:
+    :param incremental:
+    :param diff:
+    :param budgets:
+    :return:
+    """
+    scan_context = ScanContext(target_directory, files, secret_name, engine, incremental, diff, budgets)
+    scan_context.include_graph.parser()
+
+    worker_state.update({
+        'rules': Rule(language).rules(special_rules),
+        'scan_context': scan_context,
+    })
+
+
+def scan_worker(task):
+    """
+    在worker进程中扫描单个规则
+    :param task: (规则名, 需要匹配的文件列表，为空时匹配所有文件)
+    :return: (漏洞列表, 增量扫描时每个文件的分析结果, 检查的候选数, 跳过语法分析的候选数, 耗尽的预算)
+    """
+    single_rule, shard = task
+    scan_context = worker_state['scan_context']
+    pruner = scan_context.pruner
+    checked, skipped, hits = pruner.checked, pruner.skipped, len(scan_context.budget.hits)
+
+    rule = getattr(worker_state['rules'][single_rule], single_rule)()
+    sr = SingleRule(scan_context.target_directory, rule, scan_context.files, scan_context.secret_name,
+                    scan_context=scan_context, shard=shard)
+    result = sr.process()
+
+    return result, sr.origins, pruner.checked - checked, pruner.skipped - skipped, scan_context.budget.hits[hits:]
+
+
+def scan_shard(task):
+    """
+    在worker进程中用所有规则扫描一部分文件，include和NewCore仍然使用完整的文件列表
+    :param task: (规则名列表, 切分后的文件列表)
+    :return: ({规则名: 漏洞列表}, 检查的候选数, 跳过语法分析的候选数, 耗尽的预算)
+    """
+    scan_rules, shard = task
+    scan_context = worker_state['scan_context']
+    pruner = scan_context.pruner
+    checked, skipped, hits = pruner.checked, pruner.skipped, len(scan_context.budget.hits)
+
+    results = {}
+    for single_rule in scan_rules:
+        rule = getattr(worker_state['rules'][single_rule], single_rule)()
+        results[single_rule] = scan_single(scan_context.target_directory, rule, scan_context.files,
+                                           scan_context.secret_name, scan_context=scan_context, shard=shard)
+
+    return results, pruner.checked - checked, pruner.skipped - skipped, scan_context.budget.hits[hits:]
+
+
 def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=None, framework=None, file_count=0,
-         extension_count=0, files=None, secret_name=None):
+         extension_count=0, files=None, secret_name=None, engine='recursive', jobs=1, parallel='rule',
+         incremental=False, diff=None, budgets=None):
     r = Rule(language)
     vulnerabilities = r.vulnerabilities
     rules = r.rules(special_rules)
     find_vulnerabilities = []
+    scan_context = ScanContext(target_directory, files, secret_name, engine, incremental, diff, budgets)
+    pruner = scan_context.pruner
+    budget = scan_context.budget
+    manifest = None
+    grep_list = files
 
     def store(result):
         if result is not None and isinstance(result, list) is True:
@@ -166,6 +331,38 @@ def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=
         return False
     logger.info('[PUSH] {rc} Rules'.format(rc=len(rules)))
     push_rules = []
+    scan_rules = []
+    svids = {}
+
+    if diff is not None:
+        # 只在修改过的文件中匹配规则，NewCore和include仍然使用完整的文件列表
+        grep_list = filter_file_list(files, diff.changed_files(files))
+        if incremental:
+            logger.info('[SCAN] [DIFF] incremental scan is ignored in diff mode')
+            incremental = scan_context.incremental = False
+
+    if incremental:
+        # 只重新匹配和分析变化的文件以及依赖变化的文件，其余文件复用上次扫描的结果
+        manifest = Manifest(target_directory, fingerprint(engine, budgets))
+        manifest.diff(files)
+        if parallel == 'file':
+            logger.info('[SCAN] [INCREMENTAL] split the scan by rule in incremental mode')
+            parallel = 'rule'
+
+    def grep_files(single_rule):
+        if manifest is None:
+            return None if diff is None else grep_list
+        # 规则源码和修复函数都没有变化时只匹配变化的文件
+        keep = manifest.plan(single_rule, rule_fingerprint(rules[single_rule],
+                                                           scan_context.repair_functions(svids[single_rule])))
+        return None if keep is None else filter_file_list(files, keep)
+
+    def store_rule(single_rule, result, origins):
+        if manifest is None:
+            store(result)
+            return
+        manifest.store(single_rule, origins)
+        store(manifest.findings(single_rule, files))
 
     for idx, single_rule in enumerate(sorted(rules.keys())):
 
@@ -183,8 +380,59 @@ def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=
             vulnerability=rule.vulnerability,
             language=rule.language
         ))
-        result = scan_single(target_directory, rule, files, secret_name)
-        store(result)
+        svids[single_rule] = rule.svid
+        if jobs > 1:
+            scan_rules.append(single_rule)
+            continue
+
+        sr = SingleRule(target_directory, rule, files, secret_name, scan_context=scan_context,
+                        shard=grep_files(single_rule))
+        store_rule(single_rule, sr.process(), sr.origins)
+
+    if scan_rules and parallel == 'file':
+        # 文件切分为多份，每份用所有规则扫描，按规则、文件的顺序合并结果，与顺序扫描的结果顺序一致
+        # 规则的预算在每份文件中分别计算
+        shards = split_file_list(grep_list, jobs * 4)
+        logger.info('[SCAN] [JOBS] scan {sc} file shards with {j} processes'.format(sc=len(shards), j=jobs))
+        pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                    initargs=(target_directory, language, special_rules, files, secret_name, engine,
+                                              False, diff, budgets))
+        try:
+            shard_results = pool.map(scan_shard, [(scan_rules, shard) for shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+
+        for results, checked, skipped, hits in shard_results:
+            pruner.checked += checked
+            pruner.skipped += skipped
+            budget.hits.extend(hits)
+        for single_rule in scan_rules:
+            for results, checked, skipped, hits in shard_results:
+                store(results[single_rule])
+
+    elif scan_rules:
+        # 规则之间相互独立，分发到进程池中扫描，按规则顺序取回结果，与顺序扫描的结果顺序一致
+        logger.info('[SCAN] [JOBS] scan {rc} rules with {j} processes'.format(rc=len(scan_rules), j=jobs))
+        pool = multiprocessing.Pool(jobs, initializer=init_worker,
+                                    initargs=(target_directory, language, special_rules, files, secret_name, engine,
+                                              incremental, diff, budgets))
+        try:
+            tasks = [(single_rule, grep_files(single_rule)) for single_rule in scan_rules]
+            for single_rule, (result, origins, checked, skipped, hits) in zip(scan_rules,
+                                                                             pool.imap(scan_worker, tasks)):
+                pruner.checked += checked
+                pruner.skipped += skipped
+                budget.hits.extend(hits)
+                store_rule(single_rule, result, origins)
+        finally:
+            pool.close()
+            pool.join()
+
+    pruner.report()
+    budget.report()
+    if manifest is not None:
+        manifest.save()
 
     # print
     data = []
@@ -237,13 +485,20 @@ def scan(target_directory, a_sid=None, s_sid=None, special_rules=None, language=
 
 
 class SingleRule(object):
-    def __init__(self, target_directory, single_rule, files, secret_name=None):
+    def __init__(self, target_directory, single_rule, files, secret_name=None, scan_context=None, shard=None):
         self.target_directory = target_directory
+        if scan_context is None:
+            scan_context = ScanContext(target_directory, files, secret_name)
+        self.scan_context = scan_context
         self.find = Tool().find
         self.grep = Tool().grep
         self.sr = single_rule
         self.files = files
+        # 只在这部分文件中匹配规则，其余分析仍然使用完整的文件列表
+        self.grep_files = shard if shard is not None else files
         self.secret_name = secret_name
+        # 增量扫描时每个文件的候选分析时读取的文件以及产生的漏洞
+        self.origins = OrderedDict()
         # Single Rule Vulnerabilities
         """
         [
@@ -268,7 +523,7 @@ class SingleRule(object):
 
             try:
                 if matchs:
-                    f = FileParseAll(self.files, self.target_directory)
+                    f = FileParseAll(self.grep_files, self.target_directory)
 
                     for match in matchs:
 
@@ -307,7 +562,7 @@ class SingleRule(object):
 
             try:
                 if match:
-                    f = FileParseAll(self.files, self.target_directory)
+                    f = FileParseAll(self.grep_files, self.target_directory)
                     result = f.grep(match)
                 else:
                     result = None
@@ -325,7 +580,7 @@ class SingleRule(object):
 
             try:
                 if match:
-                    f = FileParseAll(self.files, self.target_directory)
+                    f = FileParseAll(self.grep_files, self.target_directory)
                     result = f.grep(match)
                 else:
                     result = None
@@ -344,7 +599,7 @@ class SingleRule(object):
             result = []
 
             try:
-                f = FileParseAll(self.files, self.target_directory)
+                f = FileParseAll(self.grep_files, self.target_directory)
 
                 result = f.multi_grep_name(matchs, unmatchs, matchs_name, black_list)
                 if not result:
@@ -377,50 +632,177 @@ class SingleRule(object):
             return None
 
         origin_vulnerabilities = origin_results
+        diff = self.scan_context.diff
+        if diff is not None:
+            # 只分析修改行附近的候选，NewCore生成的调用位置不受限制
+            origin_vulnerabilities = [origin_vulnerability for origin_vulnerability in origin_vulnerabilities
+                                      if origin_vulnerability and diff.contains(origin_vulnerability[0],
+                                                                                origin_vulnerability[1])]
+            logger.debug('[CVI-{cvi}] [DIFF] {c} of {t} candidates in changed lines'.format(
+                cvi=self.sr.svid, c=len(origin_vulnerabilities), t=len(origin_results)))
+
+        # 同一个文件的候选放在一起分析，文件只读取、词法分析和语法分析一次，结果仍按候选的顺序排列
+        groups = OrderedDict()
         for index, origin_vulnerability in enumerate(origin_vulnerabilities):
-            logger.debug(
-                '[CVI-{cvi}] [ORIGIN] {line}'.format(cvi=self.sr.svid, line=": ".join(list(origin_vulnerability))))
-            if origin_vulnerability == ():
-                logger.debug(' > continue...')
-                continue
-            vulnerability = self.parse_match(origin_vulnerability)
-            if vulnerability is None:
-                logger.debug('Not vulnerability, continue...')
-                continue
-            is_test = False
-            try:
-                datas = Core(self.target_directory, vulnerability, self.sr, 'project name',
-                             ['whitelist1', 'whitelist2'], test=is_test, index=index,
-                             files=self.files, secret_name=self.secret_name).scan()
-                data = ""
-
-                if len(datas) == 3:
-                    is_vulnerability, reason, data = datas
-                elif len(datas) == 2:
-                    is_vulnerability, reason = datas
-                else:
-                    is_vulnerability, reason = False, "Unpack error"
+            file_path = origin_vulnerability[0] if origin_vulnerability else None
+            groups.setdefault(file_path, []).append(index)
+
+        found = {}
+        include_graph = self.scan_context.include_graph
+        budget = self.scan_context.budget
+        budget.start('rule', self.sr.svid, 'CVI-{cvi}'.format(cvi=self.sr.svid))
+        for file_path, indexes in groups.items():
+            logger.debug('[CVI-{cvi}] [GROUP] {c} candidates in {f}'.format(cvi=self.sr.svid, c=len(indexes),
+                                                                             f=file_path))
+            budget.start('file', self.sr.svid,
+                         file_path.strip().replace(self.target_directory, '') if file_path else '')
+            record = self.scan_context.incremental and file_path is not None
+            if record:
+                # 备忘的结果可能来自其他文件，增量扫描时每个文件重新回溯，保证记录到所有读取的文件
+                include_graph.accessed = set([file_path.strip()])
+                self.scan_context.memos.clear()
+
+            if self.is_regex_only(file_path):
+                found.update(self.regex_only(file_path, indexes, origin_vulnerabilities))
+            else:
+                for index in indexes:
+                    found[index] = self.process_candidate(index, origin_vulnerabilities[index])
 
-                if is_vulnerability:
-                    logger.debug('[CVI-{cvi}] [RET] Found {code}'.format(cvi=self.sr.svid, code=reason))
-                    vulnerability.analysis = reason
-                    self.rule_vulnerabilities.append(vulnerability)
-                else:
-                    if reason == 'New Core':  # 新的规则
-                        logger.debug('[CVI-{cvi}] [NEW-VUL] New Rules init')
-                        new_rule_vulnerabilities = NewCore(self.sr, self.target_directory, data, self.files, 0, secret_name=self.secret_name)
+            if record:
+                self.origins[file_path] = (include_graph.accessed, [vulnerability for index in indexes
+                                                                    for vulnerability in found[index]])
+                include_graph.accessed = None
+            budget.stop('file')
+        budget.stop('rule')
 
-                        if len(new_rule_vulnerabilities) > 0:
-                            self.rule_vulnerabilities.extend(new_rule_vulnerabilities)
+        for index in sorted(found):
+            self.rule_vulnerabilities.extend(found[index])
 
-                    else:
-                        logger.debug('Not vulnerability: {code}'.format(code=reason))
-            except Exception:
-                raise
         logger.debug('[CVI-{cvi}] {vn} Vulnerabilities: {count}'.format(cvi=self.sr.svid, vn=self.sr.vulnerability,
                                                                         count=len(self.rule_vulnerabilities)))
         return self.rule_vulnerabilities
 
+    def is_regex_only(self, file_path):
+        """
+        Whether the candidates in this file are findings without AST analysis
+        :param file_path:
+        :return: boolean
+        """
+        if not file_path:
+            return False
+
+        language = self.scan_context.language(file_path.strip())
+        if self.sr.match_mode == const.mm_regex_only_match:
+            return language in ('php', 'sol')
+        if self.sr.match_mode == const.mm_regex_return_regex:
+            # PHP的regex-return-regex规则仍然需要判断参数是否可控
+            return language == 'sol'
+        return False
+
+    def regex_only(self, file_path, indexes, origin_vulnerabilities):
+        """
+        纯正则规则的候选直接作为漏洞，只判断白名单、特殊文件和注释
+        :param file_path:
+        :param indexes: 该文件中候选的位置
+        :param origin_vulnerabilities:
+        :return: {候选位置: [漏洞]}
+        """
+        found = dict((index, []) for index in indexes)
+        path = file_path.strip()
+        if path.split(self.target_directory, 1)[1] in ['whitelist1', 'whitelist2']:
+            logger.debug("[RET] Whitelist")
+            return found
+
+        if special_file(path):
+            logger.debug("[RET] Special File")
+            return found
+
+        if self.sr.match_mode == const.mm_regex_only_match:
+            reason = 'Regex-only-match'
+        else:
+            reason = 'Regex-return-regex'
+
+        for index in indexes:
+            vulnerability = self.parse_match(origin_vulnerabilities[index])
+            code_content = vulnerability.code_content
+            if len(code_content) > 512:
+                code_content = code_content[:500]
+
+            if annotation_line(path, vulnerability.line_number, code_content, self.scan_context.include_graph):
+                logger.debug("[RET] Annotation")
+                continue
+
+            logger.debug('[CVI-{cvi}] [RET] Found {code}'.format(cvi=self.sr.svid, code=reason))
+            vulnerability.analysis = reason
+            found[index] = [vulnerability]
+
+        return found
+
+    def process_candidate(self, index, origin_vulnerability):
+        """
+        Process a single grep candidate
+        :param index: candidate index
+        :param origin_vulnerability: (file path, line number, code)
+        :return: vulnerabilities found by this candidate
+        """
+        logger.debug(
+            '[CVI-{cvi}] [ORIGIN] {line}'.format(cvi=self.sr.svid, line=": ".join(list(origin_vulnerability))))
+        if origin_vulnerability == ():
+            logger.debug(' > continue...')
+            return []
+        vulnerability = self.parse_match(origin_vulnerability)
+        if vulnerability is None:
+            logger.debug('Not vulnerability, continue...')
+            return []
+
+        budget = self.scan_context.budget
+        budget.start('candidate', self.sr.svid, '{f}:{l}'.format(
+            f=vulnerability.file_path.strip().replace(self.target_directory, ''), l=vulnerability.line_number))
+        try:
+            # 文件或者规则的预算耗尽后不再分析其余候选
+            budget.check()
+            return self.verify(index, vulnerability)
+        except BudgetExceededException as e:
+            e.args[0].abandoned += 1
+            logger.debug('[CVI-{cvi}] [BUDGET] {s} budget exceeded'.format(cvi=self.sr.svid, s=e.args[0].scope))
+            vulnerability.analysis = budget_reason
+            return [vulnerability]
+        finally:
+            budget.stop('candidate')
+
+    def verify(self, index, vulnerability):
+        """
+        Verify a candidate with Core and expand the new rules it generates
+        :param index: candidate index
+        :param vulnerability: candidate vulnerability
+        :return: vulnerabilities found by this candidate
+        """
+        is_test = False
+        datas = Core(self.target_directory, vulnerability, self.sr, 'project name',
+                     ['whitelist1', 'whitelist2'], test=is_test, index=index,
+                     files=self.files, secret_name=self.secret_name, scan_context=self.scan_context).scan()
+        data = ""
+
+        if len(datas) == 3:
+            is_vulnerability, reason, data = datas
+        elif len(datas) == 2:
+            is_vulnerability, reason = datas
+        else:
+            is_vulnerability, reason = False, "Unpack error"
+
+        if is_vulnerability:
+            logger.debug('[CVI-{cvi}] [RET] Found {code}'.format(cvi=self.sr.svid, code=reason))
+            vulnerability.analysis = reason
+            return [vulnerability]
+
+        if reason == 'New Core':  # 新的规则
+            logger.debug('[CVI-{cvi}] [NEW-VUL] New Rules init')
+            return NewCore(self.sr, self.target_directory, data, self.files, 0, secret_name=self.secret_name,
+                           scan_context=self.scan_context) or []
+
+        logger.debug('Not vulnerability: {code}'.format(code=reason))
+        return []
+
     def parse_match(self, single_match):
         mr = VulnerabilityResult()
         # grep result
@@ -449,7 +831,7 @@ class SingleRule(object):
 
 class Core(object):
     def __init__(self, target_directory, vulnerability_result, single_rule, project_name, white_list, test=False,
-                 index=0, files=None, secret_name=None):
+                 index=0, files=None, secret_name=None, scan_context=None):
         """
         Initialize
         :param: target_directory:
@@ -461,10 +843,10 @@ class Core(object):
         :param index: vulnerability index
         :param files: core file list
         :param secret_name: secret name
+        :param scan_context: state shared by this scan
         """
         self.data = []
-        self.repair_dict = {}
-        self.repair_functions = []
+        self.repair_functions = ()
 
         self.target_directory = target_directory
 
@@ -474,6 +856,11 @@ class Core(object):
         self.code_content = vulnerability_result.code_content
         self.files = files
         self.secret_name = secret_name
+        if scan_context is None:
+            scan_context = ScanContext(target_directory, files, secret_name)
+        self.scan_context = scan_context
+        self.include_graph = scan_context.include_graph
+        self.pruner = scan_context.pruner
 
         self.rule_match = single_rule.match
         self.rule_match_mode = single_rule.match_mode
@@ -527,15 +914,7 @@ class Core(object):
         :method: According to the file name to determine whether the special file
         :return: boolean
         """
-        special_paths = [
-            '/node_modules/',
-            '/bower_components/',
-            '.min.js',
-        ]
-        for path in special_paths:
-            if path in self.file_path:
-                return True
-        return False
+        return special_file(self.file_path)
 
     def is_test_file(self):
         """
@@ -576,45 +955,38 @@ class Core(object):
                - Java:
         :return: boolean
         """
-        match_result = re.findall(r"(#|\\\*|\/\/)+", self.code_content)
         # Skip detection only on match
         if self.is_match_only_rule():
             return False
-        else:
-            return len(match_result) > 0
+
+        return annotation_line(self.file_path, self.line_number, self.code_content, self.include_graph)
+
+    def is_source_free(self):
+        """
+        Whether the file can't contain any controllable source, the AST analysis is skipped if so
+        :return: boolean
+        """
+        if self.pruner is None:
+            return False
+
+        if self.rule_match_mode not in (const.mm_function_param_controllable, const.mm_regex_param_controllable):
+            return False
+
+        return self.pruner.skip(self.file_path)
 
     def is_can_parse(self):
         """
         Whether to parse the parameter is controllable operation
         :return:
         """
-        for language in CAST.languages:
-            if self.file_path[-len(language):].lower() == language:
-                return True
-        return False
+        return self.scan_context.language(self.file_path) is not None
 
     def init_php_repair(self):
         """
-        初始化修复函数规则
+        初始化修复函数规则，每次扫描中每个规则只计算一次
         :return: 
         """
-        # self.single_rule.svid
-        a = __import__('rules.secret.demo', fromlist=['IS_REPAIR_DEFAULT'])
-        self.repair_dict = getattr(a, 'IS_REPAIR_DEFAULT')
-
-        if self.secret_name is not None:
-            try:
-                a = __import__('rules.secret.' + self.secret_name, fromlist=[self.secret_name])
-                a = getattr(a, self.secret_name)
-                self.repair_dict = self.repair_dict.copy()
-                self.repair_dict.update(a.items())
-            except ImportError:
-                logger.warning('[AST][INIT] Secret_name init error... No nodule named {}'.format(self.secret_name))
-
-        # init
-        for key in self.repair_dict:
-            if self.single_rule.svid in self.repair_dict[key]:
-                self.repair_functions.append(key)
+        self.repair_functions = self.scan_context.repair_functions(self.single_rule.svid)
 
     def scan(self):
         """
@@ -659,10 +1031,17 @@ class Core(object):
         #
         logger.debug('[CVI-{cvi}] match-mode {mm}'.format(cvi=self.cvi, mm=self.rule_match_mode))
         if self.file_path[-3:].lower() == 'php':
+            if self.is_source_free():
+                logger.debug('[CVI-{cvi}] [PRUNE] No controllable source in this file'.format(cvi=self.cvi))
+                return False, 'Param-Not-Controllable'
+
             try:
                 self.init_php_repair()
+                context = self.scan_context.analysis_context(self.single_rule.svid)
                 ast = CAST(self.rule_match, self.target_directory, self.file_path, self.line_number,
-                           self.code_content, files=self.files, rule_class=self.single_rule, repair_functions=self.repair_functions)
+                           self.code_content, files=self.files, rule_class=self.single_rule,
+                           repair_functions=self.repair_functions, context=context,
+                           language=self.scan_context.language(self.file_path))
 
                 # only match
                 if self.rule_match_mode == const.mm_regex_only_match:
@@ -678,10 +1057,12 @@ class Core(object):
                     rule_match = self.rule_match.strip('()').split('|')
                     logger.debug('[RULE_MATCH] {r}'.format(r=rule_match))
                     try:
-                        # with open(self.file_path, 'r') as fi:
-                        fi = codecs.open(self.file_path, "r", encoding='utf-8', errors='ignore')
-                        code_contents = fi.read()
-                        result = scan_parser(code_contents, rule_match, self.line_number, self.file_path, repair_functions=self.repair_functions)
+                        # 同一个文件的内容只读取一次
+                        code_contents = context.include_graph.read(self.file_path)
+                        if code_contents is None:
+                            raise IOError('error to open {}'.format(self.file_path))
+                        result = scan_parser(code_contents, rule_match, self.line_number, self.file_path,
+                                             repair_functions=self.repair_functions, context=context)
                         logger.debug('[AST] [RET] {c}'.format(c=result))
                         if len(result) > 0:
                             if result[0]['code'] == 1:  # 函数参数可控
@@ -702,6 +1083,8 @@ class Core(object):
                                 '[AST] Parser failed / vulnerability parameter is not controllable {r}'.format(
                                     r=result))
                             return False, 'Can\'t parser'
+                    except BudgetExceededException:
+                        raise
                     except Exception:
                         exc_msg = traceback.format_exc()
                         logger.warning(exc_msg)
@@ -727,6 +1110,8 @@ class Core(object):
 
                     logger.debug('[CVI-{cvi}] [PARAM-CONTROLLABLE] Param Not Controllable'.format(cvi=self.cvi))
                     return False, 'Param-Not-Controllable'
+            except BudgetExceededException:
+                raise
             except Exception as e:
                 logger.debug(traceback.format_exc())
                 return False, 'Exception'
@@ -735,7 +1120,7 @@ class Core(object):
             try:
                 ast = CAST(self.rule_match, self.target_directory, self.file_path, self.line_number,
                            self.code_content, files=self.files, rule_class=self.single_rule,
-                           repair_functions=self.repair_functions)
+                           repair_functions=self.repair_functions, language=self.scan_context.language(self.file_path))
 
                 # only match
                 if self.rule_match_mode == const.mm_regex_only_match:
@@ -758,6 +1143,42 @@ class Core(object):
 
 
 
+def special_file(file_path):
+    """
+    Is special file
+    :param file_path:
+    :return: boolean
+    """
+    special_paths = [
+        '/node_modules/',
+        '/bower_components/',
+        '.min.js',
+    ]
+    for path in special_paths:
+        if path in file_path:
+            return True
+    return False
+
+
+def annotation_line(file_path, line_number, code_content, include_graph=None):
+    """
+    匹配到的代码是否在注释中
+    :param file_path:
+    :param line_number:
+    :param code_content:
+    :param include_graph: 有include关系图时PHP文件从token流中判断
+    :return: boolean
+    """
+    if include_graph is not None and file_path[-3:].lower() == 'php':
+        # PHP从文件的token流中判断，字符串中的`//` `#`不是注释
+        stream = include_graph.tokens(file_path)
+        if stream is not None:
+            return int(line_number) in stream.comment_lines()
+
+    match_result = re.findall(r"(#|\\\*|\/\/)+", code_content)
+    return len(match_result) > 0
+
+
 def init_match_rule(data):
     """
     处理新生成规则初始化正则匹配
@@ -841,6 +1262,50 @@ def init_match_rule(data):
     return match, match2, vul_function, index
 
 
+def call_site_grep(new_rules, match, files, target_directory, include_graph=None):
+    """
+    根据调用点索引获取新规则的调用行，代替对整个项目的grep
+    调用需要在一行内结束，并且传入了污点所在位置的参数，词法分析失败的文件仍然使用正则匹配
+    :param new_rules:
+    :param match: 新规则的正则，只用于没有索引的文件
+    :param files:
+    :param target_directory:
+    :param include_graph:
+    :return: [(文件, 行号, 代码)]，与grep的顺序一致
+    """
+    f = FileParseAll(files, target_directory)
+    if include_graph is None:
+        return f.grep(match)
+
+    if isinstance(new_rules[0], php.Class):
+        name = 'new ' + new_rules[0].name
+        params = new_rules[2]
+    else:
+        name = new_rules[0].name
+        params = new_rules[0].params
+    names = [param.name for param in params]
+    position = names.index(new_rules[1].name) if new_rules[1].name in names else len(names)
+
+    file_paths = [target_directory + ffile for ffile in f.t_filelist]
+    lines = {}
+    for file_path, lineno, arguments, end_lineno in include_graph.call_sites(name, file_paths):
+        if end_lineno == lineno and arguments is not None and len(arguments) > position:
+            lines.setdefault(file_path, set()).add(lineno)
+
+    unindexed = set(include_graph.unindexed)
+    result = []
+    for file_path in file_paths:
+        if file_path in unindexed:
+            result.extend(file_grep(file_path, match))
+            continue
+
+        stream = include_graph.tokens(file_path)
+        for lineno in sorted(lines.get(file_path, ())):
+            result.append((file_path, str(lineno), stream.line(lineno)))
+
+    return result
+
+
 def auto_parse_match(single_match, svid, language):
     mr = VulnerabilityResult()
     # grep result
@@ -867,21 +1332,27 @@ def auto_parse_match(single_match, svid, language):
     return mr
 
 
-def NewCore(old_single_rule, target_directory, new_rules, files, count=0, secret_name=None):
+def NewCore(old_single_rule, target_directory, new_rules, files, count=0, secret_name=None, scan_context=None):
     """
     处理新的规则生成
     :param old_single_rule: 
     :param secret_name: 
+    :param scan_context: 本次扫描共用的扫描状态
     :param target_directory: 
     :param new_rules: 
     :param files: 
-    :param count:
-    :return: 
+    :param count: 调用链上已经展开的新规则层数，超过20层时停止展开
+    :return: 新规则的漏洞列表，新规则正在展开时返回None
     """
     count += 1
 
+    if scan_context is None:
+        scan_context = ScanContext(target_directory, files, secret_name)
+
     if count > 20:
         logger.warning("[New Rule] depth too big to auto exit...")
+        # 调用链上的展开都被截断，不保存结果
+        scan_context.incomplete.update(scan_context.expanding)
         return False
 
     # init
@@ -901,12 +1372,69 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, secret
     sr.svid = svid
     sr.language = language
 
+    # 同一个函数参数生成的新规则每次扫描只展开一次，结果复用
+    expanded = scan_context.expanded
+
+    # 新规则的调用点可能在项目的任何文件中
+    scan_context.include_graph.record('*')
+
+    key = (svid, language, match, match2, vul_function)
+    if key in expanded:
+        if expanded[key] is None:
+            logger.debug('[New Rule] {} is expanding, skip...'.format(vul_function))
+            # 调用链上在它之后的展开缺少它的结果，不保存
+            expanding = scan_context.expanding
+            scan_context.incomplete.update(expanding[expanding.index(key) + 1:])
+            return None
+
+        logger.debug('[New Rule] reuse {} results of {}'.format(len(expanded[key]), vul_function))
+        return [copy.copy(vulnerability) for vulnerability in expanded[key]]
+
+    expanded[key] = None
+    scan_context.expanding.append(key)
+    try:
+        rule_vulnerabilities = new_core_scan(sr, target_directory, new_rules, match, match2, files, count,
+                                             secret_name=secret_name, scan_context=scan_context)
+    except BudgetExceededException:
+        # 预算耗尽时没有完整展开，不保存结果
+        del expanded[key]
+        raise
+    finally:
+        scan_context.expanding.pop()
+
+    if key in scan_context.incomplete:
+        scan_context.incomplete.discard(key)
+        del expanded[key]
+        return rule_vulnerabilities or []
+
+    expanded[key] = rule_vulnerabilities or []
+
+    return [copy.copy(vulnerability) for vulnerability in expanded[key]]
+
+
+def new_core_scan(sr, target_directory, new_rules, match, match2, files, count, secret_name=None,
+                  scan_context=None):
+    """
+    匹配并分析新规则
+    :param sr: 新规则
+    :param target_directory:
+    :param new_rules:
+    :param match:
+    :param match2: 需要排除的定义
+    :param files:
+    :param count: 当前新规则所在的展开层数，继续传给下一层NewCore
+    :param secret_name:
+    :param scan_context:
+    :return:
+    """
+    svid = sr.svid
+    language = sr.language
+
     # grep
 
     try:
         if match:
-            f = FileParseAll(files, target_directory)
-            result = f.grep(match)
+            result = call_site_grep(new_rules, match, files, target_directory, scan_context.include_graph)
         else:
             result = None
     except Exception as e:
@@ -941,7 +1469,8 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, secret
 
         try:
             datas = Core(target_directory, vulnerability, sr, 'project name',
-                         ['whitelist1', 'whitelist2'], files=files, secret_name=secret_name).scan()
+                         ['whitelist1', 'whitelist2'], files=files, secret_name=secret_name,
+                         scan_context=scan_context).scan()
             data = ""
             if len(datas) == 3:
                 is_vulnerability, reason, data = datas
@@ -957,7 +1486,11 @@ def NewCore(old_single_rule, target_directory, new_rules, files, count=0, secret
             else:
                 if reason == 'New Core':  # 新的规则
                     logger.debug('[CVI-{cvi}] [NEW-VUL] New Rules init')
-                    new_rule_vulnerabilities = NewCore(sr, target_directory, data, files, 0, secret_name=secret_name)
+                    new_rule_vulnerabilities = NewCore(sr, target_directory, data, files, count,
+                                                       secret_name=secret_name, scan_context=scan_context)
+                    if new_rule_vulnerabilities is None:
+                        # 递归调用正在展开的新规则，继续分析其余调用位置
+                        continue
 
                     if not new_rule_vulnerabilities:
                         return rule_vulnerabilities
@@ -31,3 +31,7 @@ class NotExistException(PickupGitException):
 
 class AuthFailedException(PickupGitException):
     """Base class for Auth Failed exceptions"""
+
+
+class BudgetExceededException(CobraException):
+    """Analysis budget exceeded"""
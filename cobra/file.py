@@ -41,6 +41,40 @@ def file_list_parse(filelist):
     return result
 
 
+def split_file_list(filelist, count):
+    """
+    将文件列表切分为count份，每种扩展名的文件按顺序连续切分，每份都保留所有扩展名
+    :param filelist: [(扩展名, {'count': 数量, 'list': [文件]})]
+    :param count:
+    :return: 切分后的文件列表，去掉没有文件的部分
+    """
+    shards = [[] for _ in range(count)]
+
+    for ext, info in filelist or []:
+        files = info['list']
+        size = (len(files) + count - 1) // count
+        for index in range(count):
+            part = files[index * size:(index + 1) * size]
+            shards[index].append((ext, {'count': len(part), 'list': part}))
+
+    return [shard for shard in shards if [ext for ext, info in shard if info['list']]]
+
+
+def filter_file_list(filelist, keep):
+    """
+    只保留部分文件，每种扩展名都保留
+    :param filelist: [(扩展名, {'count': 数量, 'list': [文件]})]
+    :param keep: 需要保留的文件
+    :return:
+    """
+    result = []
+    for ext, info in filelist or []:
+        files = [ffile for ffile in info['list'] if ffile in keep]
+        result.append((ext, {'count': len(files), 'list': files}))
+
+    return result
+
+
 def get_line(file_path, line_rule):
     """
     搜索指定文件的指定行到指定行的内容
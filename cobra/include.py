@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.include
+    ~~~~~~~~~~~~~
+
+    Include graph and per-project caches of token streams, ASTs,
+    function indexes and call sites shared by one scan
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import os
+import codecs
+import hashlib
+import threading
+from phply.phplex import lexer
+from phply.phpparse import make_parser
+from phply import phpast as php
+from . import const
+from .log import logger
+from .file import ext_list
+from .compact import compact
+from .partial import PartialParser, scope_region, segment_source
+from .tokens import TokenStream
+
+with_line = True
+
+# 建立常量索引的php文件扩展名
+php_extensions = [ext for ext in ext_list if ext != '.sol']
+
+
+class IncludeGraph(object):
+    """
+    单次扫描内共享的include关系图，每个include表达式只解析一次
+    同一个进程中的分析上下文共用，语法分析器不可重入，语法分析和语法树缓存的读写由锁保护；
+    缓存不能跨进程共享，多进程扫描时每个进程各自建立
+    """
+
+    def __init__(self, target_directory=None, files=None):
+        self.target_directory = target_directory
+        self.files = files  # 本次扫描的文件列表 [(扩展名, {'count': 数量, 'list': [相对路径]})]
+        self.edges = {}  # 文件 -> [(include所在行号, 被包含文件)]
+        self.resolved = {}  # (文件, 行号, 表达式) -> 被包含文件，无法解析时为None
+        self.constants = {}  # 文件 -> {常量名: 常量值}
+        self.asts = {}  # 文件 -> 紧凑表示的语法树，解析失败时为None
+        self.scopes = {}  # (文件或者代码hash, 片段范围) -> (token流, 紧凑表示的局部语法树)
+        self.index = None  # 项目常量索引 常量名 -> (定义文件, 行号, 值表达式)，第一次查询时建立
+        self.values = {}  # 常量名 -> (计算后的常量值, 计算时读取的文件)
+        self.recovered = {}  # 解析失败的代码hash -> 紧凑表示的部分解析结果
+        self.failed = set()  # 部分解析中失败的片段
+        self.streams = {}  # 文件 -> token流，每个文件只做一次词法分析
+        self.calls = None  # 调用点索引 小写的函数名或者`new 类名` -> [(文件, 行号, 参数, 调用结束的行号)]，第一次查询时建立
+        self.unindexed = []  # 词法分析失败，没有加入调用点索引的文件
+        self.php_parser = None  # 本次扫描复用的phply语法分析器
+        self.lock = threading.RLock()  # 保护语法分析器和语法树缓存
+        self.function_indexes = {}  # 文件 -> 函数边界索引
+        self.accessed = None  # 分析中读取的文件，'*'表示依赖整个项目，为None时不记录
+
+    def parse(self, file_path):
+        """
+        读取并解析文件，紧凑表示的语法树缓存到本次扫描结束，直接用于分析
+        :param file_path:
+        :return: 语法树节点列表，失败返回None
+        """
+        self.record(file_path)
+        if file_path in self.asts:
+            return self.asts[file_path]
+
+        file_content = read_file(file_path)
+        if file_content is None:
+            self.asts[file_path] = None
+            return None
+        return self.parse_code(file_content, file_path)
+
+    def record(self, file_path):
+        """
+        增量扫描时记录分析读取的文件
+        :param file_path: 依赖整个项目时为'*'
+        :return:
+        """
+        if self.accessed is not None and file_path is not None:
+            self.accessed.add(file_path)
+
+    def parse_code(self, code_content, file_path=None):
+        """
+        解析代码，失败时按顶层语句分片段解析，部分解析的结果缓存到本次扫描结束
+        指定文件时，同一个文件的内容只解析一次，所有候选和规则共用
+        :param code_content:
+        :param file_path:
+        :return: 紧凑表示的语法树节点列表
+        """
+        self.record(file_path)
+        with self.lock:
+            if file_path is not None and self.asts.get(file_path) is not None and file_path in self.streams and \
+                    self.streams[file_path].code_content == code_content:
+                return self.asts[file_path]
+
+            key = hashlib.md5(code_content.encode('utf-8')).hexdigest()
+            if key in self.recovered:
+                all_nodes = self.recovered[key]
+            else:
+                all_nodes = compact(self.parse_tokens(code_content, key, file_path))
+
+            if file_path is not None:
+                self.asts[file_path] = all_nodes
+            return all_nodes
+
+    def parse_tokens(self, code_content, key, file_path=None):
+        """
+        用缓存的token流解析代码，失败时按顶层语句分片段解析
+        :param code_content:
+        :param key: 代码内容的hash
+        :param file_path:
+        :return:
+        """
+        stream = self.token_stream(code_content, file_path)
+        parser = self.parser()
+        try:
+            return parser.parse(code_content, debug=False, lexer=stream.lexer(), tracking=with_line)
+        except SyntaxError as e:
+            logger.warning("[AST] [PARTIAL] error to parse {}: {}, try to parse by segments".format(file_path, e))
+
+        all_nodes = compact(PartialParser(parser, self.failed).parse(code_content, stream.tokens))
+        self.recovered[key] = all_nodes
+        return all_nodes
+
+    def parser(self):
+        """
+        获取语法分析器，每次扫描只生成一次
+        :return:
+        """
+        with self.lock:
+            if self.php_parser is None:
+                self.php_parser = make_parser()
+
+            return self.php_parser
+
+    def parse_scope(self, code_content, lineno, file_path=None):
+        """
+        只解析行号所在的函数或方法，类方法会带上类的属性和构造函数
+        同一个函数的局部语法树以紧凑表示缓存到本次扫描结束，同一个函数中的候选共用
+        :param code_content:
+        :param lineno:
+        :param file_path:
+        :return: 语法树节点列表，不在函数中或者解析失败时返回None
+        """
+        with self.lock:
+            stream = self.token_stream(code_content, file_path)
+            region = scope_region(code_content, stream.tokens, int(lineno))
+            if region is None:
+                return None
+
+            ranges, start_lineno = region
+            key = (file_path or hashlib.md5(code_content.encode('utf-8')).hexdigest(), tuple(ranges))
+            cached = self.scopes.get(key)
+            if cached is not None and cached[0] is stream:
+                return cached[1]
+
+            try:
+                source = segment_source(code_content, ranges, start_lineno)
+                all_nodes = compact(self.parser().parse(source, debug=False, lexer=lexer.clone(), tracking=with_line))
+            except SyntaxError as e:
+                logger.debug("[AST] [SCOPE] error to parse scope of {}:{}: {}".format(file_path, lineno, e))
+                all_nodes = None
+
+            self.scopes[key] = (stream, all_nodes)
+            return all_nodes
+
+    def token_stream(self, code_content, file_path=None):
+        """
+        获取代码的token流，同一个文件只做一次词法分析
+        :param code_content:
+        :param file_path: 为空时按代码内容缓存
+        :return:
+        """
+        key = file_path or hashlib.md5(code_content.encode('utf-8')).hexdigest()
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None or stream.code_content != code_content:
+                stream = TokenStream(code_content)
+                self.streams[key] = stream
+
+            return stream
+
+    def tokens(self, file_path):
+        """
+        获取文件的token流，已经缓存时不再读取文件
+        :param file_path:
+        :return: 读取失败时返回None
+        """
+        self.record(file_path)
+        if file_path in self.streams:
+            return self.streams[file_path]
+
+        file_content = read_file(file_path)
+        if file_content is None:
+            return None
+        return self.token_stream(file_content, file_path)
+
+    def read(self, file_path):
+        """
+        读取文件内容，已经做过词法分析的文件不再读取
+        :param file_path:
+        :return: 读取失败时返回None
+        """
+        stream = self.tokens(file_path)
+        return stream.code_content if stream is not None else None
+
+    def build_calls(self, file_paths):
+        """
+        建立项目调用点索引，每次扫描只建立一次
+        :param file_paths:
+        :return:
+        """
+        self.calls = {}
+        self.unindexed = []
+
+        for file_path in file_paths:
+            stream = self.tokens(file_path)
+            if stream is None:
+                continue
+            if stream.error is not None:
+                self.unindexed.append(file_path)
+                continue
+
+            for name, calls in stream.calls().items():
+                self.calls.setdefault(name, []).extend((file_path, ) + call for call in calls)
+
+        logger.debug("[AST] call site index: {} callees, {} files unindexed".format(len(self.calls),
+                                                                                    len(self.unindexed)))
+        return self.calls
+
+    def call_sites(self, name, file_paths):
+        """
+        查询函数调用或者类实例化的位置和参数
+        :param name: 函数名或者`new 类名`
+        :param file_paths: 建立索引时使用的文件列表
+        :return: [(文件, 行号, 参数, 调用结束的行号)]，参数为[(起始字符位置, 结束字符位置)]，按文件列表和位置排列
+        """
+        self.record('*')
+        if self.calls is None:
+            self.build_calls(file_paths)
+
+        return self.calls.get(name.lower(), [])
+
+    def file_constants(self, file_path, nodes=None):
+        """
+        获取文件中define()以及const定义的常量，包括条件分支中的定义
+        :param file_path:
+        :param nodes: 已有的语法树，为空时读取缓存
+        :return:
+        """
+        if file_path in self.constants:
+            return self.constants[file_path]
+
+        constants = {}
+        self.constants[file_path] = constants
+
+        if nodes is None:
+            nodes = self.parse(file_path)
+
+        for node in walk_constants(nodes or []):
+            name, value = constant_definition(node)
+
+            if not isinstance(name, str) or name in constants:
+                continue
+
+            value = self.evaluate(value, file_path)
+            if value is not None:
+                constants[name] = value
+
+        return constants
+
+    def build_index(self):
+        """
+        建立项目常量索引，每次扫描只建立一次，只解析有define调用或者const声明的文件
+        建立索引读取的文件不计入分析读取的文件，常量的定义文件由definition记录
+        :return:
+        """
+        self.index = {}
+        accessed, self.accessed = self.accessed, None
+
+        try:
+            for file_path in self.project_files():
+                if file_path not in self.asts:
+                    stream = self.tokens(file_path)
+                    if stream is None or not has_constants(stream.tokens):
+                        continue
+
+                for node in walk_constants(self.parse(file_path) or []):
+                    name, value = constant_definition(node)
+                    if isinstance(name, str) and name not in self.index:
+                        self.index[name] = (file_path, node.lineno, value)
+        finally:
+            self.accessed = accessed
+
+        logger.debug("[AST] constant index: {} constants".format(len(self.index)))
+        return self.index
+
+    def project_files(self):
+        """
+        获取需要建立常量索引的php文件，优先使用本次扫描的文件列表，
+        没有文件列表时遍历扫描目录，没有扫描目录时只使用已经解析过的文件
+        :return:
+        """
+        if self.files is not None:
+            return [os.path.normpath(self.target_directory + ffile) for ext, info in self.files
+                    if ext.lower() in php_extensions for ffile in info['list']]
+
+        if self.target_directory is None or not os.path.isdir(self.target_directory):
+            return sorted(path for path in self.asts if path is not None)
+
+        files = []
+        for root, dirs, filenames in os.walk(self.target_directory):
+            dirs.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in php_extensions:
+                    files.append(os.path.join(root, filename))
+        return files
+
+    def definition(self, name):
+        """
+        查找常量在项目中的定义
+        :param name:
+        :return: (定义文件, 行号, 值表达式)，找不到时返回None
+        """
+        if self.index is None:
+            self.build_index()
+
+        definition = self.index.get(name)
+        # 找不到定义时，常量可能在项目的任何文件中新增
+        self.record(definition[0] if definition is not None else '*')
+        return definition
+
+    def constant(self, name, file_path):
+        """
+        查找常量的值，优先当前文件，其次项目常量索引
+        :param name:
+        :param file_path:
+        :return:
+        """
+        self.record(file_path)
+        constants = self.file_constants(file_path)
+        if name in constants:
+            return constants[name]
+
+        if name in self.values:
+            value, files = self.values[name]
+            for dep in files:
+                self.record(dep)
+            return value
+
+        definition = self.definition(name)
+        if definition is None:
+            return None
+
+        # 先占位，防止常量之间循环引用，同时记录计算时读取的文件，复用时一并记录
+        self.values[name] = (None, set([definition[0]]))
+        accessed, self.accessed = self.accessed, set([definition[0]])
+        try:
+            value = self.evaluate(definition[2], definition[0])
+        finally:
+            files, self.accessed = self.accessed, accessed
+
+        self.values[name] = (value, files)
+        for dep in files:
+            self.record(dep)
+        return value
+
+    def constant_sources(self, name):
+        """
+        获取常量定义中使用的用户可控变量
+        :param name:
+        :return:
+        """
+        definition = self.definition(name)
+        if definition is None:
+            return []
+
+        sources = []
+        stack = [definition[2]]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, php.Variable) and node.name in const.controlled_params:
+                sources.append(node.name)
+            elif isinstance(node, php.Node):
+                for field in node.fields:
+                    value = getattr(node, field)
+                    if isinstance(value, list):
+                        stack.extend(value[::-1])
+                    else:
+                        stack.append(value)
+
+        return sources
+
+    def evaluate(self, expr, file_path):
+        """
+        计算include表达式的字符串值，无法静态计算时返回None
+        :param expr:
+        :param file_path: 表达式所在文件
+        :return:
+        """
+        if isinstance(expr, str):
+            return expr
+
+        if isinstance(expr, (int, float)) and not isinstance(expr, bool):
+            return str(expr)
+
+        if isinstance(expr, php.BinaryOp) and expr.op == '.':
+            left = self.evaluate(expr.left, file_path)
+            right = self.evaluate(expr.right, file_path)
+            if left is None or right is None:
+                return None
+            return left + right
+
+        if isinstance(expr, php.MagicConstant):
+            if expr.name == '__DIR__':
+                return os.path.dirname(file_path)
+            if expr.name == '__FILE__':
+                return file_path
+            return None
+
+        if isinstance(expr, php.Constant):
+            return self.constant(expr.name, file_path)
+
+        if isinstance(expr, php.FunctionCall) and expr.name == 'dirname' and expr.params:
+            path = self.evaluate(expr.params[0].node, file_path)
+            if path is None:
+                return None
+
+            levels = expr.params[1].node if len(expr.params) > 1 else 1
+            if not isinstance(levels, int):
+                return None
+
+            for _ in range(levels):
+                path = os.path.dirname(path)
+            return path
+
+        return None
+
+    def resolve(self, node, file_path):
+        """
+        解析include/require节点指向的文件
+        :param node:
+        :param file_path: include语句所在文件
+        :return: 被包含文件的路径，找不到时返回None
+        """
+        if file_path is None:
+            return None
+
+        key = (file_path, node.lineno, repr(node.expr))
+        if key in self.resolved:
+            if self.resolved[key] is None or 'Constant(' in key[2]:
+                self.record('*')
+            self.record(self.resolved[key])
+            return self.resolved[key]
+
+        include_path = None
+        filename = self.evaluate(node.expr, file_path)
+
+        if filename is None:
+            logger.warning("[AST] [INCLUDE FOUND] Can't resolve include {}, pass it ".format(node.expr))
+        else:
+            candidates = [filename] if os.path.isabs(filename) else [os.path.join(os.path.dirname(file_path), filename)]
+            if self.target_directory is not None and not os.path.isabs(filename):
+                candidates.append(os.path.join(self.target_directory, filename))
+
+            for candidate in candidates:
+                candidate = os.path.normpath(candidate)
+                if os.path.isfile(candidate):
+                    include_path = candidate
+                    break
+
+            if include_path is None:
+                logger.warning("[AST] [INCLUDE FOUND] Can't found include file {}, pass it ".format(filename))
+                # 被包含的文件可能在之后的扫描中出现
+                self.record('*')
+            else:
+                self.record(include_path)
+                self.edges.setdefault(file_path, []).append((node.lineno, include_path))
+
+        self.resolved[key] = include_path
+        return include_path
+
+    def includes(self, file_path):
+        """
+        获取文件直接包含的文件
+        :param file_path:
+        :return:
+        """
+        return [include_path for _, include_path in self.edges.get(file_path, [])]
+
+    def dependencies(self, file_path):
+        """
+        获取文件传递包含的所有文件
+        :param file_path:
+        :return:
+        """
+        result = []
+        stack = [file_path]
+
+        while stack:
+            for include_path in self.includes(stack.pop()):
+                if include_path != file_path and include_path not in result:
+                    result.append(include_path)
+                    stack.append(include_path)
+
+        return result
+
+
+def read_file(file_path):
+    """
+    读取文件内容
+    :param file_path:
+    :return: 文件内容，失败返回None
+    """
+    try:
+        f = codecs.open(file_path, "r", encoding='utf-8', errors='ignore')
+        file_content = f.read()
+        f.close()
+    except IOError:
+        logger.warning("[Deep AST] error to open new file {}...continue".format(file_path))
+        return None
+
+    return file_content
+
+
+def has_constants(tokens):
+    """
+    token流中是否有define调用或者const声明
+    :param tokens:
+    :return:
+    """
+    for token in tokens:
+        if token.type == 'CONST' or token.type == 'STRING' and token.value.lower() == 'define':
+            return True
+    return False
+
+
+def constant_definition(node):
+    """
+    取出define()调用或const声明中的常量名和值
+    :param node:
+    :return:
+    """
+    if isinstance(node, php.FunctionCall):
+        return node.params[0].node, node.params[1].node
+
+    return node.name, node.initial
+
+
+def walk_constants(nodes):
+    """
+    遍历语法树，取出所有define()调用和const声明
+    :param nodes:
+    :return:
+    """
+    stack = list(nodes)[::-1]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, php.FunctionCall) and node.name == 'define':
+            if len(node.params) >= 2:
+                yield node
+            continue
+
+        if isinstance(node, php.ConstantDeclaration):
+            yield node
+            continue
+
+        if isinstance(node, (php.Function, php.Method, php.Class)):
+            continue
+
+        if isinstance(node, php.Node):
+            for field in node.fields:
+                value = getattr(node, field)
+                if isinstance(value, list):
+                    stack.extend(value[::-1])
+                elif isinstance(value, php.Node):
+                    stack.append(value)
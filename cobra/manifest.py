@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.manifest
+    ~~~~~~~~~~~~~~
+
+    Manifest of file hashes, dependencies and findings used by
+    incremental scans
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import os
+import json
+import hashlib
+from .log import logger
+from .config import rules_path
+from .result import VulnerabilityResult
+from .__version__ import __version__
+
+# 依赖整个项目的分析结果，任何文件变化都需要重新分析
+project_dependency = '*'
+
+
+class Manifest(object):
+    """
+    增量扫描的结果缓存，按扫描目录保存
+    每个规则的结果以(规则源码及修复函数的指纹, 扫描时所有文件的内容hash)为键，
+    规则或者候选所在文件及其依赖的文件没有变化时复用每个文件中候选的分析结果
+    """
+
+    def __init__(self, target_directory, fingerprint, directory=None):
+        self.target_directory = target_directory
+        self.fingerprint = fingerprint
+        self.directory = directory or manifest_directory()  # 清单的保存目录
+        self.path = os.path.join(self.directory, hashlib.md5(target_directory.encode('utf-8')).hexdigest() + '.json')
+        self.files = {}  # 上次扫描 相对路径 -> [大小, 修改时间, 内容hash]
+        self.snapshots = {}  # 规则扫描时的文件状态 快照id -> {相对路径: 内容hash}
+        # 规则名 -> {'fingerprint': 规则指纹, 'snapshot': 快照id,
+        #           'files': {候选所在文件: {'deps': [依赖文件], 'findings': [漏洞]}}}
+        self.rules = {}
+        self.current = {}  # 本次扫描的文件状态
+        self.snapshot = None  # 本次扫描的快照id
+        self.changed = set()  # 与上次扫描相比新增、修改以及删除的文件
+        self.changes = {}  # 快照id -> 与本次扫描相比变化的文件
+        self.results = {}  # 本次扫描的规则结果，格式与rules一致
+        self.stale = []  # 规则或者修复函数变化，需要扫描所有文件的规则
+        self.reused = 0
+        self.analysed = 0
+        self.load()
+
+    def load(self):
+        """
+        读取上次扫描的清单，版本或者引擎变化时全部重新扫描
+        :return:
+        """
+        if not os.path.isfile(self.path):
+            logger.info('[SCAN] [INCREMENTAL] No manifest, scan all files')
+            return
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.warning('[SCAN] [INCREMENTAL] error to load manifest {}: {}'.format(self.path, e))
+            return
+
+        if data.get('fingerprint') != self.fingerprint:
+            logger.info('[SCAN] [INCREMENTAL] Version or engine changed, scan all files')
+            return
+
+        self.files = data.get('files', {})
+        self.snapshots = data.get('snapshots', {})
+        self.rules = data.get('rules', {})
+
+    def diff(self, files):
+        """
+        比较文件列表和上次扫描的文件状态，大小和修改时间都没有变化的文件不计算hash
+        :param files: [(扩展名, {'count': 数量, 'list': [相对路径]})]
+        :return: 变化的文件
+        """
+        for ext, info in files or []:
+            for ffile in info['list']:
+                file_path = self.target_directory + ffile
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+
+                old = self.files.get(ffile)
+                if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime:
+                    self.current[ffile] = old
+                    continue
+
+                self.current[ffile] = [stat.st_size, stat.st_mtime, file_hash(file_path)]
+                if old is None or old[2] != self.current[ffile][2]:
+                    self.changed.add(self.normalize(ffile))
+
+        for ffile in self.files:
+            if ffile not in self.current:
+                self.changed.add(self.normalize(ffile))
+
+        snapshot = sorted((ffile, state[2]) for ffile, state in self.current.items())
+        self.snapshot = hashlib.md5(json.dumps(snapshot).encode('utf-8')).hexdigest()
+
+        logger.info('[SCAN] [INCREMENTAL] {c} of {t} files changed'.format(c=len(self.changed), t=len(self.current)))
+        return self.changed
+
+    def normalize(self, ffile):
+        """
+        文件的绝对路径，与分析时记录的依赖比较
+        :param ffile: 相对路径
+        :return:
+        """
+        return os.path.normpath(self.target_directory + ffile)
+
+    def changed_since(self, snapshot_id):
+        """
+        规则上次扫描之后变化的文件
+        :param snapshot_id:
+        :return:
+        """
+        if snapshot_id not in self.changes:
+            snapshot = self.snapshots[snapshot_id]
+            changed = set()
+            for ffile in set(snapshot) | set(self.current):
+                current = self.current[ffile][2] if ffile in self.current else None
+                if snapshot.get(ffile) != current:
+                    changed.add(self.normalize(ffile))
+            self.changes[snapshot_id] = changed
+
+        return self.changes[snapshot_id]
+
+    def is_valid(self, entry, changed):
+        """
+        候选所在文件及其依赖是否都没有变化
+        :param entry:
+        :param changed: 变化的文件
+        :return:
+        """
+        if not changed:
+            return True
+
+        deps = entry['deps']
+        return project_dependency not in deps and not changed.intersection(deps)
+
+    def plan(self, rule_name, rule_fingerprint):
+        """
+        获取规则需要重新匹配的文件，其余文件复用上次的结果
+        :param rule_name:
+        :param rule_fingerprint: 规则源码和修复函数的指纹
+        :return: 需要重新匹配的相对路径，需要匹配所有文件时为None
+        """
+        results = self.results.setdefault(rule_name, {
+            'fingerprint': rule_fingerprint,
+            'snapshot': self.snapshot,
+            'files': {},
+        })
+
+        old = self.rules.get(rule_name)
+        if old is None or old.get('fingerprint') != rule_fingerprint or old.get('snapshot') not in self.snapshots:
+            logger.debug('[SCAN] [INCREMENTAL] {r} changed, scan all files'.format(r=rule_name))
+            self.stale.append(rule_name)
+            return None
+
+        changed = self.changed_since(old['snapshot'])
+        grep = set(ffile for ffile in self.current if self.normalize(ffile) in changed)
+        for ffile, entry in old['files'].items():
+            if ffile not in self.current:
+                continue
+
+            if self.is_valid(entry, changed):
+                results['files'][ffile] = entry
+                self.reused += 1
+            else:
+                grep.add(ffile)
+
+        return grep
+
+    def store(self, rule_name, origins):
+        """
+        保存本次分析的结果
+        :param rule_name:
+        :param origins: {候选所在文件: (分析时读取的文件, 漏洞列表)}
+        :return:
+        """
+        results = self.results[rule_name]['files']
+        for file_path, (deps, vulnerabilities) in origins.items():
+            ffile = file_path.strip().replace(self.target_directory, '')
+            findings = []
+            for vulnerability in vulnerabilities:
+                finding = vulnerability.convert_to_dict()
+                finding['file_path'] = finding['file_path'].replace(self.target_directory, '')
+                findings.append(finding)
+
+            results[ffile] = {
+                'deps': sorted(project_dependency if dep == project_dependency else os.path.normpath(dep)
+                               for dep in deps),
+                'findings': findings,
+            }
+            self.analysed += 1
+
+    def findings(self, rule_name, files):
+        """
+        按文件顺序获取规则的所有漏洞，与完整扫描的顺序一致
+        :param rule_name:
+        :param files: 文件列表
+        :return:
+        """
+        order = {}
+        for ext, info in files or []:
+            for ffile in info['list']:
+                order.setdefault(ffile, len(order))
+
+        results = self.results[rule_name]['files'] if rule_name in self.results else {}
+        vulnerabilities = []
+        for ffile in sorted(results, key=lambda ffile: (order.get(ffile, len(order)), ffile)):
+            for finding in results[ffile]['findings']:
+                vulnerability = VulnerabilityResult()
+                vulnerability.__dict__.update(finding)
+                vulnerabilities.append(vulnerability)
+
+        return vulnerabilities
+
+    def report(self):
+        """
+        输出缓存的命中率
+        :return:
+        """
+        total = self.reused + self.analysed
+        if total:
+            logger.info('[SCAN] [INCREMENTAL] {r} / {t} rule/file results ({p:.1f}%) reused, {a} analysed'.format(
+                r=self.reused, t=total, p=self.reused * 100.0 / total, a=self.analysed))
+        if self.results:
+            logger.info('[SCAN] [INCREMENTAL] {s} / {c} rules changed and scanned all files{n}'.format(
+                s=len(self.stale), c=len(self.results), n=': ' + ','.join(self.stale) if self.stale else ''))
+
+    def save(self):
+        """
+        保存本次扫描的清单，本次没有扫描的规则保留上次的结果
+        :return:
+        """
+        self.report()
+
+        rules = dict(self.rules)
+        rules.update(self.results)
+        snapshots = {}
+        for rule_name, result in rules.items():
+            snapshot_id = result['snapshot']
+            if snapshot_id == self.snapshot:
+                snapshots[snapshot_id] = dict((ffile, state[2]) for ffile, state in self.current.items())
+            elif snapshot_id in self.snapshots:
+                snapshots[snapshot_id] = self.snapshots[snapshot_id]
+
+        data = {
+            'fingerprint': self.fingerprint,
+            'target_directory': self.target_directory,
+            'files': self.current,
+            'snapshots': snapshots,
+            'rules': dict((rule_name, result) for rule_name, result in rules.items()
+                          if result['snapshot'] in snapshots),
+        }
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(self.path, 'w') as f:
+                json.dump(data, f)
+        except (IOError, OSError) as e:
+            logger.warning('[SCAN] [INCREMENTAL] error to save manifest {}: {}'.format(self.path, e))
+
+
+def manifest_directory():
+    """
+    增量扫描清单的保存目录，COBRA_MANIFEST_PATH环境变量优先，默认为用户的缓存目录
+    :return:
+    """
+    directory = os.environ.get('COBRA_MANIFEST_PATH')
+    if directory:
+        return directory
+
+    cache_directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_directory, 'cobra', 'manifest')
+
+
+def file_hash(file_path):
+    """
+    文件内容的hash
+    :param file_path:
+    :return:
+    """
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint(engine='recursive', budgets=None):
+    """
+    版本、引擎、分析预算和自动生成规则的指纹，变化时上次扫描的结果全部失效
+    :param engine:
+    :param budgets: {范围: (步数, 秒数)}
+    :return:
+    """
+    h = hashlib.md5()
+    h.update('{v}|{e}'.format(v=__version__, e=engine).encode('utf-8'))
+    if budgets:
+        h.update(repr(sorted(budgets.items())).encode('utf-8'))
+
+    source = os.path.join(rules_path, 'autorule.py')
+    if os.path.isfile(source):
+        h.update(file_hash(source).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def rule_fingerprint(rule, repair_functions=()):
+    """
+    单个规则的指纹，只有规则源码或者secret中对该规则生效的修复函数变化时该规则的结果失效
+    :param rule: 规则模块
+    :param repair_functions: 规则对应的修复函数
+    :return:
+    """
+    h = hashlib.md5()
+    h.update('|'.join(sorted(repair_functions)).encode('utf-8'))
+
+    source = os.path.splitext(rule.__file__)[0] + '.py'
+    h.update(source.encode('utf-8'))
+    if os.path.isfile(source):
+        h.update(file_hash(source).encode('utf-8'))
+
+    return h.hexdigest()
@@ -11,16 +11,163 @@
     :license:   MIT, see LICENSE for more details.
     :copyright: Copyright (c) 2017 Feei. All rights reserved
 """
-from phply.phplex import lexer  # 词法分析
-from phply.phpparse import make_parser  # 语法分析
 from phply import phpast as php
+from . import const
 from .log import logger
-import re
-import codecs
+from .include import IncludeGraph
+from .worklist import WorklistEngine
+from .exceptions import BudgetExceededException
+import bisect
 
 with_line = True
-scan_results = []  # 结果存放列表初始化
-is_repair_functions = []  # 修复函数初始化
+
+
+class AnalysisContext(object):
+    """
+    单个候选的分析上下文，代替模块级的全局变量，保证分析过程可重入
+    """
+
+    def __init__(self, repair_functions=None, include_graph=None, engine='recursive', memos=None, budget=None):
+        self.scan_results = []  # 结果存放列表
+        self.repair_functions = repair_functions if repair_functions is not None else []  # 修复函数
+        self.include_graph = include_graph if include_graph is not None else IncludeGraph()  # 本次扫描的include关系图
+        self.memos = memos if memos is not None else {}  # 本次扫描的函数体回溯备忘 回溯状态 -> 结果
+        self.back_cache = {}  # 回溯状态缓存，值为None时表示该状态正在分析中
+        self.def_use = {}  # 语句列表第一个节点的id -> 定义使用链
+        self.engine = engine  # 回溯引擎 recursive/worklist
+        self.scope_lines = 2000  # 超过该行数的文件先只解析敏感函数所在的函数或方法，0为关闭
+        self.budget = budget  # 候选、文件和规则的分析预算，为None时不限制
+        self.file_path = None  # 正在回溯的语句所在文件
+
+
+def memo_back(function_node, param, nodes, function_params=None, lineno=0, function_flag=0, vul_function=None,
+              context=None):
+    """
+    带备忘的函数体回溯，同一次扫描中函数、污点和回溯状态完全相同时直接复用上次的结果
+    只是回溯结果的备忘缓存，不是参数到返回值的函数摘要，状态有任何不同都重新回溯
+    :param function_node: 污点所在的函数、方法或者类节点
+    :param param:
+    :param nodes:
+    :param function_params:
+    :param lineno:
+    :param function_flag:
+    :param vul_function:
+    :param context:
+    :return:
+    """
+    if context is None:
+        context = AnalysisContext()
+
+    memos = context.memos
+    key = (context.file_path, function_node.lineno, function_node.name, repr(param), len(nodes),
+           repr(function_params), lineno, function_flag, vul_function, tuple(context.repair_functions))
+
+    if memos.get(key) is not None:
+        return memos[key]
+
+    if key in memos:
+        # 递归调用自身，不写入备忘
+        return parameters_back(param, nodes, function_params, lineno, function_flag=function_flag,
+                               vul_function=vul_function, context=context)
+
+    memos[key] = None
+    try:
+        result = parameters_back(param, nodes, function_params, lineno, function_flag=function_flag,
+                                 vul_function=vul_function, context=context)
+    except BudgetExceededException:
+        # 预算耗尽时没有完整的回溯结果，不写入备忘
+        del memos[key]
+        raise
+    memos[key] = result
+
+    return result
+
+
+class DefUse(object):
+    """
+    一个语句列表(函数体、顶层代码或者代码块)的定义使用链，列表第一次被回溯时建立
+    记录每个变量被直接赋值的语句位置，以及可能在内部定义变量的函数、类、if和for语句的位置，
+    回溯变量时直接跳到最近的一个，中间的语句不会改变回溯结果
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes  # 保留节点的引用，保证缓存期间节点的id不会被复用
+        self.position = {}  # 节点id -> 位置
+        self.defs = {}  # 变量名 -> 赋值语句的位置
+        self.barriers = []  # 函数、类、if、for语句的位置
+        self.methods = set()  # 方法的位置
+
+        for index, node in enumerate(nodes):
+            self.position[id(node)] = index
+
+            if isinstance(node, php.Assignment):
+                name = get_node_name(node.node)
+                if isinstance(name, str):
+                    self.defs.setdefault(name, []).append(index)
+
+            elif isinstance(node, (php.Function, php.Class, php.If, php.For)):
+                self.barriers.append(index)
+
+            elif isinstance(node, php.Method):
+                self.methods.add(index)
+
+    def covers(self, nodes):
+        """
+        nodes是否为建立时列表的前缀
+        :param nodes:
+        :return:
+        """
+        return self.position.get(id(nodes[-1])) == len(nodes) - 1
+
+    def is_use(self, name, index, function_flag=0):
+        """
+        回溯变量name时，index位置的语句是否需要分析
+        :param name:
+        :param index:
+        :param function_flag:
+        :return:
+        """
+        if function_flag == 0 and index in self.methods:
+            return True
+
+        position = bisect.bisect_left(self.barriers, index)
+        if position < len(self.barriers) and self.barriers[position] == index:
+            return True
+
+        defs = self.defs.get(name, [])
+        position = bisect.bisect_left(defs, index)
+        return position < len(defs) and defs[position] == index
+
+    def reaching(self, name, index):
+        """
+        index位置之前最近一个需要分析的语句
+        :param name:
+        :param index:
+        :return: 语句的位置，没有时为-1
+        """
+        last = -1
+        for positions in (self.barriers, self.defs.get(name, [])):
+            position = bisect.bisect_left(positions, index)
+            if position > 0:
+                last = max(last, positions[position - 1])
+
+        return last
+
+
+def def_use(nodes, context):
+    """
+    获取语句列表的定义使用链，列表的前缀复用同一个
+    :param nodes:
+    :param context:
+    :return:
+    """
+    key = id(nodes[0])
+    chain = context.def_use.get(key)
+    if chain is None or not chain.covers(nodes):
+        chain = DefUse(nodes)
+        context.def_use[key] = chain
+
+    return chain
 
 
 def export(items):
@@ -171,10 +318,11 @@ def get_binaryop_deep_params(node, params):  # 取出right，left不为变量时
     return params
 
 
-def get_expr_name(node):  # expr为'expr'中的值
+def get_expr_name(node, context=None):  # expr为'expr'中的值
     """
     获取赋值表达式的表达式部分中的参数名-->返回用来进行回溯
     :param node:
+    :param context:
     :return:
     """
     param_lineno = 0
@@ -190,7 +338,7 @@ def get_expr_name(node):  # expr为'expr'中的值
     elif isinstance(node, php.FunctionCall):  # 当赋值表达式为函数
         param_expr = get_all_params(node.params)  # 返回函数参数列表
         param_lineno = node.lineno
-        is_re = is_repair(node.name)  # 调用了函数，判断调用的函数是否为修复函数
+        is_re = is_repair(node.name, context=context)  # 调用了函数，判断调用的函数是否为修复函数
 
     elif isinstance(node, php.BinaryOp):  # 当赋值表达式为BinaryOp
         param_expr = get_binaryop_params(node)
@@ -215,54 +363,15 @@ def get_node_name(node):  # node为'node'中的元组
         return node
 
 
-def get_filename(node, file_path):  # 获取filename
-    """
-    获取
-    :param node: 
-    :param file_path: 
-    :return: 
-    """
-    filename = node.expr
-    filenames = []
-    if isinstance(filename, php.BinaryOp):
-        filenames = get_binaryop_params(filename)
-
-    elif type(filename) is str:
-        filenames = [filename]
-
-    for i in range(len(filenames)):
-        if isinstance(filenames[i], php.Constant):
-            constant_node = filenames[i]
-            constant_node_name = constant_node.name
-
-            f = codecs.open(file_path, 'r', encoding='utf-8', errors='ignore')
-            file_content = f.read()
-            parser = make_parser()
-            all_nodes = parser.parse(file_content, debug=False, lexer=lexer.clone(), tracking=with_line)
-
-            for node in all_nodes:
-                if isinstance(node, php.FunctionCall) and node.name == "define":
-                    define_params = node.params
-
-                    if len(define_params) == 2 and define_params[0].node == constant_node_name:
-                        filenames[i] = define_params[1].node
-
-            if isinstance(filenames[i], php.Constant):  # 如果还没找到该常量，暂时退出
-                logger.warning("[AST] [INCLUDE FOUND] Can't found this constart {}, pass it ".format(filenames[i]))
-                filenames[i] = "not_found"
-
-    return filenames
-
-
-def is_repair(expr):
+def is_repair(expr, context=None):
     """
     判断赋值表达式是否出现过滤函数，如果已经过滤，停止污点回溯，判定漏洞已修复
     :param expr: 赋值表达式
+    :param context:
     :return:
     """
     is_re = False  # 是否修复，默认值是未修复
-    global is_repair_functions
-    if expr in is_repair_functions:
+    if context is not None and expr in context.repair_functions:
         logger.debug("[AST] function {} in is_repair_functions, The vulnerability does not exist ")
         is_re = True
     return is_re
@@ -292,20 +401,7 @@ def is_controllable(expr, flag=None):  # 获取表达式中的变量，看是否
     :param expr:
     :return:
     """
-    controlled_params = [
-        '$_GET',
-        '$_POST',
-        '$_REQUEST',
-        '$_COOKIE',
-        '$_FILES',
-        # '$_SERVER', # 暂时去掉了，误报率太高了
-        '$HTTP_POST_FILES',
-        '$HTTP_COOKIE_VARS',
-        '$HTTP_REQUEST_VARS',
-        '$HTTP_POST_VARS',
-        '$HTTP_RAW_POST_DATA',
-        '$HTTP_GET_VARS'
-    ]
+    controlled_params = const.controlled_params
     if isinstance(expr, php.ObjectProperty):
         return 3, php.Variable(expr)
 
@@ -364,9 +460,31 @@ def is_controllable(expr, flag=None):  # 获取表达式中的变量，看是否
 # return is_co, cp, expr_lineno
 
 
-def function_back(param, nodes, function_params, vul_function=None):  # 回溯函数定义位置
+def constant_back(param, lineno, context=None):
+    """
+    判断常量是否可控，常量定义中使用了用户可控变量时可控
+    :param param: php.Constant节点
+    :param lineno: 使用常量的行号
+    :param context:
+    :return:
+    """
+    if context is None:
+        context = AnalysisContext()
+
+    sources = context.include_graph.constant_sources(param.name)
+    if sources:
+        definition = context.include_graph.definition(param.name)
+        logger.debug("[AST] constant {} defined in {} line {} is controllable".format(param.name, definition[0],
+                                                                                       definition[1]))
+        return 1, php.Variable(sources[0]), definition[1]
+
+    return -1, php.Variable(param), lineno
+
+
+def function_back(param, nodes, function_params, vul_function=None, context=None):  # 回溯函数定义位置
     """
     递归回溯函数定义位置，传入param类型不同
+    :param context:
     :param function_params: 
     :param vul_function: 
     :param param: 
@@ -388,19 +506,85 @@ def function_back(param, nodes, function_params, vul_function=None):  # 回溯
                 for function_node in function_nodes:
                     if isinstance(function_node, php.Return):
                         return_node = function_node.node
-                        return_param = return_node.node
-                        is_co, cp, expr_lineno = parameters_back(return_param, function_nodes, function_params,
-                                                                 vul_function=vul_function)
+                        if isinstance(return_node, php.Variable):
+                            # return $x; 直接回溯返回的变量
+                            return_param = return_node
+                        else:
+                            return_param = return_node.node
+                        is_co, cp, expr_lineno = memo_back(node, return_param, function_nodes, function_params,
+                                                           vul_function=vul_function, context=context)
 
     return is_co, cp, expr_lineno
 
 
-def array_back(param, nodes, vul_function=None):  # 回溯数组定义赋值
+def back_state(back_type, param, nodes, *scope):
+    """
+    生成回溯状态的key，由污点、节点位置以及函数作用域组成
+    :param back_type: 回溯类型
+    :param param:
+    :param nodes:
+    :param scope:
+    :return:
+    """
+    if len(nodes) != 0:
+        position = (id(nodes[0]), id(nodes[-1]), len(nodes))
+    else:
+        position = ()
+
+    return (back_type, repr(param), position) + scope
+
+
+def cache_back(state, nodes, back_function, *args, **kwargs):
+    """
+    对回溯状态做缓存，同一个候选中每个状态只分析一次，再次进入正在分析的状态时说明出现了环
+    :param state:
+    :param nodes:
+    :param back_function: 回溯函数，参数中的context保存缓存
+    :return:
+    """
+    context = kwargs['context']
+    if context.budget is not None:
+        context.budget.step()
+
+    back_cache = context.back_cache
+    if state in back_cache:
+        if back_cache[state] is None:
+            logger.debug("[AST] Loop found in back tracking {}, exit...".format(state[1]))
+            return -1, args[0], 0
+
+        return back_cache[state][0]
+
+    back_cache[state] = None
+    result = back_function(*args, **kwargs)
+    # 保留首尾节点的引用，保证缓存期间节点的id不会被复用
+    back_cache[state] = (result, nodes[:1] + nodes[-1:])
+
+    return result
+
+
+def array_back(param, nodes, vul_function=None, context=None):  # 回溯数组定义赋值
+    """
+    缓存回溯数组赋值定义的结果
+    :param vul_function:
+    :param param:
+    :param nodes:
+    :param context:
+    :return:
+    """
+    if context is None:
+        context = AnalysisContext()
+
+    state = back_state('array_back', param, nodes, vul_function)
+    return cache_back(state, nodes, _array_back, param, nodes, vul_function=vul_function, context=context)
+
+
+def _array_back(param, nodes, vul_function=None, context=None):
     """
     递归回溯数组赋值定义
     :param vul_function: 
     :param param: 
     :param nodes: 
+    :param context:
     :return: 
     """
     param_name = param.node.name
@@ -425,35 +609,38 @@ def array_back(param, nodes, vul_function=None):  # 回溯数组定义赋值
                                 is_co, cp = is_controllable(p_node.value.node.name)
 
                                 if is_co != 1:
-                                    is_co, cp, expr_lineno = array_back(param, nodes)
+                                    is_co, cp, expr_lineno = array_back(param, nodes, context=context)
 
                             else:
                                 n_node = php.Variable(p_node.value)
-                                is_co, cp, expr_lineno = parameters_back(n_node, nodes, vul_function=vul_function)
+                                is_co, cp, expr_lineno = parameters_back(n_node, nodes, vul_function=vul_function,
+                                                                         context=context)
 
             if param == param_node:  # 处理数组一次性赋值，左值为数组
                 if isinstance(param_node_expr, php.ArrayOffset):  # 如果赋值值仍然是数组，先经过判断在进入递归
                     is_co, cp = is_controllable(param_node_expr.node.name)
 
                     if is_co != 1:
-                        is_co, cp, expr_lineno = array_back(param, nodes)
+                        is_co, cp, expr_lineno = array_back(param, nodes, context=context)
                 else:
                     is_co, cp = is_controllable(param_node_expr)
 
                     if is_co != 1 and is_co != -1:
                         n_node = php.Variable(param_node_expr.node.value)
-                        is_co, cp, expr_lineno = parameters_back(n_node, nodes, vul_function=vul_function)
+                        is_co, cp, expr_lineno = parameters_back(n_node, nodes, vul_function=vul_function,
+                                                                 context=context)
 
     return is_co, cp, expr_lineno
 
 
-def class_back(param, node, lineno, vul_function=None):
+def class_back(param, node, lineno, vul_function=None, context=None):
     """
     回溯类中变量
     :param vul_function: 
     :param param: 
     :param node: 
     :param lineno: 
+    :param context:
     :return: 
     """
     class_name = node.name
@@ -464,7 +651,8 @@ def class_back(param, node, lineno, vul_function=None):
         if class_node.lineno < int(lineno):
             vul_nodes.append(class_node)
 
-    is_co, cp, expr_lineno = parameters_back(param, vul_nodes, lineno=lineno, vul_function=vul_function)
+    is_co, cp, expr_lineno = parameters_back(param, vul_nodes, lineno=lineno, vul_function=vul_function,
+                                             context=context)
 
     if is_co == 1 or is_co == -1:  # 可控或者不可控，直接返回
         return is_co, cp, expr_lineno
@@ -475,8 +663,9 @@ def class_back(param, node, lineno, vul_function=None):
                 constructs_nodes = class_node.nodes
 
                 # 递归析构函数
-                is_co, cp, expr_lineno = parameters_back(param, constructs_nodes, function_params=class_node_params,
-                                                         lineno=lineno, vul_function=vul_function)
+                is_co, cp, expr_lineno = memo_back(class_node, param, constructs_nodes,
+                                                   function_params=class_node_params, lineno=lineno,
+                                                   vul_function=vul_function, context=context)
 
                 if is_co == 3:
                     # 回溯输入参数
@@ -493,12 +682,13 @@ def class_back(param, node, lineno, vul_function=None):
     return is_co, cp, expr_lineno
 
 
-def new_class_back(param, nodes, vul_function=None):
+def new_class_back(param, nodes, vul_function=None, context=None):
     """
     分析新建的class，自动进入tostring函数
     :param vul_function: 
     :param param: 
     :param nodes: 
+    :param context:
     :return: 
     """
     param = param.name
@@ -522,7 +712,7 @@ def new_class_back(param, nodes, vul_function=None):
                         if isinstance(tostring_node, php.Return):
                             return_param = tostring_node.node
                             is_co, cp, expr_lineno = parameters_back(return_param, tostring_nodes,
-                                                                     vul_function=vul_function)
+                                                                     vul_function=vul_function, context=context)
                             return is_co, cp, expr_lineno
 
         else:
@@ -533,7 +723,28 @@ def new_class_back(param, nodes, vul_function=None):
 
 
 def parameters_back(param, nodes, function_params=None, lineno=0,
-                    function_flag=0, vul_function=None):  # 用来得到回溯过程中的被赋值的变量是否与敏感函数变量相等,param是当前需要跟踪的污点
+                    function_flag=0, vul_function=None, context=None):  # 用来得到回溯过程中的被赋值的变量是否与敏感函数变量相等,param是当前需要跟踪的污点
+    """
+    缓存回溯敏感函数赋值流程的结果
+    :param vul_function:
+    :param param:
+    :param nodes:
+    :param function_params:
+    :param lineno:
+    :param function_flag:
+    :param context:
+    :return:
+    """
+    if context is None:
+        context = AnalysisContext()
+
+    state = back_state('parameters_back', param, nodes, repr(function_params), lineno, function_flag, vul_function)
+    return cache_back(state, nodes, _parameters_back, param, nodes, function_params, lineno,
+                      function_flag=function_flag, vul_function=vul_function, context=context)
+
+
+def _parameters_back(param, nodes, function_params=None, lineno=0, function_flag=0, vul_function=None,
+                     context=None):
     """
     递归回溯敏感函数的赋值流程，param为跟踪的污点，当找到param来源时-->分析复制表达式-->获取新污点；否则递归下一个节点
     :param vul_function: 
@@ -542,22 +753,23 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
     :param function_params:
     :param lineno
     :param function_flag: 是否在函数、方法内的标志位
+    :param context:
     :return:
     """
 
     if isinstance(param, php.FunctionCall) or isinstance(param, php.MethodCall):  # 当污点为寻找函数时，递归进入寻找函数
         logger.debug("[AST] AST analysis for FunctionCall or MethodCall {} in line {}".format(param.name, param.lineno))
-        is_co, cp, expr_lineno = function_back(param, nodes, function_params)
+        is_co, cp, expr_lineno = function_back(param, nodes, function_params, context=context)
         return is_co, cp, expr_lineno
 
     if isinstance(param, php.ArrayOffset):  # 当污点为数组时，递归进入寻找数组声明或赋值
         logger.debug("[AST] AST analysis for ArrayOffset  in line {}".format(param.lineno))
-        is_co, cp, expr_lineno = array_back(param, nodes)
+        is_co, cp, expr_lineno = array_back(param, nodes, context=context)
         return is_co, cp, expr_lineno
 
     if isinstance(param, php.New) or (hasattr(param, "name") and isinstance(param.name, php.New)):  # 当污点为新建类事，进入类中tostring函数分析
         logger.debug("[AST] AST analysis for New Class {} in line {}".format(param.name, param.lineno))
-        is_co, cp, expr_lineno = new_class_back(param, nodes)
+        is_co, cp, expr_lineno = new_class_back(param, nodes, context=context)
         return is_co, cp, expr_lineno
 
     expr_lineno = 0  # source所在行号
@@ -569,18 +781,30 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
 
     is_co, cp = is_controllable(param_name)
 
+    if is_co == 3 and isinstance(param_name, str) and len(nodes) != 0:
+        # 最后一个语句与污点无关时，按定义使用链跳到最近的赋值或者复合语句
+        chain = def_use(nodes, context)
+        if not chain.is_use(param_name, len(nodes) - 1, function_flag):
+            last = chain.reaching(param_name, len(nodes) - 1)
+            return parameters_back(param, nodes[:last + 1], function_params, lineno, function_flag=1,
+                                   vul_function=vul_function, context=context)
+
     if len(nodes) != 0:
         node = nodes[len(nodes) - 1]
 
         if isinstance(node, php.Assignment):  # 回溯的过程中，对出现赋值情况的节点进行跟踪
             param_node = get_node_name(node.node)  # param_node为被赋值的变量
-            param_expr, expr_lineno, is_re = get_expr_name(node.expr)  # param_expr为赋值表达式,param_expr为变量或者列表
+            # param_expr为赋值表达式,param_expr为变量或者列表
+            param_expr, expr_lineno, is_re = get_expr_name(node.expr, context=context)
 
             if param_name == param_node and is_re is True:
                 is_co = 2
                 cp = param
                 return is_co, cp, expr_lineno
 
+            if param_name == param_node and isinstance(param_expr, php.Constant):  # 变量来自常量，查询项目常量索引
+                return constant_back(param_expr, node.lineno, context=context)
+
             if param_name == param_node and not isinstance(param_expr, list):  # 找到变量的来源，开始继续分析变量的赋值表达式是否可控
                 logger.debug(
                     "[AST] Find {}={} in line {}, start ast for param {}".format(param_name, param_expr, expr_lineno,
@@ -614,10 +838,14 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                             for function_node in function_nodes:
                                 if isinstance(function_node, php.Return):
                                     return_node = function_node.node
-                                    return_param = return_node.node
-                                    is_co, cp, expr_lineno = parameters_back(return_param, function_nodes,
-                                                                             function_params, lineno, function_flag=1,
-                                                                             vul_function=vul_function)
+                                    if isinstance(return_node, php.Variable):
+                                        # return $x; 直接回溯返回的变量
+                                        return_param = return_node
+                                    else:
+                                        return_param = return_node.node
+                                    is_co, cp, expr_lineno = memo_back(node, return_param, function_nodes,
+                                                                       function_params, lineno, function_flag=1,
+                                                                       vul_function=vul_function, context=context)
 
             if param_name == param_node and isinstance(param_expr, list):
                 logger.debug(
@@ -634,7 +862,8 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
 
                     param = php.Variable(param)
                     _is_co, _cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                               function_flag=1, vul_function=vul_function)
+                                                               function_flag=1, vul_function=vul_function,
+                                                               context=context)
 
                     if _is_co != -1:  # 当参数可控时，值赋给is_co 和 cp，有一个参数可控，则认定这个函数可能可控
                         is_co = _is_co
@@ -657,8 +886,8 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                     vul_nodes.append(function_node)
 
             if len(vul_nodes) > 0:
-                is_co, cp, expr_lineno = parameters_back(param, function_nodes, function_params, function_lineno,
-                                                         function_flag=1, vul_function=vul_function)
+                is_co, cp, expr_lineno = memo_back(node, param, function_nodes, function_params, function_lineno,
+                                                   function_flag=1, vul_function=vul_function, context=context)
 
             if is_co == 3:  # 出现新的敏感函数，重新生成新的漏洞结构，进入新的遍历结构
                 for node_param in node.params:
@@ -684,7 +913,7 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                             return is_co, cp, 0
 
         elif isinstance(node, php.Class):
-            is_co, cp, expr_lineno = class_back(param, node, lineno, vul_function=vul_function)
+            is_co, cp, expr_lineno = class_back(param, node, lineno, vul_function=vul_function, context=context)
             return is_co, cp, expr_lineno
 
         elif isinstance(node, php.If):
@@ -703,11 +932,12 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
 
             # 进入分析if内的代码块，如果返回参数不同于进入参数，那么在不同的代码块中，变量值不同，不能统一处理，需要递归进入不同的部分
             is_co, cp, expr_lineno = parameters_back(param, if_nodes, function_params, if_node_lineno,
-                                                     function_flag=1, vul_function=vul_function)
+                                                     function_flag=1, vul_function=vul_function, context=context)
 
             if is_co == 3 and cp != param:  # 理由如上
                 is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                         function_flag=1, vul_function=vul_function)  # 找到可控的输入时，停止递归
+                                                         function_flag=1, vul_function=vul_function,
+                                                         context=context)  # 找到可控的输入时，停止递归
                 return is_co, cp, expr_lineno
 
             if is_co is not 1 and node.elseifs != []:  # elseif可能有多个，所以需要列表
@@ -724,12 +954,14 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                         elif_node_lineno = 0
 
                     is_co, cp, expr_lineno = parameters_back(param, elif_nodes, function_params, elif_node_lineno,
-                                                             function_flag=1, vul_function=vul_function)
+                                                             function_flag=1, vul_function=vul_function,
+                                                             context=context)
 
                     if is_co == 3 and cp != param:  # 理由如上
                         is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
                                                                  function_flag=1,
-                                                                 vul_function=vul_function)  # 找到可控的输入时，停止递归
+                                                                 vul_function=vul_function,
+                                                                 context=context)  # 找到可控的输入时，停止递归
                         return is_co, cp, expr_lineno
                     else:
                         break
@@ -746,12 +978,13 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                     else_node_lineno = 0
 
                 is_co, cp, expr_lineno = parameters_back(param, else_nodes, function_params, else_node_lineno,
-                                                         function_flag=1, vul_function=vul_function)
+                                                         function_flag=1, vul_function=vul_function, context=context)
 
                 if is_co == 3 and cp != param:  # 理由如上
                     is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
                                                              function_flag=1,
-                                                             vul_function=vul_function)  # 找到可控的输入时，停止递归
+                                                             vul_function=vul_function,
+                                                             context=context)  # 找到可控的输入时，停止递归
                     return is_co, cp, expr_lineno
 
         elif isinstance(node, php.For):
@@ -762,11 +995,12 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
                 "[AST] param {} line {} in for, start ast in for".format(param_name, for_node_lineno))
 
             is_co, cp, expr_lineno = parameters_back(param, for_nodes, function_params, for_node_lineno,
-                                                     function_flag=1, vul_function=vul_function)
+                                                     function_flag=1, vul_function=vul_function, context=context)
 
         if is_co == 3 or int(lineno) == node.lineno:  # 当is_co为True时找到可控，停止递归
             is_co, cp, expr_lineno = parameters_back(param, nodes[:-1], function_params, lineno,
-                                                     function_flag=1, vul_function=vul_function)  # 找到可控的输入时，停止递归
+                                                     function_flag=1, vul_function=vul_function,
+                                                     context=context)  # 找到可控的输入时，停止递归
 
     elif len(nodes) == 0 and function_params is not None:  # 当敏感函数在函数中时，function_params不为空，这时应进入自定义敏感函数逻辑
         for function_param in function_params:
@@ -779,7 +1013,8 @@ def parameters_back(param, nodes, function_params=None, lineno=0,
     return is_co, cp, expr_lineno
 
 
-def deep_parameters_back(param, back_node, function_params, count, file_path, lineno=0, vul_function=None):
+def deep_parameters_back(param, back_node, function_params, count, file_path, lineno=0, vul_function=None,
+                         context=None):
     """
     深度递归遍历
     :param vul_function: 
@@ -788,11 +1023,20 @@ def deep_parameters_back(param, back_node, function_params, count, file_path, li
     :param back_node:
     :param function_params: 
     :param file_path: 
+    :param context:
     :return: 
     """
+    if context is None:
+        context = AnalysisContext()
+
     count += 1
 
-    is_co, cp, expr_lineno = parameters_back(param, back_node, function_params, lineno, vul_function=vul_function)
+    caller_file, context.file_path = context.file_path, file_path
+    try:
+        is_co, cp, expr_lineno = parameters_back(param, back_node, function_params, lineno, vul_function=vul_function,
+                                                 context=context)
+    finally:
+        context.file_path = caller_file
 
     if count > 20:
         logger.warning("[Deep AST] depth too big, auto exit...")
@@ -801,33 +1045,24 @@ def deep_parameters_back(param, back_node, function_params, count, file_path, li
     if is_co == 3:
         logger.debug("[Deep AST] try to find include, start deep AST for {}".format(cp))
 
+        graph = context.include_graph
+
         for node in back_node[::-1]:
             if isinstance(node, php.Include):
-                #  拼接路径需要专门处理，暂时先这样
-                filename = get_filename(node, file_path)
-                file_path_list = re.split(r"[\/\\]", file_path)
-                file_path_list.pop()
-                file_path_list += filename
-                if "not_found" in filename:
+                file_path_name = graph.resolve(node, file_path)
+                if file_path_name is None:
                     continue
-                file_path_name = "/".join(file_path_list)
-
-                try:
-                    logger.debug("[Deep AST] open new file {file_path}".format(file_path=file_path_name))
-                    # f = open(file_path_name, 'r')
-                    f = codecs.open(file_path_name, "r", encoding='utf-8', errors='ignore')
-                    file_content = f.read()
-                except:
-                    logger.warning("[Deep AST] error to open new file...continue")
+
+                logger.debug("[Deep AST] open new file {file_path}".format(file_path=file_path_name))
+                all_nodes = graph.parse(file_path_name)
+                if all_nodes is None:
                     continue
 
-                parser = make_parser()
-                all_nodes = parser.parse(file_content, debug=False, lexer=lexer.clone(), tracking=with_line)
                 node = cp
                 # node = php.Variable(cp)
 
                 is_co, cp, expr_lineno = deep_parameters_back(node, all_nodes, function_params, count, file_path_name,
-                                                              lineno, vul_function=vul_function)
+                                                              lineno, vul_function=vul_function, context=context)
                 if is_co == -1:
                     break
 
@@ -868,7 +1103,7 @@ def get_function_params(nodes):
     return params
 
 
-def anlysis_params(param, code_content, file_path, lineno, vul_function=None, repair_functions=None):
+def anlysis_params(param, code_content, file_path, lineno, vul_function=None, repair_functions=None, context=None):
     """
     在cast调用时做中转数据预处理
     :param repair_functions: 
@@ -877,13 +1112,16 @@ def anlysis_params(param, code_content, file_path, lineno, vul_function=None, re
     :param param: 
     :param code_content: 
     :param file_path: 
+    :param context:
     :return: 
     """
-    global is_repair_functions
-    count = 0
-    function_params = None
-    if repair_functions is not None:
-        is_repair_functions = repair_functions
+    if context is None:
+        context = AnalysisContext(repair_functions)
+    elif repair_functions is not None:
+        context.repair_functions = repair_functions
+
+    context.back_cache = {}
+    context.def_use = {}
 
     if type(param) is str and "->" in param:
         param_left = php.Variable(param.split("->")[0])
@@ -891,8 +1129,6 @@ def anlysis_params(param, code_content, file_path, lineno, vul_function=None, re
         param = php.ObjectProperty(param_left, param_right)
 
     param = php.Variable(param)
-    parser = make_parser()
-    all_nodes = parser.parse(code_content, debug=False, lexer=lexer.clone(), tracking=with_line)
 
     # 做一次处理，解决Variable(Variable('$id'))的问题
     while isinstance(param.name, php.Variable):
@@ -900,18 +1136,65 @@ def anlysis_params(param, code_content, file_path, lineno, vul_function=None, re
 
     logger.debug("[AST] AST to find param {}".format(param))
 
+    scope_nodes = parse_scope(code_content, lineno, file_path, context)
+    if scope_nodes is not None:
+        is_co, cp, expr_lineno = nodes_back(param, scope_nodes, file_path, lineno, vul_function, context)
+        if is_co != 3:
+            return is_co, cp, expr_lineno
+
+        # 回溯到了函数之外，扩大到整个文件
+        logger.debug("[AST] [SCOPE] param {} out of scope, parse whole file {}".format(param, file_path))
+        context.back_cache = {}
+        context.def_use = {}
+
+    all_nodes = context.include_graph.parse_code(code_content, file_path)
+    return nodes_back(param, all_nodes, file_path, lineno, vul_function, context)
+
+
+def parse_scope(code_content, lineno, file_path, context):
+    """
+    大文件先只解析敏感函数所在的函数或方法
+    :param code_content:
+    :param lineno:
+    :param file_path:
+    :param context:
+    :return: 语法树节点列表，不需要或者无法只解析局部时返回None
+    """
+    if not context.scope_lines or code_content.count('\n') < context.scope_lines:
+        return None
+
+    return context.include_graph.parse_scope(code_content, lineno, file_path)
+
+
+def nodes_back(param, all_nodes, file_path, lineno, vul_function=None, context=None):
+    """
+    在语法树中回溯参数
+    :param param:
+    :param all_nodes:
+    :param file_path:
+    :param lineno:
+    :param vul_function:
+    :param context:
+    :return:
+    """
+    if context.engine == 'worklist' and isinstance(param.name, str):
+        engine = WorklistEngine(context)
+        return engine.back(param.name, all_nodes, lineno, file_path, vul_function=vul_function)
+
     vul_nodes = []
     for node in all_nodes:
         if node is not None and node.lineno <= int(lineno):
             vul_nodes.append(node)
 
+    count = 0
+    function_params = None
     is_co, cp, expr_lineno = deep_parameters_back(param, vul_nodes, function_params, count, file_path, lineno,
-                                                  vul_function=vul_function)
+                                                  vul_function=vul_function, context=context)
 
     return is_co, cp, expr_lineno
 
 
-def anlysis_function(node, back_node, vul_function, function_params, vul_lineno, file_path=None):
+def anlysis_function(node, back_node, vul_function, function_params, vul_lineno, file_path=None, context=None):
     """
     对用户自定义的函数进行分析-->获取函数入参-->入参用经过赋值流程，进入sink函数-->此自定义函数为危险函数
     :param file_path: 
@@ -920,61 +1203,66 @@ def anlysis_function(node, back_node, vul_function, function_params, vul_lineno,
     :param vul_function:
     :param function_params:
     :param vul_lineno:
+    :param context:
     :return:
     """
-    global scan_results
     try:
         if node.name == vul_function and int(node.lineno) == int(vul_lineno):  # 函数体中存在敏感函数，开始对敏感函数前的代码进行检测
             for param in node.params:
                 if isinstance(param.node, php.Variable):
                     analysis_variable_node(param.node, back_node, vul_function, vul_lineno, function_params,
-                                           file_path=file_path)
+                                           file_path=file_path, context=context)
 
                 if isinstance(param.node, php.FunctionCall):
                     analysis_functioncall_node(param.node, back_node, vul_function, vul_lineno, function_params,
-                                               file_path=file_path)
+                                               file_path=file_path, context=context)
 
                 if isinstance(param.node, php.BinaryOp):
                     analysis_binaryop_node(param.node, back_node, vul_function, vul_lineno, function_params,
-                                           file_path=file_path)
+                                           file_path=file_path, context=context)
 
                 if isinstance(param.node, php.ArrayOffset):
-                    analysis_arrayoffset_node(param.node, vul_function, vul_lineno)
+                    analysis_arrayoffset_node(param.node, vul_function, vul_lineno, context=context)
 
+    except BudgetExceededException:
+        raise
     except Exception as e:
         logger.debug(e)
 
 
-def analysis_functioncall(node, back_node, vul_function, vul_lineno):
+def analysis_functioncall(node, back_node, vul_function, vul_lineno, context=None):
     """
     调用FunctionCall-->判断调用Function是否敏感-->get params获取所有参数-->开始递归判断
     :param node:
     :param back_node:
     :param vul_function:
     :param vul_lineno
+    :param context:
     :return:
     """
-    global scan_results
     try:
         if node.name == vul_function and int(node.lineno) == int(vul_lineno):  # 定位到敏感函数
             for param in node.params:
                 if isinstance(param.node, php.Variable):
-                    analysis_variable_node(param.node, back_node, vul_function, vul_lineno)
+                    analysis_variable_node(param.node, back_node, vul_function, vul_lineno, context=context)
 
                 if isinstance(param.node, php.FunctionCall):
-                    analysis_functioncall_node(param.node, back_node, vul_function, vul_lineno)
+                    analysis_functioncall_node(param.node, back_node, vul_function, vul_lineno, context=context)
 
                 if isinstance(param.node, php.BinaryOp):
-                    analysis_binaryop_node(param.node, back_node, vul_function, vul_lineno)
+                    analysis_binaryop_node(param.node, back_node, vul_function, vul_lineno, context=context)
 
                 if isinstance(param.node, php.ArrayOffset):
-                    analysis_arrayoffset_node(param.node, vul_function, vul_lineno)
+                    analysis_arrayoffset_node(param.node, vul_function, vul_lineno, context=context)
 
+    except BudgetExceededException:
+        raise
     except Exception as e:
         logger.debug(e)
 
 
-def analysis_binaryop_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_binaryop_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None,
+                           context=None):
     """
     处理BinaryOp类型节点-->取出参数-->回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -983,6 +1271,7 @@ def analysis_binaryop_node(node, back_node, vul_function, vul_lineno, function_p
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -995,20 +1284,19 @@ def analysis_binaryop_node(node, back_node, vul_function, vul_lineno, function_p
         # is_co, cp, expr_lineno = parameters_back(param, back_node, function_params)
 
         if file_path is not None:
-            # with open(file_path, 'r') as fi:
-            fi = codecs.open(file_path, 'r', encoding='utf-8', errors='ignore')
-            code_content = fi.read()
+            code_content = context.include_graph.read(file_path)
             is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno,
-                                                    vul_function=vul_function)
+                                                    vul_function=vul_function, context=context)
         else:
             count = 0
             is_co, cp, expr_lineno = deep_parameters_back(node, back_node, function_params, count, file_path,
-                                                          vul_function=vul_function)
+                                                          vul_function=vul_function, context=context)
 
-        set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+        set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
-def analysis_objectproperry_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_objectproperry_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None,
+                                 context=None):
     """
     处理_objectproperry类型节点-->取出参数-->回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1017,6 +1305,7 @@ def analysis_objectproperry_node(node, back_node, vul_function, vul_lineno, func
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -1026,25 +1315,25 @@ def analysis_objectproperry_node(node, back_node, vul_function, vul_lineno, func
 
     # is_co, cp, expr_lineno = parameters_back(param, back_node, function_params)
     if file_path is not None:
-        # with open(file_path, 'r') as fi:
-        fi = codecs.open(file_path, 'r', encoding='utf-8', errors='ignore')
-        code_content = fi.read()
+        code_content = context.include_graph.read(file_path)
 
-        is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno, vul_function=vul_function)
+        is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno, vul_function=vul_function,
+                                                context=context)
     else:
         count = 0
         is_co, cp, expr_lineno = deep_parameters_back(node, back_node, function_params, count,
-                                                      vul_function=vul_function)
+                                                      vul_function=vul_function, context=context)
 
-    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
-def analysis_arrayoffset_node(node, vul_function, vul_lineno):
+def analysis_arrayoffset_node(node, vul_function, vul_lineno, context=None):
     """
     处理ArrayOffset类型节点-->取出参数-->回溯判断参数是否可控-->输出结果
     :param node:
     :param vul_function:
     :param vul_lineno:
+    :param context:
     :return:
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -1052,10 +1341,11 @@ def analysis_arrayoffset_node(node, vul_function, vul_lineno):
     expr_lineno = node.lineno
     is_co, cp = is_controllable(param)
 
-    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
-def analysis_functioncall_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_functioncall_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None,
+                               context=None):
     """
     处理FunctionCall类型节点-->取出参数-->回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1064,6 +1354,7 @@ def analysis_functioncall_node(node, back_node, vul_function, vul_lineno, functi
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -1074,21 +1365,20 @@ def analysis_functioncall_node(node, back_node, vul_function, vul_lineno, functi
         # is_co, cp, expr_lineno = parameters_back(param, back_node, function_params)
 
         if file_path is not None:
-            # with open(file_path, 'r') as fi:
-            fi = codecs.open(file_path, 'r', encoding='utf-8', errors='ignore')
-            code_content = fi.read()
+            code_content = context.include_graph.read(file_path)
 
             is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno,
-                                                    vul_function=vul_function)
+                                                    vul_function=vul_function, context=context)
         else:
             count = 0
             is_co, cp, expr_lineno = deep_parameters_back(node, back_node, function_params, count, file_path,
-                                                          vul_function=vul_function)
+                                                          vul_function=vul_function, context=context)
 
-        set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+        set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
-def analysis_variable_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_variable_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None,
+                           context=None):
     """
     处理Variable类型节点-->取出参数-->回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1097,6 +1387,7 @@ def analysis_variable_node(node, back_node, vul_function, vul_lineno, function_p
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -1104,21 +1395,20 @@ def analysis_variable_node(node, back_node, vul_function, vul_lineno, function_p
     param_lineno = node.lineno
 
     if file_path is not None:
-        # with open(file_path, 'r') as fi:
-        fi = codecs.open(file_path, 'r', encoding='utf-8', errors='ignore')
-        code_content = fi.read()
+        code_content = context.include_graph.read(file_path)
 
-        is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno, vul_function=vul_function)
+        is_co, cp, expr_lineno = anlysis_params(param, code_content, file_path, param_lineno, vul_function=vul_function,
+                                                context=context)
     else:
         count = 0
         is_co, cp, expr_lineno = deep_parameters_back(node, back_node, function_params, count, file_path,
-                                                      vul_function=vul_function)
+                                                      vul_function=vul_function, context=context)
 
-    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
 def analysis_ternaryop_node(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None,
-                            repair_functions=[]):
+                            repair_functions=[], context=None):
     """
     处理三元提交判断语句，回溯双变量
     :param node: 
@@ -1127,6 +1417,7 @@ def analysis_ternaryop_node(node, back_node, vul_function, vul_lineno, function_
     :param vul_lineno: 
     :param function_params: 
     :param file_path: 
+    :param context:
     :return: 
     """
     logger.debug('[AST] vul_function:{v}'.format(v=vul_function))
@@ -1143,38 +1434,40 @@ def analysis_ternaryop_node(node, back_node, vul_function, vul_lineno, function_
     logger.debug('[AST] vul_param1: {}, vul_param2: {}'.format(node1, node2))
 
     count = 0
-    is_co, cp, expr_lineno = deep_parameters_back(node1, back_node, function_params, count, file_path)
-    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+    is_co, cp, expr_lineno = deep_parameters_back(node1, back_node, function_params, count, file_path, context=context)
+    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
-    is_co, cp, expr_lineno = deep_parameters_back(node2, back_node, function_params, count, file_path)
-    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno)
+    is_co, cp, expr_lineno = deep_parameters_back(node2, back_node, function_params, count, file_path, context=context)
+    set_scan_results(is_co, cp, expr_lineno, vul_function, param, vul_lineno, context=context)
 
 
-def analysis_if_else(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_if_else(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None, context=None):
     nodes = []
     if isinstance(node.node, php.Block):  # if语句中的sink点以及变量
-        analysis(node.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params)
+        analysis(node.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params, context=context)
     else:
-        analysis([node.node], vul_function, back_node, vul_lineno, file_path, function_params)
+        analysis([node.node], vul_function, back_node, vul_lineno, file_path, function_params, context=context)
 
     if node.else_ is not None:  # else语句中的sink点以及变量
         if isinstance(node.else_.node, php.Block):
-            analysis(node.else_.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params)
+            analysis(node.else_.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params,
+                     context=context)
         else:
-            analysis([node.node], vul_function, back_node, vul_lineno, file_path, function_params)
+            analysis([node.node], vul_function, back_node, vul_lineno, file_path, function_params, context=context)
 
     if len(node.elseifs) != 0:  # elseif语句中的sink点以及变量
         for i_node in node.elseifs:
             if i_node.node is not None:
                 if isinstance(i_node.node, php.Block):
-                    analysis(i_node.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params)
+                    analysis(i_node.node.nodes, vul_function, back_node, vul_lineno, file_path, function_params,
+                             context=context)
 
                 else:
                     nodes.append(i_node.node)
-                    analysis(nodes, vul_function, back_node, vul_lineno, file_path, function_params)
+                    analysis(nodes, vul_function, back_node, vul_lineno, file_path, function_params, context=context)
 
 
-def analysis_echo_print(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_echo_print(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None, context=None):
     """
     处理echo/print类型节点-->判断节点类型-->不同If分支回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1183,54 +1476,54 @@ def analysis_echo_print(node, back_node, vul_function, vul_lineno, function_para
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
-    global scan_results
 
     if int(vul_lineno) == int(node.lineno):
         if isinstance(node, php.Print):
             if isinstance(node.node, php.FunctionCall):
                 analysis_functioncall_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                           file_path=file_path)
+                                           file_path=file_path, context=context)
 
             if isinstance(node.node, php.Variable) and vul_function == 'print':  # 直接输出变量信息
                 analysis_variable_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                       file_path=file_path)
+                                       file_path=file_path, context=context)
 
             if isinstance(node.node, php.BinaryOp) and vul_function == 'print':
                 analysis_binaryop_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                       file_path=file_path)
+                                       file_path=file_path, context=context)
 
             if isinstance(node.node, php.ArrayOffset) and vul_function == 'print':
-                analysis_arrayoffset_node(node.node, vul_function, vul_lineno)
+                analysis_arrayoffset_node(node.node, vul_function, vul_lineno, context=context)
 
             if isinstance(node.node, php.TernaryOp) and vul_function == 'print':
                 analysis_ternaryop_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                        file_path=file_path)
+                                        file_path=file_path, context=context)
 
         elif isinstance(node, php.Echo):
             for k_node in node.nodes:
                 if isinstance(k_node, php.FunctionCall):  # 判断节点中是否有函数调用节点
                     analysis_functioncall_node(k_node, back_node, vul_function, vul_lineno, function_params,
-                                               file_path=file_path)  # 将含有函数调用的节点进行分析
+                                               file_path=file_path, context=context)  # 将含有函数调用的节点进行分析
 
                 if isinstance(k_node, php.Variable) and vul_function == 'echo':
                     analysis_variable_node(k_node, back_node, vul_function, vul_lineno, function_params,
-                                           file_path=file_path)
+                                           file_path=file_path, context=context)
 
                 if isinstance(k_node, php.BinaryOp) and vul_function == 'echo':
                     analysis_binaryop_node(k_node, back_node, vul_function, vul_lineno, function_params,
-                                           file_path=file_path)
+                                           file_path=file_path, context=context)
 
                 if isinstance(k_node, php.ArrayOffset) and vul_function == 'echo':
-                    analysis_arrayoffset_node(k_node, vul_function, vul_lineno)
+                    analysis_arrayoffset_node(k_node, vul_function, vul_lineno, context=context)
 
                 if isinstance(k_node, php.TernaryOp) and vul_function == 'echo':
                     analysis_ternaryop_node(k_node, back_node, vul_function, vul_lineno, function_params,
-                                            file_path=file_path)
+                                            file_path=file_path, context=context)
 
 
-def analysis_return(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None):
+def analysis_return(node, back_node, vul_function, vul_lineno, function_params=None, file_path=None, context=None):
     """
     处理return节点
     :param file_path: 
@@ -1239,36 +1532,36 @@ def analysis_return(node, back_node, vul_function, vul_lineno, function_params=N
     :param vul_function:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
-    global scan_results
 
     if int(vul_lineno) == int(node.lineno) and isinstance(node, php.Return):
         if isinstance(node.node, php.FunctionCall):
             analysis_functioncall_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                       file_path=file_path)
+                                       file_path=file_path, context=context)
 
         if isinstance(node.node, php.Variable):  # 直接输出变量信息
             analysis_variable_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                   file_path=file_path)
+                                   file_path=file_path, context=context)
 
         if isinstance(node.node, php.BinaryOp):
             analysis_binaryop_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                   file_path=file_path)
+                                   file_path=file_path, context=context)
 
         if isinstance(node.node, php.ArrayOffset):
-            analysis_arrayoffset_node(node.node, vul_function, vul_lineno)
+            analysis_arrayoffset_node(node.node, vul_function, vul_lineno, context=context)
 
         if isinstance(node.node, php.TernaryOp):
             analysis_ternaryop_node(node.node, back_node, vul_function, vul_lineno, function_params,
-                                    file_path=file_path)
+                                    file_path=file_path, context=context)
 
         if isinstance(node.node, php.Silence):
             nodes = get_silence_params(node.node)
-            analysis(nodes, vul_function, back_node, vul_lineno, file_path)
+            analysis(nodes, vul_function, back_node, vul_lineno, file_path, context=context)
 
 
-def analysis_eval(node, vul_function, back_node, vul_lineno, function_params=None, file_path=None):
+def analysis_eval(node, vul_function, back_node, vul_lineno, function_params=None, file_path=None, context=None):
     """
     处理eval类型节点-->判断节点类型-->不同If分支回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1277,34 +1570,37 @@ def analysis_eval(node, vul_function, back_node, vul_lineno, function_params=Non
     :param back_node:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
-    global scan_results
 
     if vul_function == 'eval' and int(node.lineno) == int(vul_lineno):
         if isinstance(node.expr, php.Variable):
-            analysis_variable_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path)
+            analysis_variable_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path,
+                                   context=context)
 
         if isinstance(node.expr, php.FunctionCall):
             analysis_functioncall_node(node.expr, back_node, vul_function, vul_lineno, function_params,
-                                       file_path=file_path)
+                                       file_path=file_path, context=context)
 
         if isinstance(node.expr, php.BinaryOp):
-            analysis_binaryop_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path)
+            analysis_binaryop_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path,
+                                   context=context)
 
         if isinstance(node.expr, php.ArrayOffset):
-            analysis_arrayoffset_node(node.expr, vul_function, vul_lineno)
+            analysis_arrayoffset_node(node.expr, vul_function, vul_lineno, context=context)
 
         if isinstance(node.expr, php.ObjectProperty):
             analysis_objectproperry_node(node.expr, back_node, vul_function, vul_lineno, function_params,
-                                         file_path=file_path)
+                                         file_path=file_path, context=context)
 
         if isinstance(node.expr, php.Silence):
             nodes = get_silence_params(node.expr)
-            analysis(nodes, vul_function, back_node, vul_lineno, file_path)
+            analysis(nodes, vul_function, back_node, vul_lineno, file_path, context=context)
 
 
-def analysis_file_inclusion(node, vul_function, back_node, vul_lineno, function_params=None, file_path=None):
+def analysis_file_inclusion(node, vul_function, back_node, vul_lineno, function_params=None, file_path=None,
+                            context=None):
     """
     处理include/require类型节点-->判断节点类型-->不同If分支回溯判断参数是否可控-->输出结果
     :param file_path: 
@@ -1313,33 +1609,35 @@ def analysis_file_inclusion(node, vul_function, back_node, vul_lineno, function_
     :param back_node:
     :param vul_lineno:
     :param function_params:
+    :param context:
     :return:
     """
-    global scan_results
     include_fs = ['include', 'include_once', 'require', 'require_once']
 
     if vul_function in include_fs and int(node.lineno) == int(vul_lineno):
         logger.debug('[AST-INCLUDE] {l}-->{r}'.format(l=vul_function, r=vul_lineno))
 
         if isinstance(node.expr, php.Variable):
-            analysis_variable_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path)
+            analysis_variable_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path,
+                                   context=context)
 
         if isinstance(node.expr, php.FunctionCall):
             analysis_functioncall_node(node.expr, back_node, vul_function, vul_lineno, function_params,
-                                       file_path=file_path)
+                                       file_path=file_path, context=context)
 
         if isinstance(node.expr, php.BinaryOp):
-            analysis_binaryop_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path)
+            analysis_binaryop_node(node.expr, back_node, vul_function, vul_lineno, function_params, file_path=file_path,
+                                   context=context)
 
         if isinstance(node.expr, php.ArrayOffset):
-            analysis_arrayoffset_node(node.expr, vul_function, vul_lineno)
+            analysis_arrayoffset_node(node.expr, vul_function, vul_lineno, context=context)
 
         if isinstance(node.expr, php.ObjectProperty):
             analysis_objectproperry_node(node.expr, back_node, vul_function, vul_lineno, function_params,
-                                         file_path=file_path)
+                                         file_path=file_path, context=context)
 
 
-def set_scan_results(is_co, cp, expr_lineno, sink, param, vul_lineno):
+def set_scan_results(is_co, cp, expr_lineno, sink, param, vul_lineno, context=None):
     """
     获取结果信息-->输出结果
     :param is_co:
@@ -1348,11 +1646,9 @@ def set_scan_results(is_co, cp, expr_lineno, sink, param, vul_lineno):
     :param sink:
     :param param:
     :param vul_lineno:
+    :param context:
     :return:
     """
-    results = []
-    global scan_results
-
     result = {
         'code': is_co,
         'source': cp,
@@ -1362,74 +1658,95 @@ def set_scan_results(is_co, cp, expr_lineno, sink, param, vul_lineno):
         'sink_lineno': vul_lineno
     }
     if result['code'] > 0:  # 查出来漏洞结果添加到结果信息中
-        results.append(result)
-        scan_results += results
+        context.scan_results.append(result)
 
 
-def analysis(nodes, vul_function, back_node, vul_lineo, file_path=None, function_params=None):
+def analysis(nodes, vul_function, back_node, vul_lineo, file_path=None, function_params=None, context=None):
     """
     调用FunctionCall-->analysis_functioncall分析调用函数是否敏感
     :param nodes: 所有节点
-    :param vul_function: 要判断的敏感函数名
+    :param vul_function: 要判断的敏感函数名，也可以是敏感函数列表，一次遍历同时分析所有敏感函数
     :param back_node: 各种语法结构里面的语句
     :param vul_lineo: 漏洞函数所在行号
     :param function_params: 自定义函数的所有参数列表
     :param file_path: 当前分析文件的地址
+    :param context:
     :return:
     """
+    if isinstance(vul_function, (list, tuple)):
+        sinks = vul_function
+    else:
+        sinks = [vul_function]
+
     buffer_ = []
     for node in nodes:
         if isinstance(node, php.FunctionCall):  # 函数直接调用，不进行赋值
-            anlysis_function(node, back_node, vul_function, function_params, vul_lineo, file_path=file_path)
+            for sink in sinks:
+                anlysis_function(node, back_node, sink, function_params, vul_lineo, file_path=file_path,
+                                 context=context)
 
         elif isinstance(node, php.Assignment):  # 函数调用在赋值表达式中
             if isinstance(node.expr, php.FunctionCall):
-                anlysis_function(node.expr, back_node, vul_function, function_params, vul_lineo, file_path=file_path)
+                for sink in sinks:
+                    anlysis_function(node.expr, back_node, sink, function_params, vul_lineo, file_path=file_path,
+                                     context=context)
 
             if isinstance(node.expr, php.Eval):
-                analysis_eval(node.expr, vul_function, back_node, vul_lineo, function_params, file_path=file_path)
+                for sink in sinks:
+                    analysis_eval(node.expr, sink, back_node, vul_lineo, function_params, file_path=file_path,
+                                  context=context)
 
             if isinstance(node.expr, php.Silence):
                 buffer_.append(node.expr)
-                analysis(buffer_, vul_function, back_node, vul_lineo, file_path, function_params)
+                analysis(buffer_, vul_function, back_node, vul_lineo, file_path, function_params, context=context)
 
         elif isinstance(node, php.Return):
-            analysis_return(node, back_node, vul_function, vul_lineo, function_params, file_path=file_path)
+            for sink in sinks:
+                analysis_return(node, back_node, sink, vul_lineo, function_params, file_path=file_path,
+                                context=context)
 
         elif isinstance(node, php.Print) or isinstance(node, php.Echo):
-            analysis_echo_print(node, back_node, vul_function, vul_lineo, function_params, file_path=file_path)
+            for sink in sinks:
+                analysis_echo_print(node, back_node, sink, vul_lineo, function_params, file_path=file_path,
+                                    context=context)
 
         elif isinstance(node, php.Silence):
             nodes = get_silence_params(node)
-            analysis(nodes, vul_function, back_node, vul_lineo, file_path)
+            analysis(nodes, vul_function, back_node, vul_lineo, file_path, context=context)
 
         elif isinstance(node, php.Eval):
-            analysis_eval(node, vul_function, back_node, vul_lineo, function_params, file_path=file_path)
+            for sink in sinks:
+                analysis_eval(node, sink, back_node, vul_lineo, function_params, file_path=file_path,
+                              context=context)
 
         elif isinstance(node, php.Include) or isinstance(node, php.Require):
-            analysis_file_inclusion(node, vul_function, back_node, vul_lineo, function_params, file_path=file_path)
+            for sink in sinks:
+                analysis_file_inclusion(node, sink, back_node, vul_lineo, function_params, file_path=file_path,
+                                        context=context)
 
         elif isinstance(node, php.If):  # 函数调用在if-else语句中时
-            analysis_if_else(node, back_node, vul_function, vul_lineo, function_params, file_path=file_path)
+            analysis_if_else(node, back_node, vul_function, vul_lineo, function_params, file_path=file_path,
+                             context=context)
 
         elif isinstance(node, php.While) or isinstance(node, php.For):  # 函数调用在循环中
             if isinstance(node.node, php.Block):
-                analysis(node.node.nodes, vul_function, back_node, vul_lineo, file_path, function_params)
+                analysis(node.node.nodes, vul_function, back_node, vul_lineo, file_path, function_params,
+                         context=context)
 
         elif isinstance(node, php.Function) or isinstance(node, php.Method):
             function_body = []
             function_params = get_function_params(node.params)
 
             analysis(node.nodes, vul_function, function_body, vul_lineo, function_params=function_params,
-                     file_path=file_path)
+                     file_path=file_path, context=context)
 
         elif isinstance(node, php.Class):
-            analysis(node.nodes, vul_function, back_node, vul_lineo, file_path, function_params)
+            analysis(node.nodes, vul_function, back_node, vul_lineo, file_path, function_params, context=context)
 
         back_node.append(node)
 
 
-def scan_parser(code_content, sensitive_func, vul_lineno, file_path, repair_functions=[]):
+def scan_parser(code_content, sensitive_func, vul_lineno, file_path, repair_functions=[], context=None):
     """
     开始检测函数
     :param repair_functions: 
@@ -1437,19 +1754,43 @@ def scan_parser(code_content, sensitive_func, vul_lineno, file_path, repair_func
     :param sensitive_func: 要检测的敏感函数,传入的为函数列表
     :param vul_lineno: 漏洞函数所在行号
     :param file_path: 文件路径
+    :param context:
     :return:
     """
-    try:
-        global scan_results, is_repair_functions
-        scan_results = []
-        is_repair_functions = repair_functions
-        parser = make_parser()
-        all_nodes = parser.parse(code_content, debug=False, lexer=lexer.clone(), tracking=with_line)
+    if context is None:
+        context = AnalysisContext(repair_functions)
+    else:
+        context.repair_functions = repair_functions
 
-        for func in sensitive_func:  # 循环判断代码中是否存在敏感函数，若存在，递归判断参数是否可控;对文件内容循环判断多次
+    context.scan_results = []
+    context.back_cache = {}
+    context.def_use = {}
+
+    try:
+        all_nodes = parse_scope(code_content, vul_lineno, file_path, context)
+        if all_nodes is not None:
+            analysis(all_nodes, list(sensitive_func), [], int(vul_lineno), file_path, function_params=None,
+                     context=context)
+
+            if [result for result in context.scan_results if result['code'] == 3]:
+                # 回溯到了函数之外，扩大到整个文件
+                logger.debug("[AST] [SCOPE] sink out of scope, parse whole file {}".format(file_path))
+                context.scan_results = []
+                context.back_cache = {}
+                context.def_use = {}
+                all_nodes = None
+
+        if all_nodes is None:
+            all_nodes = context.include_graph.parse_code(code_content, file_path)
+
+            # 一次遍历语法树分析所有敏感函数
             back_node = []
-            analysis(all_nodes, func, back_node, int(vul_lineno), file_path, function_params=None)
+            analysis(all_nodes, list(sensitive_func), back_node, int(vul_lineno), file_path, function_params=None,
+                     context=context)
+
+        # 结果按敏感函数的顺序排列
+        context.scan_results.sort(key=lambda result: sensitive_func.index(result['sink']))
     except SyntaxError as e:
         logger.warning('[AST] [ERROR]:{e}'.format(e=e))
 
-    return scan_results
+    return context.scan_results
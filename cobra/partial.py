@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.partial
+    ~~~~~~~~~~~~~
+
+    Parse only the top-level statements around a line and recover
+    from syntax errors in the rest of the file
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import hashlib
+from phply.phplex import lexer
+from phply import phpast as php
+from .log import logger
+from .tokens import TokenStream
+
+with_line = True
+
+# 以右大括号结束的语句
+block_keywords = ('FUNCTION', 'CLASS', 'ABSTRACT', 'FINAL', 'INTERFACE', 'TRAIT', 'IF', 'FOR', 'FOREACH', 'WHILE',
+                  'DO', 'SWITCH', 'TRY', 'NAMESPACE', 'DECLARE', 'PUBLIC', 'PROTECTED', 'PRIVATE', 'STATIC')
+
+# 右大括号之后还属于同一条语句的关键字
+continuation_keywords = ('ELSE', 'ELSEIF', 'CATCH', 'FINALLY', 'WHILE')
+
+# 可以使用冒号语法的语句
+alternative_keywords = ('IF', 'FOR', 'FOREACH', 'WHILE', 'SWITCH', 'DECLARE')
+alternative_ends = ('ENDIF', 'ENDFOR', 'ENDFOREACH', 'ENDWHILE', 'ENDSWITCH', 'ENDDECLARE')
+
+class_keywords = ('CLASS', 'ABSTRACT', 'FINAL', 'INTERFACE', 'TRAIT')
+
+
+def lex_tokens(code_content):
+    """
+    词法分析，出现无法识别的字符时返回之前的token
+    :param code_content:
+    :return:
+    """
+    return TokenStream(code_content).tokens
+
+
+def split_tokens(tokens):
+    """
+    在顶层语句、函数、类的边界切分token
+    :param tokens:
+    :return: [(起始token位置, 结束token位置)]
+    """
+    segments = []
+    start = 0
+    braces = 0
+    parens = 0
+    alternative = 0
+    pending_control = False
+    control_paren = False
+    closed_control = False
+
+    for i, token in enumerate(tokens):
+        token_type = token.type
+        end = False
+        just_closed = False
+
+        if token_type in ('LBRACE', 'CURLY_OPEN', 'DOLLAR_OPEN_CURLY_BRACES'):
+            braces += 1
+
+        elif token_type == 'RBRACE':
+            braces = max(braces - 1, 0)
+            if braces == 0 and parens == 0 and alternative == 0 and tokens[start].type in block_keywords:
+                next_type = tokens[i + 1].type if i + 1 < len(tokens) else None
+                end = next_type not in continuation_keywords
+
+        elif token_type == 'LPAREN':
+            if pending_control and parens == 0:
+                control_paren = True
+            pending_control = False
+            parens += 1
+
+        elif token_type == 'RPAREN':
+            parens = max(parens - 1, 0)
+            if parens == 0 and control_paren:
+                control_paren = False
+                just_closed = True
+
+        elif token_type == 'COLON':
+            if closed_control:
+                alternative += 1
+
+        elif token_type in alternative_ends:
+            alternative = max(alternative - 1, 0)
+
+        elif token_type in alternative_keywords and parens == 0:
+            pending_control = True
+
+        elif token_type == 'SEMI' or token_type == 'INLINE_HTML':
+            end = braces == 0 and parens == 0 and alternative == 0
+
+        closed_control = just_closed
+
+        if end:
+            segments.append((start, i))
+            start = i + 1
+
+    if start < len(tokens):
+        segments.append((start, len(tokens) - 1))
+
+    return segments
+
+
+def segment_source(code_content, ranges, lineno, html=False):
+    """
+    生成片段的代码，用换行补齐使节点的行号与原文件一致
+    :param code_content:
+    :param ranges: [(起始字符位置, 结束字符位置)]
+    :param lineno: 片段第一行的行号
+    :param html: 片段是否以html开始
+    :return:
+    """
+    parts = ['<?php ', '\n' * (lineno - 1)]
+    if html:
+        parts.append('?>')
+
+    last = None
+    for start, end in ranges:
+        if last is not None:
+            parts.append('\n' * code_content.count('\n', last, start))
+        parts.append(code_content[start:end])
+        last = end
+
+    return ''.join(parts)
+
+
+def segment_end(code_content, tokens, end):
+    """
+    片段结束的字符位置，包括片段之后的空白和注释
+    :param code_content:
+    :param tokens:
+    :param end: 片段最后一个token的位置
+    :return:
+    """
+    return tokens[end + 1].lexpos if end + 1 < len(tokens) else len(code_content)
+
+
+def class_body(tokens, start, end):
+    """
+    获取类定义中左大括号的位置
+    :param tokens:
+    :param start:
+    :param end:
+    :return: 类体左大括号的token位置，不是完整的类定义时返回None
+    """
+    body = start
+    while body <= end and tokens[body].type != 'LBRACE':
+        body += 1
+
+    if body >= end or tokens[end].type != 'RBRACE':
+        return None
+    return body
+
+
+def scope_region(code_content, tokens, lineno):
+    """
+    根据token切分的结果定位行号所在的函数或方法，类方法会带上类的属性和构造函数
+    :param code_content:
+    :param tokens:
+    :param lineno:
+    :return: ([(起始字符位置, 结束字符位置)], 起始行号)，不在函数或方法中时返回None
+    """
+    for start, end in split_tokens(tokens):
+        if tokens[start].lineno <= lineno <= tokens[end].lineno:
+            break
+    else:
+        return None
+
+    if tokens[start].type == 'FUNCTION':
+        return [(tokens[start].lexpos, segment_end(code_content, tokens, end))], tokens[start].lineno
+
+    if tokens[start].type not in class_keywords:
+        return None
+
+    body = class_body(tokens, start, end)
+    if body is None:
+        return None
+
+    ranges = [(tokens[start].lexpos, tokens[body].lexpos + 1)]
+    found = False
+    member_tokens = tokens[body + 1:end]
+    for member_start, member_end in split_tokens(member_tokens):
+        types = [token.type for token in member_tokens[member_start:member_end + 1]]
+        begin = member_tokens[member_start].lexpos
+        finish = member_tokens[member_end + 1].lexpos if member_end + 1 < len(member_tokens) else tokens[end].lexpos
+
+        if member_tokens[member_start].lineno <= lineno <= member_tokens[member_end].lineno:
+            found = 'FUNCTION' in types
+            ranges.append((begin, finish))
+        elif 'FUNCTION' not in types:
+            # 属性和常量
+            ranges.append((begin, finish))
+        else:
+            name = member_tokens[member_start + types.index('FUNCTION') + 1].value
+            if name.lower() == '__construct':
+                ranges.append((begin, finish))
+
+    if not found:
+        return None
+
+    ranges.append((tokens[end].lexpos, tokens[end].lexpos + 1))
+    return ranges, tokens[start].lineno
+
+
+class PartialParser(object):
+    """
+    phply解析失败时，按顶层语句切分文件分别解析，跳过失败的片段
+    失败的片段按内容记录，同一次扫描中不会重复解析
+    """
+
+    def __init__(self, parser, failed=None):
+        self.parser = parser
+        self.failed = failed if failed is not None else set()  # 解析失败的片段
+        self.skipped = []  # 本次跳过的片段行号范围
+
+    def parse(self, code_content, tokens=None):
+        """
+        分片段解析代码
+        :param code_content:
+        :param tokens: 已有的token，为空时重新词法分析
+        :return: 所有解析成功的片段的节点
+        """
+        if tokens is None:
+            tokens = lex_tokens(code_content)
+        all_nodes = []
+
+        for start, end in split_tokens(tokens):
+            nodes = self.parse_segment(code_content, tokens, start, end)
+            if nodes is None and tokens[start].type in class_keywords:
+                nodes = self.parse_class(code_content, tokens, start, end)
+
+            if nodes is None:
+                self.skipped.append((tokens[start].lineno, tokens[end].lineno))
+                continue
+
+            all_nodes.extend(nodes)
+
+        logger.info("[AST] [PARTIAL] {} segments skipped: {}".format(len(self.skipped), self.skipped))
+        return all_nodes
+
+    def parse_source(self, source):
+        """
+        解析一段代码，记录失败的代码
+        :param source:
+        :return:
+        """
+        key = hashlib.md5(source.encode('utf-8')).hexdigest()
+        if key in self.failed:
+            return None
+
+        try:
+            return self.parser.parse(source, debug=False, lexer=lexer.clone(), tracking=with_line)
+        except SyntaxError as e:
+            logger.debug("[AST] [PARTIAL] segment error: {}".format(e))
+            self.failed.add(key)
+            return None
+
+    def parse_segment(self, code_content, tokens, start, end):
+        """
+        解析[start, end]范围的token对应的代码
+        :param code_content:
+        :param tokens:
+        :param start:
+        :param end:
+        :return:
+        """
+        begin = tokens[start].lexpos
+        finish = segment_end(code_content, tokens, end)
+        source = segment_source(code_content, [(begin, finish)], tokens[start].lineno,
+                                html=tokens[start].type == 'INLINE_HTML')
+        return self.parse_source(source)
+
+    def parse_class(self, code_content, tokens, start, end):
+        """
+        类解析失败时，单独解析类中的每个成员，保留解析成功的成员
+        :param code_content:
+        :param tokens:
+        :param start:
+        :param end:
+        :return:
+        """
+        body = class_body(tokens, start, end)
+        if body is None:
+            return None
+
+        header = (tokens[start].lexpos, tokens[body].lexpos + 1)
+        closing = (tokens[end].lexpos, tokens[end].lexpos + 1)
+        lineno = tokens[start].lineno
+
+        class_nodes = self.parse_source(segment_source(code_content, [header, closing], lineno))
+        if not class_nodes or not isinstance(class_nodes[0], php.Class):
+            return None
+
+        members = []
+        member_tokens = tokens[body + 1:end]
+        for member_start, member_end in split_tokens(member_tokens):
+            begin = member_tokens[member_start].lexpos
+            if member_end + 1 < len(member_tokens):
+                finish = member_tokens[member_end + 1].lexpos
+            else:
+                finish = tokens[end].lexpos
+
+            nodes = self.parse_source(segment_source(code_content, [header, (begin, finish), closing], lineno))
+            if nodes:
+                members.extend(nodes[0].nodes)
+            else:
+                self.skipped.append((member_tokens[member_start].lineno, member_tokens[member_end].lineno))
+
+        class_nodes[0].nodes = members
+        return class_nodes
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.prune
+    ~~~~~~~~~~~
+
+    Skip candidates in files that cannot reach a taint source
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from . import const
+from .log import logger
+
+include_types = ('INCLUDE', 'INCLUDE_ONCE', 'REQUIRE', 'REQUIRE_ONCE')
+
+
+class SourcePruner(object):
+    """
+    语法分析之前用token判断文件中是否不可能有用户可控的输入到达敏感函数，
+    可控结果只来自controlled_params中的变量、被包含的文件、使用了可控变量的常量以及函数参数(生成新规则)，
+    文件中都没有时跳过语法分析
+    """
+
+    def __init__(self, include_graph):
+        self.include_graph = include_graph
+        self.files = {}  # 文件 -> 不能跳过的原因，可以跳过时为None
+        self.checked = 0
+        self.skipped = 0
+
+    def skip(self, file_path):
+        """
+        判断候选漏洞所在的文件是否可以跳过语法分析，并统计跳过的数量
+        :param file_path:
+        :return:
+        """
+        if file_path not in self.files:
+            self.files[file_path] = self.reason(file_path)
+            logger.debug("[AST] [PRUNE] {}: {}".format(file_path, self.files[file_path] or 'no source'))
+
+        # 缓存的结果同样依赖文件本身，检查过常量定义时依赖整个项目
+        self.include_graph.record(file_path)
+        if self.files[file_path] is None or self.files[file_path].startswith('constant'):
+            self.include_graph.record('*')
+
+        self.checked += 1
+        if self.files[file_path] is None:
+            self.skipped += 1
+            return True
+        return False
+
+    def reason(self, file_path):
+        """
+        文件中可能存在污点的原因
+        :param file_path:
+        :return: 没有可能的污点时返回None
+        """
+        stream = self.include_graph.tokens(file_path)
+        if stream is None or stream.error is not None:
+            return 'lexer error'
+
+        tokens = stream.tokens
+        names = set()
+        for i, token in enumerate(tokens):
+            if token.type == 'VARIABLE' and token.value in const.controlled_params:
+                return 'source {}'.format(token.value)
+
+            if token.type in include_types:
+                return 'include'
+
+            if token.type == 'FUNCTION' and function_params(tokens, i):
+                return 'function params'
+
+            if token.type == 'STRING':
+                names.add(token.value)
+
+        for name in names:
+            if self.include_graph.constant_sources(name):
+                return 'constant {}'.format(name)
+
+        return None
+
+    def report(self):
+        """
+        输出跳过的比例
+        :return:
+        """
+        if self.checked:
+            logger.info("[SCAN] [PRUNE] {} / {} candidates ({:.1f}%) skipped without AST analysis".format(
+                self.skipped, self.checked, self.skipped * 100.0 / self.checked))
+
+
+def function_params(tokens, start):
+    """
+    start位置的函数定义是否有参数
+    :param tokens:
+    :param start: function token的位置
+    :return:
+    """
+    parens = 0
+    for index in range(start + 1, len(tokens)):
+        token = tokens[index]
+        if token.type == 'LPAREN':
+            parens += 1
+        elif token.type == 'RPAREN':
+            parens -= 1
+            if parens == 0:
+                return False
+        elif token.type == 'VARIABLE' and parens > 0:
+            return True
+
+    return False
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.tokens
+    ~~~~~~~~~~~~
+
+    Token stream recorded once per file, replayed for parsing and
+    used for line, variable and call-site lookups
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import copy
+from phply.phplex import lexer, FilteredLexer
+from .log import logger
+
+comment_types = ('COMMENT', 'DOC_COMMENT')
+string_types = ('CONSTANT_ENCAPSED_STRING', 'ENCAPSED_AND_WHITESPACE')
+
+# 不以函数名token出现的函数调用
+construct_types = ('EVAL', 'INCLUDE', 'INCLUDE_ONCE', 'REQUIRE', 'REQUIRE_ONCE', 'ECHO', 'PRINT', 'EXIT', 'ISSET',
+                   'EMPTY', 'UNSET')
+
+# 出现在这些token之后的名字不是函数调用
+not_call_types = ('FUNCTION', 'NEW', 'OBJECT_OPERATOR', 'DOUBLE_COLON')
+
+# 参数中的括号
+open_types = ('LPAREN', 'LBRACKET', 'LBRACE', 'CURLY_OPEN', 'DOLLAR_OPEN_CURLY_BRACES')
+close_types = ('RPAREN', 'RBRACKET', 'RBRACE')
+
+
+class RecordingLexer(FilteredLexer):
+    """
+    与phply的FilteredLexer过滤方式一致，同时记录过滤前的所有token
+    """
+
+    def __init__(self, lexer, raw):
+        super(RecordingLexer, self).__init__(lexer)
+        self.raw = raw
+
+    def next_lexer_token(self):
+        t = self.lexer.token()
+        if t is not None:
+            # FilteredLexer会改写close tag等token的类型，保存原始的token
+            self.raw.append(copy.copy(t))
+        return t
+
+
+class ReplayLexer(object):
+    """
+    按缓存的token流重放的词法分析器，给phply的语法分析使用
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.index = 0
+        self.lineno = 1
+        self.lexpos = 0
+
+    def clone(self):
+        return ReplayLexer(self.stream)
+
+    def input(self, data):
+        self.index = 0
+        self.lineno = 1
+        self.lexpos = 0
+
+    def token(self):
+        stream = self.stream
+        if self.index < len(stream.tokens):
+            t = stream.tokens[self.index]
+            self.lineno, self.lexpos = stream.positions[self.index]
+            self.index += 1
+            return t
+
+        self.lineno, self.lexpos = stream.end
+        if stream.error is not None:
+            raise SyntaxError(*stream.error.args)
+        return None
+
+
+class TokenStream(object):
+    """
+    单个文件的token流，注释、字符串、变量、函数边界和函数调用都从这里查询
+    """
+
+    def __init__(self, code_content):
+        self.code_content = code_content
+        self.raw = []  # 所有token，包括空白、注释和php标签
+        self.tokens = []  # 语法分析使用的token
+        self.positions = []  # 每个语法分析token之后词法分析器的(行号, 位置)
+        self.end = (1, 0)
+        self.error = None  # 词法分析的错误
+
+        self._lines = None
+        self._offsets = None
+        self._comment_lines = None
+        self._functions = None
+        self._calls = None
+
+        lx = RecordingLexer(lexer.clone().lexer, self.raw)
+        lx.input(code_content)
+        try:
+            while True:
+                token = lx.token()
+                if token is None:
+                    break
+                self.tokens.append(token)
+                self.positions.append((lx.lineno, lx.lexpos))
+        except SyntaxError as e:
+            logger.warning("[AST] [TOKEN] lexer error: {}".format(e))
+            self.error = e
+
+        self.end = (lx.lineno, lx.lexpos)
+
+    def lexer(self):
+        """
+        获取重放token流的词法分析器
+        :return:
+        """
+        return ReplayLexer(self)
+
+    def line(self, lineno):
+        """
+        获取某一行的代码，包括换行符
+        :param lineno:
+        :return:
+        """
+        if self._lines is None:
+            self._lines = self.code_content.split('\n')
+
+        if not 0 < int(lineno) <= len(self._lines):
+            return ''
+        if int(lineno) == len(self._lines):
+            return self._lines[-1]
+        return self._lines[int(lineno) - 1] + '\n'
+
+    def line_offset(self, lineno):
+        """
+        某一行第一个字符在代码中的位置
+        :param lineno:
+        :return:
+        """
+        if self._offsets is None:
+            offsets = [0]
+            for line in self.code_content.split('\n'):
+                offsets.append(offsets[-1] + len(line) + 1)
+            self._offsets = offsets
+
+        return self._offsets[int(lineno) - 1]
+
+    def comments(self):
+        """
+        所有注释token
+        :return:
+        """
+        return [token for token in self.raw if token.type in comment_types]
+
+    def comment_lines(self):
+        """
+        注释覆盖的行号
+        :return:
+        """
+        if self._comment_lines is None:
+            lines = set()
+            for token in self.comments():
+                lines.update(range(token.lineno, token.lineno + token.value.rstrip('\n').count('\n') + 1))
+            self._comment_lines = lines
+
+        return self._comment_lines
+
+    def strings(self, lineno=None):
+        """
+        字符串token的值
+        :param lineno: 只获取该行的字符串，为空时获取全部
+        :return:
+        """
+        return [token.value for token in self.raw
+                if token.type in string_types and (lineno is None or token.lineno == int(lineno))]
+
+    def variables(self, lineno=None, code=None):
+        """
+        按出现顺序获取变量名
+        :param lineno: 只获取该行的变量，为空时获取全部
+        :param code: 只获取该行中这段代码第一次出现位置内的变量，需要同时指定行号
+        :return: 代码不在该行中时返回None
+        """
+        if code is None:
+            return [token.value for token in self.tokens
+                    if token.type == 'VARIABLE' and (lineno is None or token.lineno == int(lineno))]
+
+        column = self.line(lineno).find(code)
+        if column < 0:
+            return None
+
+        start = self.line_offset(lineno) + column
+        end = start + len(code)
+        return [token.value for token in self.tokens
+                if token.type == 'VARIABLE' and start <= token.lexpos and token.lexpos + len(token.value) <= end]
+
+    def functions(self):
+        """
+        所有具名函数和方法的边界
+        :return: [(函数名, 起始行号, 结束行号)]，按起始行号排列
+        """
+        if self._functions is not None:
+            return self._functions
+
+        functions = []
+        tokens = self.tokens
+        for i, token in enumerate(tokens):
+            if token.type != 'FUNCTION':
+                continue
+
+            name = i + 1
+            if name < len(tokens) and tokens[name].type == 'AND':
+                name += 1
+            if name >= len(tokens) or tokens[name].type != 'STRING':
+                # 匿名函数
+                continue
+
+            functions.append((tokens[name].value, token.lineno, self.block_end(name)))
+
+        self._functions = functions
+        return functions
+
+    def block_end(self, start):
+        """
+        从start开始的第一个代码块结束的行号，没有代码块时为语句结束的行号
+        :param start:
+        :return:
+        """
+        tokens = self.tokens
+        braces = 0
+        parens = 0
+        for index in range(start, len(tokens)):
+            token = tokens[index]
+            if token.type in ('LBRACE', 'CURLY_OPEN', 'DOLLAR_OPEN_CURLY_BRACES'):
+                braces += 1
+            elif token.type == 'RBRACE':
+                braces -= 1
+                if braces == 0:
+                    return token.lineno
+            elif token.type == 'LPAREN':
+                parens += 1
+            elif token.type == 'RPAREN':
+                parens -= 1
+            elif token.type == 'SEMI' and braces == 0 and parens == 0:
+                return token.lineno
+
+        return tokens[-1].lineno if tokens else 1
+
+    def calls(self):
+        """
+        函数调用和类实例化的位置和参数，方法调用和静态方法调用不包括在内
+        :return: {小写的函数名或者`new 类名`: [(行号, 参数, 调用结束的行号)]}，
+                 参数见arguments，没有括号的调用参数为None
+        """
+        if self._calls is not None:
+            return self._calls
+
+        calls = {}
+        tokens = self.tokens
+        for i, token in enumerate(tokens):
+            if token.type in construct_types:
+                name = token.value.lower()
+            elif token.type == 'STRING' and i > 0 and tokens[i - 1].type == 'NEW':
+                name = 'new ' + token.value.lower()
+            elif token.type == 'STRING' and i + 1 < len(tokens) and tokens[i + 1].type == 'LPAREN':
+                if i > 0 and tokens[i - 1].type in not_call_types:
+                    continue
+                if i > 1 and tokens[i - 1].type == 'AND' and tokens[i - 2].type == 'FUNCTION':
+                    continue
+                name = token.value.lower()
+            else:
+                continue
+
+            if i + 1 < len(tokens) and tokens[i + 1].type == 'LPAREN':
+                arguments, end_lineno = self.arguments(i + 1)
+            else:
+                arguments, end_lineno = None, token.lineno
+            calls.setdefault(name, []).append((token.lineno, arguments, end_lineno))
+
+        self._calls = calls
+        return calls
+
+    def arguments(self, start):
+        """
+        调用的参数位置
+        :param start: 参数左括号的位置
+        :return: ([(参数起始字符位置, 参数结束字符位置)], 右括号所在行号)，括号不完整时参数为None
+        """
+        tokens = self.tokens
+        depth = 0
+        arguments = []
+        begin = end = None
+        for index in range(start, len(tokens)):
+            token = tokens[index]
+            if token.type in close_types:
+                depth -= 1
+                if depth == 0:
+                    if begin is not None:
+                        arguments.append((begin, end))
+                    return arguments, token.lineno
+            elif token.type == 'COMMA' and depth == 1:
+                arguments.append((begin, end))
+                begin = end = None
+                continue
+
+            if token.type in open_types:
+                depth += 1
+                if depth == 1:
+                    continue
+
+            if begin is None:
+                begin = token.lexpos
+            end = token.lexpos + len(str(token.value))
+
+        return None, tokens[-1].lineno
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+
+"""
+    cobra.worklist
+    ~~~~~~~~~~~~~~
+
+    Worklist engine for taint back-tracking, an alternative to the
+    recursive parameters_back
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from phply import phpast as php
+from . import const
+from .log import logger
+
+# 结果优先级，多条路径的结果合并时取优先级最高的
+result_rank = {
+    1: 5,
+    4: 4,
+    3: 3,
+    2: 2,
+    -1: 1,
+}
+
+# 不透明的表达式，无法继续回溯，结果为3
+opaque_nodes = (php.MethodCall, php.StaticMethodCall, php.New, php.ObjectProperty, php.StaticProperty)
+
+
+def result_key(result):
+    """
+    合并多条路径的结果时的比较顺序，优先级相同时按行号和污点比较，与路径的访问顺序无关
+    :param result: (is_co, cp, expr_lineno)
+    :return:
+    """
+    is_co, cp, expr_lineno = result
+    try:
+        expr_lineno = int(expr_lineno or 0)
+    except (TypeError, ValueError):
+        expr_lineno = 0
+    return result_rank[is_co], expr_lineno, repr(cp)
+
+
+def block_nodes(node):
+    """
+    将语句或代码块统一成语句列表
+    :param node:
+    :return:
+    """
+    if node is None:
+        return []
+    if isinstance(node, php.Block):
+        return node.nodes
+    if isinstance(node, list):
+        return node
+    return [node]
+
+
+def branch_nodes(node):
+    """
+    获取复合语句中的所有分支的语句列表
+    :param node:
+    :return:
+    """
+    if isinstance(node, php.If):
+        branches = [block_nodes(node.node)]
+        for elseif in node.elseifs:
+            branches.append(block_nodes(elseif.node))
+        if node.else_ is not None:
+            branches.append(block_nodes(node.else_.node))
+        return branches
+
+    if isinstance(node, (php.While, php.DoWhile, php.For, php.Foreach)):
+        return [block_nodes(node.node)]
+
+    if isinstance(node, php.Block):
+        return [node.nodes]
+
+    if isinstance(node, php.Switch):
+        return [case.nodes for case in node.nodes]
+
+    if isinstance(node, php.Try):
+        branches = [node.nodes]
+        for catch in node.catches:
+            branches.append(catch.nodes)
+        finally_ = getattr(node, 'finally')
+        if finally_ is not None:
+            branches.append(block_nodes(finally_.nodes))
+        return branches
+
+    return []
+
+
+def last_before(nodes, lineno):
+    """
+    获取列表中最后一个行号不大于lineno的节点位置
+    :param nodes:
+    :param lineno:
+    :return:
+    """
+    index = -1
+    for i, node in enumerate(nodes):
+        node_lineno = getattr(node, 'lineno', None)
+        if node_lineno is None:
+            continue
+        if node_lineno > lineno:
+            break
+        index = i
+    return index
+
+
+class WorklistEngine(object):
+    """
+    基于显式工作队列的污点回溯，返回值与parameters_back一致(1/2/3/4/-1)
+    工作项为(污点变量, 语句位置栈, 作用域)，使用扫描的候选预算代替递归深度，预算耗尽时抛出BudgetExceededException
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.steps = 0
+        self.functions = {}
+        self.vul_function = None
+
+    def back(self, param, all_nodes, lineno, file_path, vul_function=None):
+        """
+        从敏感函数所在行开始回溯污点
+        :param param: 污点变量名
+        :param all_nodes: 文件的全部语法树节点
+        :param lineno: 敏感函数所在行号
+        :param file_path:
+        :param vul_function:
+        :return: is_co, cp, expr_lineno
+        """
+        if param in const.controlled_params:
+            return 1, php.Variable(param), 0
+
+        if not param.startswith('$'):
+            # 字符串常量，不可控
+            return -1, php.Variable(param), 0
+
+        self.vul_function = vul_function
+        self.functions = dict((node.name.lower(), node) for node in all_nodes if isinstance(node, php.Function))
+
+        frames, scope = self.locate(all_nodes, int(lineno), file_path)
+        worklist = [(param, frames, scope)]
+        visited = set()
+        result = None
+
+        while worklist:
+            item = worklist.pop()
+            key = (item[0], tuple((id(f[0]), f[1]) for f in item[1]), self.scope_key(item[2]))
+            if key in visited:
+                continue
+            visited.add(key)
+            self.steps += 1
+            if self.context.budget is not None:
+                self.context.budget.step()
+
+            for found in self.step(item, worklist):
+                if result is None or result_key(found) > result_key(result):
+                    result = found
+                if found[0] == 1:
+                    # 可控是最高的优先级，结论不会再变化
+                    logger.debug("[Worklist] found controllable source {} in line {}".format(found[1], found[2]))
+                    return result
+
+        if result is None:
+            return 3, php.Variable(param), 0
+        return result
+
+    @staticmethod
+    def scope_key(scope):
+        """
+        作用域的唯一标识，包含完整的调用链
+        :param scope:
+        :return:
+        """
+        key = []
+        while scope is not None:
+            key.append(id(scope['function']))
+            scope = scope['caller'][2] if scope['caller'] is not None else None
+        return tuple(key)
+
+    def locate(self, nodes, lineno, file_path):
+        """
+        定位敏感函数所在的语句位置，返回回溯起点的位置栈和作用域
+        :param nodes:
+        :param lineno:
+        :param file_path:
+        :return:
+        """
+        frames = []
+        scope = None
+        klass = None
+
+        while True:
+            index = last_before(nodes, lineno)
+            if index == -1:
+                frames.append((nodes, -1, file_path))
+                break
+
+            node = nodes[index]
+            if isinstance(node, (php.Function, php.Method)) and node.lineno < lineno:
+                # 敏感函数在函数中，只回溯函数内的语句
+                frames = []
+                scope = {'function': node, 'class': klass, 'caller': None}
+                nodes = node.nodes
+                continue
+
+            if isinstance(node, php.Class) and node.lineno < lineno:
+                frames = []
+                klass = node
+                nodes = node.nodes
+                continue
+
+            branch = None
+            for branch_node in branch_nodes(node):
+                if last_before(branch_node, lineno) != -1:
+                    branch = branch_node
+
+            if branch is None:
+                frames.append((nodes, index - 1, file_path))
+                break
+
+            frames.append((nodes, index - 1, file_path))
+            nodes = branch
+
+        return tuple(frames), scope
+
+    def step(self, item, worklist):
+        """
+        处理一个工作项，新的工作项加入队列，返回该路径上得到的结果
+        :param item:
+        :param worklist:
+        :return:
+        """
+        taint, frames, scope = item
+        nodes, index, file_path = frames[-1]
+
+        if index < 0:
+            if len(frames) > 1:
+                worklist.append((taint, frames[:-1], scope))
+                return []
+            return self.finish(taint, scope, worklist)
+
+        node = nodes[index]
+        rest = frames[:-1] + ((nodes, index - 1, file_path),)
+
+        if isinstance(node, php.Assignment):
+            target = self.target_name(node.node)
+            if target != taint:
+                worklist.append((taint, rest, scope))
+                return []
+
+            if isinstance(node.node, php.ArrayOffset):
+                # 数组元素赋值不会覆盖整个数组
+                worklist.append((taint, rest, scope))
+            return self.assign(node.expr, node.lineno, rest, scope, worklist)
+
+        if isinstance(node, php.AssignOp):
+            worklist.append((taint, rest, scope))
+            if self.target_name(node.left) == taint:
+                return self.assign(node.right, node.lineno, rest, scope, worklist)
+            return []
+
+        if isinstance(node, php.ListAssignment):
+            names = [self.target_name(n) for n in node.nodes if n is not None]
+            if taint in names:
+                return self.assign(node.expr, node.lineno, rest, scope, worklist)
+            worklist.append((taint, rest, scope))
+            return []
+
+        if isinstance(node, php.Foreach):
+            names = [self.target_name(getattr(n, 'name', n)) for n in (node.keyvar, node.valvar) if n is not None]
+            worklist.append((taint, rest, scope))
+            for branch in branch_nodes(node):
+                worklist.append((taint, rest + ((branch, len(branch) - 1, file_path),), scope))
+            if taint in names:
+                return self.assign(node.expr, node.lineno, rest, scope, worklist)
+            return []
+
+        if isinstance(node, php.Include) and scope is None:
+            worklist.append((taint, rest, scope))
+            self.include(taint, node, rest, worklist)
+            return []
+
+        # 分支语句: 每个分支和跳过分支都是一条路径
+        worklist.append((taint, rest, scope))
+        for branch in branch_nodes(node):
+            worklist.append((taint, rest + ((branch, len(branch) - 1, file_path),), scope))
+        return []
+
+    def include(self, taint, node, rest, worklist):
+        """
+        进入被包含的文件继续回溯
+        :param taint:
+        :param node:
+        :param rest:
+        :param worklist:
+        :return:
+        """
+        file_path = rest[-1][2]
+        graph = self.context.include_graph
+        include_path = graph.resolve(node, file_path)
+        if include_path is None or include_path in [f[2] for f in rest]:
+            return
+
+        include_nodes = graph.parse(include_path)
+        if include_nodes:
+            logger.debug("[Worklist] follow include {} for {}".format(include_path, taint))
+            worklist.append((taint, rest + ((include_nodes, len(include_nodes) - 1, include_path),), None))
+
+    def assign(self, expr, lineno, rest, scope, worklist):
+        """
+        找到污点的赋值语句，分析赋值表达式
+        :param expr:
+        :param lineno:
+        :param rest: 赋值语句之前的位置栈
+        :param scope:
+        :param worklist:
+        :return:
+        """
+        if isinstance(expr, php.FunctionCall) and expr.name in self.context.repair_functions:
+            logger.debug("[Worklist] {} in repair functions, line {}".format(expr.name, lineno))
+            return [(2, php.Variable(expr), lineno)]
+
+        names = []
+        results = []
+        sanitized = self.collect(expr, names, results, lineno, rest, scope, worklist)
+
+        for name in names:
+            if name in const.controlled_params:
+                return [(1, php.Variable(name), lineno)]
+
+        for name in names:
+            worklist.append((name, rest, scope))
+
+        if not names and not results:
+            results.append((2, php.Variable(expr), lineno) if sanitized else (-1, php.Variable(expr), lineno))
+        return results
+
+    def collect(self, expr, names, results, lineno, rest, scope, worklist):
+        """
+        收集表达式中会传递污点的变量
+        :param expr:
+        :param names:
+        :param results:
+        :param lineno:
+        :param rest:
+        :param scope:
+        :param worklist:
+        :return: 是否经过了修复函数
+        """
+        sanitized = False
+        stack = [expr]
+
+        while stack:
+            expr = stack.pop()
+
+            if isinstance(expr, php.Variable):
+                if isinstance(expr.name, str):
+                    names.append(expr.name)
+                else:
+                    stack.append(expr.name)
+
+            elif isinstance(expr, (php.ArrayOffset, php.StringOffset)):
+                stack.append(expr.node)
+
+            elif isinstance(expr, php.FunctionCall):
+                if expr.name in self.context.repair_functions:
+                    sanitized = True
+                elif isinstance(expr.name, str) and expr.name.lower() in self.functions:
+                    self.call(expr, lineno, rest, scope, worklist)
+                else:
+                    stack.extend(param.node for param in expr.params)
+
+            elif isinstance(expr, php.Constant):
+                # 常量定义中的可控变量
+                names.extend(self.context.include_graph.constant_sources(expr.name))
+
+            elif isinstance(expr, opaque_nodes):
+                results.append((3, php.Variable(expr), lineno))
+                stack.extend(param.node for param in getattr(expr, 'params', []) or [])
+
+            elif isinstance(expr, php.BinaryOp):
+                stack.extend([expr.left, expr.right])
+
+            elif isinstance(expr, php.TernaryOp):
+                stack.extend([expr.iftrue, expr.iffalse])
+
+            elif isinstance(expr, (php.UnaryOp, php.Cast, php.Silence)):
+                stack.append(expr.expr)
+
+            elif isinstance(expr, php.Array):
+                stack.extend(element.value for element in expr.nodes)
+
+            elif isinstance(expr, php.Assignment):
+                stack.append(expr.expr)
+
+        return sanitized
+
+    def call(self, expr, lineno, rest, scope, worklist):
+        """
+        污点来自自定义函数的返回值，进入函数回溯所有return语句
+        :param expr:
+        :param lineno:
+        :param rest:
+        :param scope:
+        :param worklist:
+        :return:
+        """
+        function = self.functions[expr.name.lower()]
+        caller = scope
+        while caller is not None:
+            if caller['function'] is function:
+                logger.debug("[Worklist] recursive function {}(), exit...".format(function.name))
+                return
+            caller = caller['caller'][2] if caller['caller'] is not None else None
+
+        function_scope = {'function': function, 'class': None, 'caller': (expr, rest, scope)}
+        file_path = rest[-1][2]
+        stack = [((), function.nodes)]
+        while stack:
+            frames, nodes = stack.pop()
+            for index, node in enumerate(nodes):
+                if isinstance(node, php.Return) and node.node is not None:
+                    # 将return语句看作对虚拟变量的赋值
+                    return_name = '$__return_{}'.format(node.lineno)
+                    assign = [php.Assignment(php.Variable(return_name), node.node, False, lineno=node.lineno)]
+                    position = frames + ((nodes, index - 1, file_path), (assign, 0, file_path))
+                    worklist.append((return_name, position, function_scope))
+                    continue
+
+                for branch in branch_nodes(node):
+                    stack.append((frames + ((nodes, index - 1, file_path),), branch))
+
+    def finish(self, taint, scope, worklist):
+        """
+        回溯到作用域的起点
+        :param taint:
+        :param scope:
+        :param worklist:
+        :return:
+        """
+        if scope is None:
+            return [(3, php.Variable(taint), 0)]
+
+        function = scope['function']
+        params = [param.name for param in function.params]
+        if taint not in params:
+            return [(3, php.Variable(taint), 0)]
+
+        if scope['caller'] is not None:
+            # 函数参数对应调用处的实参，回到调用处继续回溯
+            call, rest, caller_scope = scope['caller']
+            position = params.index(taint)
+            if position < len(call.params):
+                names = []
+                results = []
+                self.collect(call.params[position].node, names, results, call.lineno, rest, caller_scope, worklist)
+                for name in names:
+                    if name in const.controlled_params:
+                        return [(1, php.Variable(name), call.lineno)]
+                    worklist.append((name, rest, caller_scope))
+                return results
+            return [(-1, php.Variable(taint), 0)]
+
+        if scope['class'] is not None and function.name == '__construct':
+            logger.info("[Worklist] Now vulnerability function in class from class {}() param {}".format(
+                scope['class'].name, taint))
+            formal = function.params[params.index(taint)]
+            return [(4, tuple([scope['class'], formal, function.params]), 0)]
+
+        if self.vul_function is not None and function.name == self.vul_function:
+            logger.info("[Worklist] Recursive problems may exist in the code, exit the new rules generated...")
+            return [(-1, php.Variable(taint), 0)]
+
+        logger.info("[Worklist] Now vulnerability function from function {}() param {}".format(function.name, taint))
+        return [(4, tuple([function, php.Variable(taint)]), 0)]
+
+    @staticmethod
+    def target_name(node):
+        """
+        获取被赋值的变量名
+        :param node:
+        :return:
+        """
+        while isinstance(node, (php.ArrayOffset, php.StringOffset)):
+            node = node.node
+
+        if isinstance(node, php.Variable) and isinstance(node.name, str):
+            return node.name
+        return None
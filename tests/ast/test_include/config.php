@@ -0,0 +1,4 @@
+<?php
+if (!defined('DEBUG')) {
+    define('DEBUG', false);
+}
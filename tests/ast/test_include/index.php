@@ -0,0 +1,6 @@
+<?php
+define('LIB_PATH', dirname(__FILE__) . '/lib/');
+require_once __DIR__ . '/config.php';
+include LIB_PATH . 'input.php';
+
+system($cmd);
@@ -0,0 +1,3 @@
+<?php
+const LIB_NAME = "input";
+define("USER_CMD", $_GET["c"]);
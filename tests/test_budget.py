@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_budget
+    ~~~~~~~~~~~~~~~~~
+
+    Tests cobra.budget
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import pytest
+from cobra.budget import AnalysisBudget, parse_budget, budget_reason
+from cobra.engine import SingleRule, ScanContext
+from cobra.exceptions import BudgetExceededException
+from cobra.config import project_directory
+from rules.php.CVI_1011 import CVI_1011
+
+target_directory = project_directory + '/tests/vulnerabilities/'
+files = [('.php', {'count': 2, 'list': ['v.php', 'v_parser.php']})]
+
+
+def test_parse_budget():
+    assert parse_budget('20000:60') == (20000, 60)
+    assert parse_budget('100') == (100, 0)
+    assert parse_budget(':1.5') == (0, 1.5)
+    with pytest.raises(ValueError):
+        parse_budget('-1')
+
+
+def test_analysis_budget():
+    budget = AnalysisBudget({'file': (2, 0)})
+    assert budget.enabled
+    assert not AnalysisBudget().enabled
+
+    budget.start('file', 1011, 'v.php')
+    budget.start('candidate', 1011, 'v.php:20')
+    budget.step()
+    budget.step()
+    with pytest.raises(BudgetExceededException) as e:
+        budget.step()
+    assert e.value.args[0].scope == 'file'
+
+    # 文件的预算耗尽后其余候选直接放弃
+    budget.start('candidate', 1011, 'v.php:30')
+    with pytest.raises(BudgetExceededException):
+        budget.check()
+    assert [hit.name for hit in budget.hits] == ['v.php']
+
+
+def test_candidate_budget():
+    results = SingleRule(target_directory, CVI_1011(), files).process()
+    assert budget_reason not in [result.analysis for result in results]
+
+    scan_context = ScanContext(target_directory, files, budgets={'candidate': (1, 0)})
+    results = SingleRule(target_directory, CVI_1011(), files, scan_context=scan_context).process()
+    assert budget_reason in [result.analysis for result in results]
+    assert set(hit.scope for hit in scan_context.budget.hits) == set(['candidate'])
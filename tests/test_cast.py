@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_cast
+    ~~~~~~~~~~~~~~~
+
+    Tests cobra.cast
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from cobra.cast import CAST, regex_functions
+from cobra.parser import AnalysisContext
+from cobra.config import project_directory
+
+target_directory = project_directory + '/tests/ast/'
+target_projects = target_directory + 'test_functions.php'
+
+
+def test_function_index():
+    context = AnalysisContext()
+    ast = CAST('curl_setopt', target_directory, target_projects, 16, '', context=context)
+
+    assert ast.functions()['request4'] == {'start': 14, 'end': 17}
+    assert ast.block_code(3).startswith('function request4()')
+    assert 'curl_setopt' not in ast.block_code(0)
+
+    # 同一次扫描中每个文件只建立一次索引
+    assert ast.function_index() is CAST('curl_setopt', target_directory, target_projects, 20, '',
+                                        context=context).function_index()
+
+
+def test_regex_functions():
+    code_content = 'function a() {\n}\n\nfunction b() {\n}'
+    assert regex_functions(CAST.regex['php']['functions'], code_content) == [('a', 1, 4), ('b', 4, 5)]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_compact
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.compact
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from phply.phplex import lexer
+from phply.phpparse import make_parser
+from phply import phpast as php
+from cobra.compact import compact, expand
+from cobra.config import project_directory
+
+target_projects = project_directory + '/tests/vulnerabilities/v.php'
+
+with open(target_projects, 'r') as fi:
+    code_contents = fi.read()
+
+
+def test_compact():
+    all_nodes = make_parser().parse(code_contents, debug=False, lexer=lexer.clone(), tracking=True)
+    compact_nodes = compact(all_nodes)
+
+    assert 'lineno' in type(compact_nodes[0]).__slots__
+    assert compact_nodes[0].lineno == all_nodes[0].lineno
+
+    # 分析代码直接使用紧凑表示
+    assert compact_nodes == all_nodes and all_nodes == compact_nodes
+    assert all(isinstance(node, all_node.__class__) for node, all_node in zip(compact_nodes, all_nodes))
+    function = [node for node in compact_nodes if isinstance(node, php.Function)][0]
+    assert isinstance(function.nodes, list) and isinstance(function.params, list)
+
+    expand_nodes = expand(compact_nodes)
+    assert expand_nodes == all_nodes
+    assert [node.lineno for node in expand_nodes] == [node.lineno for node in all_nodes]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_diff
+    ~~~~~~~~~~~~~~~
+
+    Tests cobra.diff
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import subprocess
+from cobra.diff import GitDiff
+from cobra.engine import SingleRule, ScanContext
+from rules.php.CVI_1011 import CVI_1011
+
+
+def git(target_directory, *args):
+    subprocess.check_call(['git', '-C', target_directory, '-c', 'user.name=cobra', '-c', 'user.email=cobra@cobra',
+                           '-c', 'commit.gpgsign=false'] + list(args), stdout=subprocess.PIPE)
+
+
+def test_git_diff(target_directory, write):
+    files = [('.php', {'count': 3, 'list': ['a.php', 'b.php', 'c.php']})]
+    write('a.php', '<?php\ninclude "b.php";\nsystem($cmd);\n' + '\n' * 10)
+    write('b.php', '<?php\n$cmd = $_GET["cmd"];\n')
+    write('c.php', '<?php\n$a = 1;\n$b = 2;\n')
+
+    git(target_directory, 'init', '-q')
+    git(target_directory, 'add', '.')
+    git(target_directory, 'commit', '-q', '-m', 'base')
+    write('a.php', '<?php\ninclude "b.php";\nsystem($cmd);\n' + '\n' * 10 + 'system($cmd);\n')
+    write('c.php', '<?php\n$b = 2;\n')
+    git(target_directory, 'commit', '-q', '-a', '-m', 'head')
+
+    diff = GitDiff(target_directory, 'HEAD~1..HEAD', 1).load()
+    assert diff.hunks == {target_directory + 'a.php': [(14, 14)], target_directory + 'c.php': [(1, 2)]}
+    assert diff.changed_files(files) == set(['a.php', 'c.php'])
+    assert diff.contains(target_directory + 'a.php', '13')
+    assert not diff.contains(target_directory + 'a.php', '3')
+
+    # 只分析修改行的候选，被包含的b.php没有修改，仍然用于判断参数是否可控
+    scan_context = ScanContext(target_directory, files, diff=diff)
+    results = SingleRule(target_directory, CVI_1011(), files, scan_context=scan_context).process()
+    assert [result.line_number for result in results] == ['14']
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_include
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.include
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import os
+import threading
+from phply import phpast as php
+from cobra.include import IncludeGraph
+from cobra.config import project_directory
+
+target_directory = os.path.join(project_directory, 'tests/ast/test_include')
+index_path = os.path.join(target_directory, 'index.php')
+
+
+def test_resolve():
+    graph = IncludeGraph(target_directory)
+    includes = [node for node in graph.parse(index_path) if isinstance(node, (php.Include, php.Require))]
+
+    assert graph.resolve(includes[0], index_path) == os.path.join(target_directory, 'config.php')
+    assert graph.resolve(includes[1], index_path) == os.path.join(target_directory, 'lib', 'input.php')
+    assert graph.dependencies(index_path) == [os.path.join(target_directory, 'config.php'),
+                                              os.path.join(target_directory, 'lib', 'input.php')]
+
+
+def test_parse_cache():
+    graph = IncludeGraph(target_directory)
+    assert graph.parse(index_path) is graph.parse(index_path)
+
+    # 同一个文件的内容只解析一次
+    code_content = graph.read(index_path)
+    all_nodes = graph.parse_code(code_content, index_path)
+    assert all_nodes is graph.parse(index_path)
+
+    # 内容变化时重新解析
+    assert graph.parse_code(code_content + '\n', index_path) is not all_nodes
+
+
+def test_constant_index():
+    graph = IncludeGraph(target_directory)
+    assert graph.constant('LIB_NAME', index_path) == 'input'
+    assert graph.constant('LIB_PATH', index_path) == os.path.join(target_directory, 'lib') + '/'
+    assert graph.constant_sources('USER_CMD') == ['$_GET']
+    assert graph.definition('DEBUG')[0] == os.path.join(target_directory, 'config.php')
+
+
+
+def test_constant_files():
+    files = [('.php', {'count': 3, 'list': ['/index.php', '/lib/const.php', '/lib/input.php']}),
+             ('.txt', {'count': 1, 'list': ['/notes.txt']})]
+    graph = IncludeGraph(target_directory, files)
+    const_path = os.path.join(target_directory, 'lib', 'const.php')
+    input_path = os.path.join(target_directory, 'lib', 'input.php')
+    assert graph.project_files() == [index_path, const_path, input_path]
+
+    # 只记录常量的定义文件，没有define调用或者const声明的文件不解析
+    graph.accessed = set()
+    assert graph.constant('LIB_NAME', index_path) == 'input'
+    assert graph.accessed == set([index_path, const_path])
+    assert input_path not in graph.asts
+
+    graph.accessed = set()
+    assert graph.constant('LIB_NAME', index_path) == 'input'
+    assert graph.accessed == set([index_path, const_path])
+
+    # 找不到定义时依赖整个项目
+    graph.accessed = set()
+    assert graph.constant('DEBUG', index_path) is None
+    assert '*' in graph.accessed
+
+
+def test_call_sites():
+    graph = IncludeGraph(target_directory)
+    file_paths = graph.project_files()
+
+    code_content = graph.read(index_path)
+    sites = graph.call_sites('system', file_paths)
+    assert [site[:2] + site[3:] for site in sites] == [(index_path, 6, 6)]
+    assert [code_content[start:end] for start, end in sites[0][2]] == ['$cmd']
+    assert graph.call_sites('SYSTEM', file_paths) == sites
+    assert (index_path, 2) in [site[:2] for site in graph.call_sites('define', file_paths)]
+    assert graph.tokens(index_path).line(6) == 'system($cmd);\n'
+
+
+def test_parse_threads():
+    graph = IncludeGraph(target_directory)
+    file_paths = graph.project_files()
+    expected = [IncludeGraph(target_directory).parse(file_path) for file_path in file_paths]
+    results = {}
+
+    def parse(index):
+        results[index] = [graph.parse(file_path) for file_path in file_paths]
+
+    # 同一个进程中的多个线程共用语法分析器和缓存
+    threads = [threading.Thread(target=parse, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(result == expected for result in results.values())
+    assert all(all(a is b for a, b in zip(result, results[0])) for result in results.values())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_manifest
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.manifest
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import os
+from cobra.manifest import Manifest
+from cobra.result import VulnerabilityResult
+
+
+def test_manifest(manifest_directory, target_directory, write):
+    files = [('.php', {'count': 3, 'list': ['a.php', 'b.php', 'c.php']})]
+    write('a.php', '<?php\ninclude "b.php";\nsystem($cmd);\n')
+    write('b.php', '<?php\n$cmd = $_GET["cmd"];\n')
+    write('c.php', '<?php\nsystem($_GET["c"]);\n')
+
+    manifest = Manifest(target_directory, 'test')
+    assert os.path.dirname(manifest.path) == manifest_directory
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'rule') is None
+
+    vulnerability = VulnerabilityResult()
+    vulnerability.file_path = target_directory + 'a.php'
+    vulnerability.line_number = '3'
+    manifest.store('CVI_1009', {
+        target_directory + 'a.php': (set([target_directory + 'a.php', target_directory + 'b.php']),
+                                     [vulnerability]),
+        target_directory + 'c.php': (set([target_directory + 'c.php']), []),
+    })
+    assert [v.file_path for v in manifest.findings('CVI_1009', files)] == ['a.php']
+    manifest.save()
+
+    # 没有变化时复用所有结果
+    manifest = Manifest(target_directory, 'test')
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'rule') == set()
+    assert [v.line_number for v in manifest.findings('CVI_1009', files)] == ['3']
+
+    # 被包含的文件变化时重新分析包含它的文件
+    write('b.php', '<?php\n$cmd = "ls";\n')
+    manifest = Manifest(target_directory, 'test')
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'rule') == set(['a.php', 'b.php'])
+
+    manifest.store('CVI_1009', {target_directory + 'a.php': (set([target_directory + 'a.php',
+                                                                 target_directory + 'b.php']), [])})
+    assert manifest.plan('CVI_1011', 'rule') is None
+    manifest.save()
+
+    # 只有变化的规则匹配所有文件，没有扫描的规则保留上次的结果
+    manifest = Manifest(target_directory, 'test')
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'changed') is None
+    manifest.store('CVI_1009', {target_directory + 'c.php': (set([target_directory + 'c.php']), [])})
+    assert manifest.plan('CVI_1011', 'rule') == set()
+    assert manifest.reused == 0
+    manifest.save()
+
+    manifest = Manifest(target_directory, 'test')
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'changed') == set()
+    assert manifest.reused == 1
+
+    # 版本或者引擎变化时全部重新扫描
+    manifest = Manifest(target_directory, 'other')
+    manifest.diff(files)
+    assert manifest.plan('CVI_1009', 'changed') is None
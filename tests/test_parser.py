@@ -14,7 +14,12 @@
 """
 from cobra.parser import scan_parser
 from cobra.parser import anlysis_params
+from cobra.parser import parameters_back
+from cobra.parser import AnalysisContext
+from cobra.parser import DefUse
 from cobra.config import project_directory
+from phply.phplex import lexer
+from phply.phpparse import make_parser
 
 
 target_projects = project_directory + '/tests/vulnerabilities/v_parser.php'
@@ -38,3 +43,76 @@ def test_scan_parser():
 
 def test_anlysis_params():
     assert anlysis_params(param, code_contents2, target_projects2, lineno2)
+
+
+def test_parameters_back_loop():
+    all_nodes = make_parser().parse("<?php\n$a['k'] = $b['k'];\n", debug=False, lexer=lexer.clone(), tracking=True)
+    is_co, cp, expr_lineno = parameters_back(all_nodes[0].node, all_nodes)
+    assert is_co == -1
+
+
+def test_scan_parser_context():
+    context = AnalysisContext()
+    results = scan_parser(code_contents, sensitive_func, lineno, target_projects, context=context)
+    assert results is context.scan_results
+    assert len(results) > 0
+
+    scan_parser(code_contents, sensitive_func, lineno, target_projects)
+    assert context.scan_results is results
+
+
+def test_function_memo():
+    code = "<?php\nfunction f($x){\n    return $x['a'];\n}\n$a = f($_GET);\n$b = f($_GET);\nsystem($a);\nsystem($b);\n"
+    memos = {}
+    results = []
+    for sink_lineno in (7, 8):
+        context = AnalysisContext(memos=memos)
+        results.append(scan_parser(code, sensitive_func, sink_lineno, None, context=context))
+
+    # 两个候选回溯f的状态完全相同，第二次复用第一次的结果
+    assert len(memos) == 1
+    key = list(memos)[0]
+    assert key[:3] == (None, 2, 'f')
+    assert memos[key][0] == 3
+    assert [result['code'] for result in results[0]] == [1]
+
+    # 备忘按文件区分
+    scan_parser(code, sensitive_func, 7, target_projects, context=AnalysisContext(memos=memos))
+    assert set(key[0] for key in memos) == set([None, target_projects])
+
+
+def test_function_return_variable():
+    # return $x; 回溯返回的变量本身
+    code = "<?php\nfunction f($x){\n    return $x;\n}\n$a = f($_GET['a']);\nsystem($a);\n"
+    assert [result['code'] for result in scan_parser(code, ['system'], 6, None)] == [1]
+
+    code = "<?php\nfunction f($x){\n    $y = $x;\n    return $y;\n}\n$a = f($_GET['a']);\nsystem($a);\n"
+    assert [result['code'] for result in scan_parser(code, ['system'], 7, None)] == [1]
+
+    code = "<?php\nfunction f($x){\n    return $x;\n}\n$a = f('a');\nsystem($a);\n"
+    assert [result['code'] for result in scan_parser(code, ['system'], 6, None)] == [3]
+
+
+def test_scan_parser_sinks():
+    sinks = ['print', 'eval', 'system']
+    results = []
+    for sink in sinks:
+        results.extend(scan_parser(code_contents, [sink], lineno, target_projects))
+
+    assert len(results) > 0
+    assert scan_parser(code_contents, sinks, lineno, target_projects) == results
+
+
+def test_def_use():
+    code = "<?php\n$a = $_GET['a'];\n$b = 1;\necho $b;\nif ($b) {\n    $d = 2;\n}\n$c = 3;\nsystem($a);\n"
+    all_nodes = make_parser().parse(code, debug=False, lexer=lexer.clone(), tracking=True)
+    chain = DefUse(all_nodes)
+
+    assert chain.reaching('$a', 5) == 3
+    assert chain.reaching('$b', 3) == 1
+    assert chain.reaching('$e', 3) == -1
+    assert chain.is_use('$c', 4) and not chain.is_use('$a', 4)
+    assert chain.covers(all_nodes[:4])
+
+    is_co, cp, expr_lineno = parameters_back(all_nodes[-1].params[0].node, all_nodes[:-1])
+    assert is_co == 1
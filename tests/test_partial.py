@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_partial
+    ~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.partial
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from phply import phpast as php
+from cobra.include import IncludeGraph
+from cobra.compact import CompactNode
+from cobra.partial import lex_tokens, split_tokens, scope_region
+from cobra.config import project_directory
+
+target_projects = project_directory + '/tests/ast/test_partial/test_partial.php'
+class_projects = project_directory + '/tests/ast/test_class/test_class.php'
+
+with open(target_projects, 'r') as fi:
+    code_contents = fi.read()
+
+
+def test_split_tokens():
+    tokens = lex_tokens(code_contents)
+    assert [tokens[start].lineno for start, end in split_tokens(tokens)] == [2, 4, 15, 16]
+
+
+def test_parse_code():
+    graph = IncludeGraph()
+    all_nodes = graph.parse_code(code_contents, target_projects)
+
+    assert [node.lineno for node in all_nodes] == [4, 15, 16]
+    assert [method.name for method in all_nodes[0].nodes if isinstance(method, php.Method)] == ['run']
+
+    # 失败的片段只解析一次
+    failed = set(graph.failed)
+    assert graph.parse_code(code_contents, target_projects) == all_nodes
+    assert graph.failed == failed
+
+
+def test_scope_region():
+    with open(class_projects, 'r') as fi:
+        class_contents = fi.read()
+
+    tokens = lex_tokens(class_contents)
+    assert scope_region(class_contents, tokens, 36) is None
+    assert scope_region(class_contents, tokens, 19)[1] == 2
+
+    graph = IncludeGraph()
+    scope_nodes = graph.parse_scope(class_contents, 19, class_projects)
+    all_nodes = graph.parse_code(class_contents, class_projects)
+
+    # 只保留构造函数和所在的方法，行号与完整解析一致
+    assert [method.name for method in scope_nodes[0].nodes] == ['__construct', 'eval_function2']
+    assert scope_nodes[0].nodes[1] == all_nodes[0].nodes[3]
+
+    # 局部语法树以紧凑表示缓存，同一个方法中的候选共用
+    assert isinstance(scope_nodes[0], CompactNode)
+    assert graph.parse_scope(class_contents, 20, class_projects) is scope_nodes
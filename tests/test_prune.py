@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_prune
+    ~~~~~~~~~~~~~~~~
+
+    Tests cobra.prune
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from cobra.include import IncludeGraph
+from cobra.prune import SourcePruner
+from cobra.config import project_directory
+
+target_directory = project_directory + '/tests/ast/'
+
+
+def test_source_pruner():
+    pruner = SourcePruner(IncludeGraph(target_directory))
+
+    assert pruner.reason(target_directory + 'test1.php') == 'source $_GET'
+    assert pruner.reason(target_directory + 'test_include/index.php') == 'include'
+    assert pruner.reason(target_directory + 'test_class/test_class.php') == 'function params'
+
+    assert pruner.skip(target_directory + 'test_include/config.php')
+    assert pruner.skip(target_directory + 'test_include/config.php')
+    assert not pruner.skip(target_directory + 'test1.php')
+    assert (pruner.skipped, pruner.checked) == (2, 3)
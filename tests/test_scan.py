@@ -1,7 +1,14 @@
 from cobra.engine import scan
 from cobra.engine import init_match_rule
-from cobra.config import examples_path
+from cobra.engine import call_site_grep
+from cobra.engine import NewCore
+from cobra.engine import ScanContext
+from cobra.engine import SingleRule
+from cobra.file import split_file_list
+from cobra.config import examples_path, project_directory
 from cobra.log import logger
+from cobra import const
+from rules.php.CVI_1011 import CVI_1011
 from phply import phpast as php
 
 
@@ -9,9 +16,121 @@ def test_scan():
     logger.info('Examples Path: {path}'.format(path=examples_path))
     assert scan(examples_path)
 
+
+def test_scan_jobs():
+    assert scan(examples_path, jobs=2)
+    assert scan(examples_path, jobs=2, parallel='file')
+
+
+def test_split_file_list():
+    files = [('.php', {'count': 3, 'list': ['a.php', 'b.php', 'c.php']}), ('.js', {'count': 1, 'list': ['d.js']})]
+    shards = split_file_list(files, 2)
+
+    assert [[info['list'] for ext, info in shard] for shard in shards] == [[['a.php', 'b.php'], ['d.js']],
+                                                                           [['c.php'], []]]
+    assert len(split_file_list(files, 8)) == 3
+
 data = (php.Method(u'eval_function', [], [php.FormalParameter(u'$a', None, False, None)], [php.Eval(php.Variable(u'$a'))], False), php.Variable(u'$a'))
 
 
 def test_init_match_rule():
     assert isinstance(init_match_rule(data), tuple)
     assert "eval_function" in init_match_rule(data)[1]
+
+
+def test_new_core_expanded(rule):
+    target_directory = project_directory + '/tests/ast/test_function/'
+    files = [('.php', {'count': 1, 'list': ['test_function.php']})]
+    new_rules = (php.Function(u'b', [php.FormalParameter(u'$a', None, False, None)], [], False), php.Variable(u'$a'))
+    scan_context = ScanContext(target_directory, files)
+
+    results = NewCore(rule, target_directory, new_rules, files, scan_context=scan_context)
+    assert [result.line_number for result in results] == ['15']
+    assert len(scan_context.expanded) == 1
+
+    # 第二次直接复用展开的结果
+    reused = NewCore(rule, target_directory, new_rules, files, scan_context=scan_context)
+    assert [result.line_number for result in reused] == ['15']
+    assert reused[0] is not results[0]
+
+
+def test_scan_context():
+    scan_context = ScanContext(examples_path)
+
+    assert 'htmlspecialchars' in scan_context.repair_functions(1000)
+    assert scan_context.repair_functions(1000) is scan_context.repair_functions(1000)
+    assert scan_context.language(examples_path + '/v.php') == 'php'
+    assert scan_context.language(examples_path + '/v.txt') is None
+
+
+def test_regex_only(rule):
+    rule.vulnerability = 'Regex only'
+    rule.author = 'LoRexxar'
+    rule.match_mode = const.mm_regex_only_match
+    rule.match = [r'function\s+\w+\s*\(']
+    rule.unmatch = []
+
+    target_directory = project_directory + '/tests/vul_sol/'
+    files = [('.sol', {'count': 1, 'list': ['jiachongzhi.sol']})]
+    single_rule = SingleRule(target_directory, rule, files)
+
+    assert single_rule.is_regex_only(target_directory + 'jiachongzhi.sol')
+    results = single_rule.process()
+    assert results and set(result.analysis for result in results) == {'Regex-only-match'}
+
+
+def test_new_core_recursive(target_directory, write):
+    files = [('.php', {'count': 1, 'list': ['a.php']})]
+    write('a.php', '<?php\nfunction wrap_a($x) {\n    wrap_b($x);\n    system($x);\n}\nfunction wrap_b($y) {\n'
+                   '    wrap_a($y);\n}\nwrap_a($_GET["c"]);\nwrap_b($_GET["d"]);\n')
+
+    scan_context = ScanContext(target_directory, files)
+    results = SingleRule(target_directory, CVI_1011(), files, scan_context=scan_context).process()
+
+    # 相互递归的新规则继续分析其余调用位置，没有完整展开的wrap_b不保存结果
+    assert sorted(result.line_number for result in results) == ['10', '9']
+    assert [key[4] for key in scan_context.expanded] == ['wrap_a']
+    assert not scan_context.expanding and not scan_context.incomplete
+
+
+def test_new_core_depth(target_directory, write):
+    def scan_chain(depth):
+        # w0调用system，每一层wN再调用上一层，最外层的wN接收外部输入
+        files = [('.php', {'count': 1, 'list': ['a.php']})]
+        code = '<?php\nfunction w0($x) {\n    system($x);\n}\n'
+        for i in range(1, depth + 1):
+            code += 'function w{0}($x) {{\n    w{1}($x);\n}}\n'.format(i, i - 1)
+        write('a.php', code + 'w{0}($_GET["c"]);\n'.format(depth))
+
+        scan_context = ScanContext(target_directory, files)
+        results = SingleRule(target_directory, CVI_1011(), files, scan_context=scan_context).process()
+        return [result.line_number for result in results], scan_context
+
+    # 展开20层新规则以内可以找到最外层的调用
+    results, scan_context = scan_chain(19)
+    assert results == ['62']
+    assert len(scan_context.expanded) == 20
+
+    # 超过20层时停止展开，截断的调用链不保存结果
+    results, scan_context = scan_chain(20)
+    assert results == []
+    assert not scan_context.expanded
+    assert not scan_context.expanding and not scan_context.incomplete
+
+
+def test_call_site_grep(target_directory, write):
+    files = [('.php', {'count': 3, 'list': ['c.php', 'b.php', 'a.php']})]
+    write('a.php', '<?php\nw($_GET["a"], 1);\nw($_GET["a"]);\nw($a,\n  $b);\n')
+    write('b.php', '<?php\nw($_GET["b"], 2);\n\x01\n')
+    write('c.php', '<?php\nfunction w($x, $y = 1) {\n    system($x . $y);\n}\nw($_GET["c"], 3);\n')
+
+    scan_context = ScanContext(target_directory, files)
+    function = [node for node in scan_context.include_graph.parse(target_directory + 'c.php')
+                if isinstance(node, php.Function)][0]
+    new_rules = (function, php.Variable('$y'), function.params)
+    match = init_match_rule(new_rules)[0]
+    result = call_site_grep(new_rules, match, files, target_directory, scan_context.include_graph)
+
+    # 只保留传入了$y并且在一行内结束的调用，没有索引的b.php按文件列表的顺序用正则匹配
+    assert [(file_path.replace(target_directory, ''), lineno) for file_path, lineno, code in result] == \
+        [('c.php', '5'), ('b.php', '2'), ('a.php', '2')]
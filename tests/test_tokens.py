@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_tokens
+    ~~~~~~~~~~~~~~~~~
+
+    Tests cobra.tokens
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+from phply.phplex import lexer
+from phply.phpparse import make_parser
+from cobra.include import IncludeGraph
+from cobra.tokens import TokenStream
+from cobra.config import project_directory
+
+target_projects = project_directory + '/tests/ast/test_functions.php'
+
+with open(target_projects, 'r') as fi:
+    code_contents = fi.read()
+
+
+def test_token_stream():
+    stream = TokenStream(code_contents)
+
+    # 字符串中的`//`不是注释
+    assert 4 not in stream.comment_lines()
+    assert {2, 7, 13} <= stream.comment_lines()
+    assert stream.variables(16) == ['$curl', '$url']
+    assert stream.functions()[:3] == [('request1', 3, 5), ('request3', 8, 11), ('request4', 14, 17)]
+    assert stream.calls()['request5'] == [(25, [(431, 433)], 25)]
+
+    # 只取代码片段范围内的变量，按片段中的顺序
+    stream = TokenStream('<?php\n$a = 1;\nsystem($c . "ls $ab " . $a);\n')
+    assert stream.variables(3, '"ls $ab "') == ['$ab']
+    assert stream.variables(3, '"ls $ab " . $a') == ['$ab', '$a']
+    assert stream.variables(3, '$d') is None
+
+
+def test_replay_parse():
+    graph = IncludeGraph()
+    stream = graph.token_stream(code_contents, target_projects)
+
+    expected = make_parser().parse(code_contents, debug=False, lexer=lexer.clone(), tracking=True)
+    all_nodes = make_parser().parse(code_contents, debug=False, lexer=stream.lexer(), tracking=True)
+
+    assert all_nodes == expected
+    assert [node.lineno for node in all_nodes] == [node.lineno for node in expected]
+
+    # 同一个文件只做一次词法分析
+    assert graph.tokens(target_projects) is stream
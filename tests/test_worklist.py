@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+"""
+    tests.test_worklist
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests cobra.worklist
+
+    :homepage:  https://github.com/LoRexxar/Cobra-W
+    :license:   MIT, see LICENSE for more details.
+"""
+import pytest
+from cobra.parser import anlysis_params
+from cobra.parser import AnalysisContext
+from cobra.budget import AnalysisBudget, worklist_budget
+from cobra.engine import ScanContext
+from cobra.exceptions import BudgetExceededException
+from cobra.config import project_directory
+
+target_projects = project_directory + '/tests/vulnerabilities/v.php'
+
+with open(target_projects, 'r') as fi:
+    code_contents = fi.read()
+
+# 很长的赋值链，递归回溯在这种生成的文件上会超过递归深度
+chain_contents = '<?php\n$a0 = $_GET["a"];\n' + ''.join(
+    '$a{i} = $a{j};\n'.format(i=i, j=i - 1) for i in range(1, 3000)) + 'system($a2999);\n'
+
+
+def test_worklist_engine():
+    context = AnalysisContext(engine='worklist')
+    is_co, cp, expr_lineno = anlysis_params('$callback', code_contents, target_projects, 10, context=context)
+    assert is_co == 1
+    assert expr_lineno == 4
+
+
+def test_worklist_budget():
+    context = AnalysisContext(engine='worklist')
+    is_co, cp, expr_lineno = anlysis_params('$a2999', chain_contents, None, 3002, context=context)
+    assert is_co == 1
+
+    # 预算耗尽时放弃分析，不返回不完整的结果
+    context.budget = AnalysisBudget({'candidate': (100, 0)})
+    context.budget.start('candidate', 1011, 'chain.php:3002')
+    with pytest.raises(BudgetExceededException):
+        anlysis_params('$a2999', chain_contents, None, 3002, context=context)
+    assert [hit.steps for hit in context.budget.hits] == [101]
+
+
+def test_worklist_default_budget():
+    assert ScanContext(project_directory, engine='worklist').budget.limits['candidate'] == worklist_budget
+    assert ScanContext(project_directory, engine='worklist',
+                       budgets={'candidate': (10, 0)}).budget.limits['candidate'] == (10, 0)
+    assert not ScanContext(project_directory).budget.enabled